@@ -0,0 +1,304 @@
+# Description: This program is a computer opponent for KubaGame. It contains the following classes:
+# TranspositionTable - a size bounded table of search results keyed by the game position
+# KubaSearch - a negamax alpha-beta search with iterative deepening and a time budget. Returns the best move for the
+#              player to move and keeps statistics (depth reached, nodes searched, nodes per second) for the last
+#              search.
+
+import time
+
+import KubaGame
+
+
+# scores at or beyond WIN_SCORE - MAX_PLY mean a forced win (or loss) was found
+WIN_SCORE = 1000000
+MAX_PLY = 1000
+
+# evaluation weights for each neutral marble captured and each marble of your color left on the board
+CAPTURE_WEIGHT = 12
+MARBLE_WEIGHT = 10
+
+# transposition table bound flags
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# how many nodes are searched between checks of the clock
+CLOCK_CHECK_NODES = 64
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time budget runs out."""
+    pass
+
+
+class TranspositionTable:
+    """Represents a size bounded table of search results. Entries are keyed by the board, the Ko reference board, the
+    player to move and both captured counts, and hold (depth, score, bound flag, best move). Once the table is full the
+    oldest entry is dropped for each new one."""
+
+    def __init__(self, max_entries=200000):
+        """Creates an empty table that holds at most max_entries entries."""
+        self._max_entries = max_entries
+        self._entries = {}
+
+    def __len__(self):
+        """Returns the number of entries in the table."""
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the entry stored for the key, or None if there is no entry."""
+        return self._entries.get(key)
+
+    def store(self, key, entry):
+        """Stores an entry for the key, dropping the oldest entry if the table is full."""
+        entries = self._entries
+        if key not in entries and len(entries) >= self._max_entries:
+            del entries[next(iter(entries))]
+        entries[key] = entry
+
+    def clear(self):
+        """Removes all entries from the table."""
+        self._entries.clear()
+
+
+class KubaSearch:
+    """Represents a computer player that searches the game tree. Uses negamax alpha-beta search with iterative
+    deepening, move ordering (the table move, then captures) and a transposition table. Positions covered by an
+    endgame tablebase (KubaTablebase), if one is given, are scored exactly without searching them. Contains methods as
+    follows: search, evaluate, get_depth, get_nodes, get_elapsed, get_nodes_per_second, get_score, and get_best_move."""
+
+    def __init__(self, time_ms=1000, max_depth=64, table_entries=200000, tablebase=None):
+        """Creates a new search. Takes the time budget per search in milliseconds, the deepest iteration to run, the
+        number of transposition table entries to keep and an optional open KubaTablebase to probe."""
+        self._time_ms = time_ms
+        self._max_depth = max_depth
+        self._table = TranspositionTable(table_entries)
+        self._tablebase = tablebase
+        self._deadline = None
+        self._nodes = 0
+        self._depth = 0
+        self._score = 0
+        self._elapsed = 0.0
+        self._best_move = None
+
+    def get_depth(self):
+        """Returns the deepest iteration completed by the last search."""
+        return self._depth
+
+    def get_nodes(self):
+        """Returns the number of nodes visited by the last search."""
+        return self._nodes
+
+    def get_elapsed(self):
+        """Returns the wall clock time of the last search in seconds."""
+        return self._elapsed
+
+    def get_nodes_per_second(self):
+        """Returns the nodes visited per second by the last search."""
+        if self._elapsed == 0:
+            return 0.0
+        return self._nodes / self._elapsed
+
+    def get_score(self):
+        """Returns the score of the best move from the last search, from the point of view of the player that moved."""
+        return self._score
+
+    def get_best_move(self):
+        """Returns the best move from the last search as (coord, direction), or None if there was no legal move."""
+        return self._best_move
+
+    def search(self, game, player_name, time_ms=None):
+        """Takes a KubaGame, the name of the player to move and an optional time budget in milliseconds (the budget
+        given when the search was created is used otherwise). Searches one ply deeper at a time until the time runs
+        out and returns the best move found by the deepest completed iteration as (coord, direction), or None if the
+        player has no legal move or it isn't their turn. The game is left as it was passed in."""
+        if time_ms is None:
+            time_ms = self._time_ms
+        start = time.perf_counter()
+        self._deadline = start + time_ms / 1000
+        self._nodes = 0
+        self._depth = 0
+        self._score = 0
+        self._best_move = None
+
+        # moves can only be searched (made and taken back) when it is the player's turn
+        if not game.get_player_by_name(player_name).get_turn():
+            self._elapsed = time.perf_counter() - start
+            return None
+
+        # moves are made and taken back on a copy, so the game's own move history isn't changed
+        game = game.copy_game()
+        names = game.get_player_names()
+        opponent_name = names[1] if names[0] == player_name else names[0]
+        root_moves = list(game.legal_moves(player_name))
+        if root_moves:
+            # always have a move to return, even if the first iteration doesn't finish
+            self._best_move = root_moves[0]
+
+        try:
+            for depth in range(1, self._max_depth + 1):
+                score = self._negamax(game, player_name, opponent_name, depth, 0, -WIN_SCORE - 1, WIN_SCORE + 1)
+                entry = self._table.get(self._table_key(game, player_name))
+                if entry is not None and entry[3] is not None:
+                    self._best_move = entry[3]
+                self._depth = depth
+                self._score = score
+                # stop early once the result is decided or there is only one move to make
+                if abs(score) >= WIN_SCORE - MAX_PLY or len(root_moves) <= 1:
+                    break
+        except SearchTimeout:
+            # every move made during the interrupted iteration has already been taken back
+            pass
+        self._elapsed = time.perf_counter() - start
+        return self._best_move
+
+    def evaluate(self, game, player_name, opponent_name):
+        """Returns a static score of the board from the point of view of player_name: captured neutral marbles and
+        marbles left on the board for that player, minus the same for the opponent."""
+        counts = game.get_marble_count()
+        color = game.get_player_by_name(player_name).get_marble_color()
+        own_marbles, opponent_marbles = (counts[0], counts[1]) if color == "W" else (counts[1], counts[0])
+        captured_difference = game.get_captured(player_name) - game.get_captured(opponent_name)
+        return CAPTURE_WEIGHT * captured_difference + MARBLE_WEIGHT * (own_marbles - opponent_marbles)
+
+    def _table_key(self, game, player_name):
+        """Returns the transposition table key for the game with player_name to move."""
+        names = game.get_player_names()
+        return (game.position_key(), game.prev_position_key(), player_name,
+                game.get_captured(names[0]), game.get_captured(names[1]))
+
+    def _ordered_moves(self, game, player_name, table_move):
+        """Returns the legal moves for player_name with the table move first, then moves that push a marble off the
+        board, then the rest."""
+        player = game.get_player_by_name(player_name)
+        captures = []
+        quiet = []
+        for move in game.legal_moves(player_name):
+            if move == table_move:
+                continue
+            if game.check_move(player, move[0], move[1])[1] is not None:
+                captures.append(move)
+            else:
+                quiet.append(move)
+        if table_move is not None and game.move_permission(player, table_move[0], table_move[1]):
+            captures.insert(0, table_move)
+        return captures + quiet
+
+    def _negamax(self, game, player_name, opponent_name, depth, ply, alpha, beta):
+        """Searches the game to the depth given and returns the score from the point of view of player_name, who is
+        to move. Raises SearchTimeout if the time budget runs out."""
+        self._nodes += 1
+        if self._nodes % CLOCK_CHECK_NODES == 0 and time.perf_counter() >= self._deadline:
+            raise SearchTimeout
+
+        winner = game.get_winner()
+        if winner is not None:
+            return WIN_SCORE - ply if winner == player_name else ply - WIN_SCORE
+        if self._tablebase is not None and ply > 0:
+            # the root is searched anyway so that there is a move to return
+            result = self._tablebase.probe(game, player_name)
+            if result is not None:
+                if result[0] == "win":
+                    return WIN_SCORE - ply - result[1]
+                if result[0] == "loss":
+                    return ply + result[1] - WIN_SCORE
+                return 0
+        if depth == 0:
+            return self.evaluate(game, player_name, opponent_name)
+
+        key = self._table_key(game, player_name)
+        entry = self._table.get(key)
+        table_move = None
+        if entry is not None:
+            entry_depth, entry_score, entry_flag, table_move = entry
+            if entry_depth >= depth:
+                entry_score = _score_from_table(entry_score, ply)
+                if entry_flag == EXACT:
+                    return entry_score
+                if entry_flag == LOWER_BOUND and entry_score >= beta:
+                    return entry_score
+                if entry_flag == UPPER_BOUND and entry_score <= alpha:
+                    return entry_score
+
+        moves = self._ordered_moves(game, player_name, table_move)
+        if not moves:
+            # get_winner normally catches this, but a player with no moves has lost
+            return ply - WIN_SCORE
+
+        original_alpha = alpha
+        best_score = -WIN_SCORE - 1
+        best_move = None
+        for move in moves:
+            game.make_move(player_name, move[0], move[1])
+            try:
+                score = -self._negamax(game, opponent_name, player_name, depth - 1, ply + 1, -beta, -alpha)
+            finally:
+                # take the move back even when the search is interrupted
+                game.undo_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self._table.store(key, (depth, _score_to_table(best_score, ply), flag, best_move))
+        return best_score
+
+
+def _score_to_table(score, ply):
+    """Converts a win or loss score measured from the root into one measured from the current node for storage."""
+    if score >= WIN_SCORE - MAX_PLY:
+        return score + ply
+    if score <= MAX_PLY - WIN_SCORE:
+        return score - ply
+    return score
+
+
+def _score_from_table(score, ply):
+    """Converts a stored win or loss score measured from its node back into one measured from the root."""
+    if score >= WIN_SCORE - MAX_PLY:
+        return score - ply
+    if score <= MAX_PLY - WIN_SCORE:
+        return score + ply
+    return score
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Plays KubaSearch against itself and reports search statistics.")
+    parser.add_argument("--time-ms", type=int, default=500, help="time budget per move in milliseconds")
+    parser.add_argument("--max-moves", type=int, default=200, help="stop the game after this many moves")
+    parser.add_argument("--tablebase", help="endgame tablebase file to probe (see KubaTablebase.py)")
+    arguments = parser.parse_args()
+
+    endgame_table = None
+    if arguments.tablebase:
+        import KubaTablebase
+        endgame_table = KubaTablebase.KubaTablebase(arguments.tablebase)
+
+    game = KubaGame.KubaGame(("Player 1", "W"), ("Player 2", "B"))
+    bots = {"Player 1": KubaSearch(arguments.time_ms, tablebase=endgame_table),
+            "Player 2": KubaSearch(arguments.time_ms, tablebase=endgame_table)}
+    player_name = "Player 1"
+    for move_number in range(arguments.max_moves):
+        if game.get_winner() is not None:
+            break
+        bot = bots[player_name]
+        move = bot.search(game, player_name)
+        if move is None:
+            break
+        game.make_move(player_name, move[0], move[1])
+        print("%3d %-8s %s %s depth %2d score %7d nodes %7d %8.0f nodes/s %6.1f ms" % (
+            move_number + 1, player_name, move[0], move[1], bot.get_depth(), bot.get_score(), bot.get_nodes(),
+            bot.get_nodes_per_second(), bot.get_elapsed() * 1000))
+        player_name = "Player 2" if player_name == "Player 1" else "Player 1"
+    print("winner:", game.get_winner())
@@ -0,0 +1,396 @@
+# Description: This program plays many games of Kuba at once for generating self-play data. It contains the
+# KubaBatch class, which holds N games as stacked NumPy arrays and works out the legal moves, pushes, captures, the Ko
+# rule, and the winner conditions of KubaGame.get_winner for every game with array operations. A cross-check mode
+# plays every game through KubaGame as well and stops at the first difference.
+#
+# Boards are int8 arrays of shape (N, 7, 7) holding EMPTY, WHITE, BLACK or RED. Moves are numbered
+# direction * 49 + row * 7 + col with the directions in the order L, R, F, B. Every push is worked out in a "view" of
+# the board that is flipped and/or transposed so that the push goes to the right along the last axis. Each line of
+# that view is given a code (4 ** 7 possible lines), and pushes, captures and legal start columns come from lookup
+# tables indexed by the code.
+
+import time
+
+import numpy as np
+
+import KubaGame
+
+
+EMPTY = 0
+WHITE = 1
+BLACK = 2
+RED = 3
+
+SIZE = 7
+DIRECTIONS = "LRFB"
+NUM_MOVES = len(DIRECTIONS) * SIZE * SIZE
+
+# the board values for each marble color used by KubaGame
+COLOR_VALUES = {"W": WHITE, "B": BLACK, "R": RED}
+
+# the opening board from KubaGame.Board
+OPENING = np.array([[COLOR_VALUES.get(space, EMPTY) for space in row]
+                    for row in KubaGame.Board().get_current_board()], dtype=np.int8)
+
+# column and start column index grids used to shift a line for every possible start column at once
+_COLUMNS = np.arange(SIZE)
+_STARTS = np.arange(SIZE)[:, None]
+
+# bit weights that turn a board into KubaGame position bitmasks
+_BIT_WEIGHTS = (np.int64(1) << np.arange(SIZE * SIZE, dtype=np.int64)).reshape(SIZE, SIZE)
+
+
+class CrossCheckError(Exception):
+    """Raised in cross-check mode when the batch engine and KubaGame disagree."""
+    pass
+
+
+def _view(boards, direction):
+    """Returns a view of the boards (the board in the last two axes) oriented so that a push in the direction given
+    (an index into DIRECTIONS) moves the marbles to the right along the last axis. Writing to the view writes to the
+    boards."""
+    if direction == 0:
+        return boards[..., ::-1]
+    if direction == 1:
+        return boards
+    if direction == 2:
+        return boards.swapaxes(-1, -2)[..., ::-1]
+    return boards.swapaxes(-1, -2)
+
+
+def _first_empty(view):
+    """Returns, for every space of the oriented boards, the column of the first blank space at or to the right of it
+    in its row (SIZE if the row is full to the edge)."""
+    empty = view == EMPTY
+    first = np.empty(view.shape, dtype=np.int8)
+    following = np.full(view.shape[:-1], SIZE, dtype=np.int8)
+    for col in range(SIZE - 1, -1, -1):
+        following = np.where(empty[..., col], col, following)
+        first[..., col] = following
+    return first
+
+
+def _shifted_rows(rows, starts, first):
+    """Returns the rows after a push to the right that starts at column starts and runs up to the blank space at
+    column first (SIZE when the last marble falls off). The inputs broadcast against each other with the columns of
+    the row in the last axis."""
+    shifted = np.zeros_like(rows)
+    shifted[..., 1:] = rows[..., :-1]
+    return np.where(_COLUMNS < starts, rows,
+                    np.where(_COLUMNS == starts, EMPTY,
+                             np.where(_COLUMNS <= first, shifted, rows)))
+
+
+def _line_codes(view):
+    """Returns the code of every line (last axis) of the oriented boards: the sum of value * 4 ** column."""
+    return (view.astype(np.int32) * _CODE_WEIGHTS).sum(axis=-1)
+
+
+def _build_line_tables():
+    """Returns lookup tables indexed by line code (and start column) for a push to the right along one line: the
+    values of each line, the code of the reversed line, the count of each marble value in the line, the code of the
+    line after a push from each start column, the value of the marble knocked off by that push, and for each marble
+    color a 7-bit mask of the start columns the player with that color may push from (leaving out the Ko rule)."""
+    codes = np.arange(NUM_LINE_CODES, dtype=np.int32)
+    values = ((codes[:, None] >> (2 * _COLUMNS)) & 3).astype(np.int8)
+    reversed_codes = _line_codes(values[:, ::-1])
+    value_counts = np.stack([(values == value).sum(axis=1) for value in range(RED + 1)]).astype(np.int8)
+    first = _first_empty(values)
+    pushed = _shifted_rows(values[:, None, :], _STARTS, first[:, :, None])
+    next_codes = _line_codes(pushed)
+    fallen = np.where(first == SIZE, values[:, -1:], EMPTY).astype(np.int8)
+
+    behind_blank = np.ones(values.shape, dtype=bool)
+    behind_blank[:, 1:] = values[:, :-1] == EMPTY
+    start_masks = np.zeros((RED + 1, NUM_LINE_CODES), dtype=np.int16)
+    for color in (WHITE, BLACK):
+        allowed = (values == color) & behind_blank & (fallen != color)
+        start_masks[color] = (allowed << _COLUMNS).sum(axis=1)
+    return values, reversed_codes, value_counts, next_codes, fallen, start_masks
+
+
+def _build_mask_tables():
+    """Returns lookup tables for 7-bit start masks: the number of set bits of each mask, and the column of the n-th set
+    bit of each mask."""
+    masks = np.arange(2 ** SIZE)
+    bits = (masks[:, None] >> _COLUMNS) & 1
+    set_bits = bits.sum(axis=1)
+    nth_bit = np.zeros((2 ** SIZE, SIZE), dtype=np.int8)
+    for mask in range(2 ** SIZE):
+        columns = np.nonzero(bits[mask])[0]
+        nth_bit[mask, :len(columns)] = columns
+    return set_bits, nth_bit
+
+
+def _build_move_numbers():
+    """Returns an array of shape (4, 7, 7) holding the move number for every (direction, line, start column) of the
+    oriented views."""
+    numbers = np.arange(NUM_MOVES).reshape(len(DIRECTIONS), SIZE, SIZE)
+    return np.stack([_view(numbers[direction], direction) for direction in range(len(DIRECTIONS))])
+
+
+_CODE_WEIGHTS = (4 ** np.arange(SIZE)).astype(np.int32)
+NUM_LINE_CODES = 4 ** SIZE
+_LINE_VALUES, _REVERSED_CODES, _VALUE_COUNTS, _NEXT_CODES, _FALLEN, _START_MASKS = _build_line_tables()
+_SET_BITS, _NTH_BIT = _build_mask_tables()
+_MOVE_NUMBERS = _build_move_numbers()
+_MOVE_SLOTS = np.argsort(_MOVE_NUMBERS.ravel())         # the (direction * 7 + line) * 7 + start of each move number
+
+
+def line_codes(boards):
+    """Returns an array of shape (N, 4, 7) with the code of every line of every board in the orientation of each
+    direction (see _view)."""
+    row_codes = (boards.astype(np.int32) * _CODE_WEIGHTS).sum(axis=2)
+    col_codes = (boards.astype(np.int32) * _CODE_WEIGHTS[:, None]).sum(axis=1)
+    return np.stack([_REVERSED_CODES[row_codes], row_codes, _REVERSED_CODES[col_codes], col_codes], axis=1)
+
+
+def start_masks(codes, prev_codes, has_prev, color):
+    """Returns an array of shape (N, 4, 7) holding, for every direction and line of the oriented views, a 7-bit mask
+    of the start columns the player with the marble color given (a scalar or one value per game) may push from. Takes
+    the line codes of the boards and of the previous boards. Applies the same rules as KubaGame.check_move: the marble
+    pushed must be the player's, the space behind it must be blank or off the board, the push can't knock off the
+    player's own color, and it can't recreate the previous board (when has_prev)."""
+    color = np.asarray(color).reshape(-1, 1, 1)
+    masks = _START_MASKS[color, codes]
+
+    # the Ko rule: a push along a line can only recreate the previous board if every other line already matches
+    lines_equal = codes == prev_codes
+    others_equal = (lines_equal.sum(axis=2, keepdims=True) - lines_equal) == SIZE - 1
+    games, directions, lines = np.nonzero(has_prev[:, None, None] & others_equal & (masks != 0))
+    if len(games):
+        repeats = _NEXT_CODES[codes[games, directions, lines]] == prev_codes[games, directions, lines][:, None]
+        masks[games, directions, lines] &= ~(repeats << _COLUMNS).sum(axis=1).astype(np.int16)
+    return masks
+
+
+def masks_to_legal(masks):
+    """Turns start masks from start_masks into a boolean array of shape (N, NUM_MOVES) marking the legal moves."""
+    legal = np.zeros((masks.shape[0], NUM_MOVES), dtype=bool)
+    legal[:, _MOVE_NUMBERS] = (masks[..., None] >> _COLUMNS) & 1
+    return legal
+
+
+def legal_move_mask(boards, prev_boards, has_prev, colors):
+    """Returns a boolean array of shape (N, NUM_MOVES) marking the legal moves of a player with the marble color
+    given per game (WHITE or BLACK), as if it were their turn."""
+    return masks_to_legal(start_masks(line_codes(boards), line_codes(prev_boards), has_prev, colors))
+
+
+def apply_moves(boards, games, slots, codes):
+    """Pushes one move on each of the boards listed in games, in place. The moves are given as slots of the oriented
+    views ((direction * 7 + line) * 7 + start), along with the line codes of the boards (from line_codes). Returns an
+    array with the value of the marble knocked off each of those boards (EMPTY if none fell off)."""
+    fallen = np.zeros(len(games), dtype=np.int8)
+    directions, cells = np.divmod(slots, SIZE * SIZE)
+    lines, starts = np.divmod(cells, SIZE)
+    for direction in range(len(DIRECTIONS)):
+        selected = np.nonzero(directions == direction)[0]
+        if not len(selected):
+            continue
+        line = lines[selected]
+        start = starts[selected]
+        code = codes[selected, direction, line]
+        fallen[selected] = _FALLEN[code, start]
+        _view(boards, direction)[games[selected], line] = _LINE_VALUES[_NEXT_CODES[code, start]]
+    return fallen
+
+
+def boards_to_positions(boards):
+    """Returns the KubaGame position bitmasks (white, black, red) for each board as a list of tuples."""
+    masks = [((boards == value) * _BIT_WEIGHTS).sum(axis=(1, 2)) for value in (WHITE, BLACK, RED)]
+    return [(int(white), int(black), int(red)) for white, black, red in zip(*masks)]
+
+
+def _move_to_play(move):
+    """Turns a move number into the (coord, direction) used by KubaGame.make_move."""
+    direction, cell = divmod(int(move), SIZE * SIZE)
+    return divmod(cell, SIZE), DIRECTIONS[direction]
+
+
+class KubaBatch:
+    """Represents a batch of games played at the same time, all starting from the opening board with the players
+    taking turns. Moves are picked at random among the legal moves, or by a policy function. Contains methods as
+    follows: run, get_winners, get_move_sequences, get_move_counts, get_elapsed, and get_moves_per_second."""
+
+    def __init__(self, games, players=(("Player 1", "W"), ("Player 2", "B")), first_player=0, max_moves=500,
+                 seed=None, policy=None, cross_check=False):
+        """Creates a batch of games. Requires the number of games. Takes the (player_name, marble_color) tuples as
+        for KubaGame, the index of the player that moves first, the number of moves after which an unfinished game is
+        stopped as a draw, a random seed, a policy and the cross-check flag. A policy is called with the boards, the
+        marble value of the player to move in each game, and the legal move mask, and returns an (N, NUM_MOVES) array
+        of scores; the best scoring legal move is played. Without a policy, moves are picked uniformly at random."""
+        self._players = players
+        self._colors = np.array([COLOR_VALUES[color] for name, color in players], dtype=np.int8)
+        self._first_player = first_player
+        self._max_moves = max_moves
+        self._rng = np.random.default_rng(seed)
+        self._policy = policy
+        self._cross_check = cross_check
+
+        self._boards = np.repeat(OPENING[None], games, axis=0)
+        self._prev_boards = np.zeros_like(self._boards)
+        self._has_prev = np.zeros(games, dtype=bool)
+        self._captured = np.zeros((games, 2), dtype=np.int16)
+        self._winners = np.full(games, -1, dtype=np.int8)
+        self._move_log = []         # (games that moved, player index, move numbers) for each round of moves
+        self._elapsed = 0.0
+        self._moves_made = 0
+        self._scalar_games = None
+
+    def get_winners(self):
+        """Returns the winner's name for each game, or None for games stopped at the move limit."""
+        return [None if winner < 0 else self._players[winner][0] for winner in self._winners]
+
+    def get_move_counts(self):
+        """Returns the number of moves played in each game as an array."""
+        counts = np.zeros(len(self._winners), dtype=np.int64)
+        for games, player_index, moves in self._move_log:
+            counts[games] += 1
+        return counts
+
+    def get_move_sequences(self):
+        """Returns the moves of each game as a list of (player_name, coord, direction) tuples that can be replayed with
+        KubaGame.make_move."""
+        sequences = [[] for _ in range(len(self._winners))]
+        for games, player_index, moves in self._move_log:
+            name = self._players[player_index][0]
+            for game, move in zip(games.tolist(), moves.tolist()):
+                coord, direction = _move_to_play(move)
+                sequences[game].append((name, coord, direction))
+        return sequences
+
+    def get_elapsed(self):
+        """Returns the wall clock time of the last run in seconds."""
+        return self._elapsed
+
+    def get_moves_per_second(self):
+        """Returns the moves played per second (over all games) in the last run."""
+        if self._elapsed == 0:
+            return 0.0
+        return self._moves_made / self._elapsed
+
+    def run(self):
+        """Plays every game until it has a winner or reaches the move limit. Returns the batch."""
+        start = time.perf_counter()
+        if self._cross_check:
+            self._scalar_games = [KubaGame.KubaGame(*self._players) for _ in range(len(self._winners))]
+
+        # line codes and start masks of both players are kept for every game and updated for the games that move
+        codes = line_codes(self._boards)
+        prev_codes = np.zeros_like(codes)
+        masks = [start_masks(codes, prev_codes, self._has_prev, color) for color in self._colors]
+
+        # the first player moves in every game, then the players take turns
+        player_index = self._first_player
+        for move_number in range(self._max_moves):
+            active = np.nonzero(self._winners < 0)[0]
+            if not len(active):
+                break
+            mover_masks = masks[player_index][active]
+            slots = self._choose_slots(active, player_index, mover_masks)
+            moves = _MOVE_NUMBERS.ravel()[slots]
+            if self._cross_check:
+                self._check_legal(active, player_index, masks_to_legal(mover_masks))
+
+            # make the moves
+            active_codes = codes[active]
+            prev_codes[active] = active_codes
+            self._prev_boards[active] = self._boards[active]
+            self._has_prev[active] = True
+            fallen = apply_moves(self._boards, active, slots, active_codes)
+            self._captured[active[fallen == RED], player_index] += 1
+            self._move_log.append((active, player_index, moves))
+            self._moves_made += len(active)
+
+            # work out both players' moves on the new boards, then find the winners
+            new_codes = line_codes(self._boards[active])
+            codes[active] = new_codes
+            active_masks = []
+            for mask, color in zip(masks, self._colors):
+                mask[active] = start_masks(new_codes, active_codes, self._has_prev[active], color)
+                active_masks.append(mask[active])
+            self._update_winners(active, new_codes, active_masks)
+            if self._cross_check:
+                self._check_moves(active, player_index, moves)
+
+            player_index = 1 - player_index
+
+        self._elapsed = time.perf_counter() - start
+        return self
+
+    def _choose_slots(self, active, player_index, mover_masks):
+        """Returns a move for each active game as a slot of the oriented views ((direction * 7 + line) * 7 + start),
+        picked from its legal moves."""
+        count = len(active)
+        if self._policy is not None:
+            legal = masks_to_legal(mover_masks)
+            scores = np.asarray(self._policy(self._boards[active], np.full(count, self._colors[player_index]),
+                                             legal), dtype=float)
+            moves = np.where(legal, scores, -np.inf).argmax(axis=1)
+            return _MOVE_SLOTS[moves]
+
+        # pick the n-th legal move at random: find the line holding it, then the start column within that line
+        line_masks = mover_masks.reshape(count, -1)
+        line_counts = _SET_BITS[line_masks]
+        running_counts = line_counts.cumsum(axis=1)
+        picks = (self._rng.random(count) * running_counts[:, -1]).astype(np.int64)
+        lines = (running_counts <= picks[:, None]).sum(axis=1)
+        games = np.arange(count)
+        within = picks - running_counts[games, lines] + line_counts[games, lines]
+        return lines * SIZE + _NTH_BIT[line_masks[games, lines], within]
+
+    def _update_winners(self, active, codes, masks):
+        """Sets the winner of every active game that has just been won, in the same order of checks as
+        KubaGame.get_winner. Takes the line codes and both players' start masks of the active games."""
+        captured = self._captured[active]
+        row_codes = codes[:, 1]
+        marble_counts = [_VALUE_COUNTS[color][row_codes].sum(axis=1) for color in self._colors]
+        has_move = [mask.reshape(len(active), -1).any(axis=1) for mask in masks]
+        conditions = [captured[:, 0] == 7, captured[:, 1] == 7, marble_counts[0] == 0, marble_counts[1] == 0,
+                      ~has_move[0], ~has_move[1]]
+        self._winners[active] = np.select(conditions, [0, 1, 1, 0, 1, 0], default=-1)
+
+    def _check_legal(self, active, player_index, legal):
+        """Cross-check: compares the legal moves of every active game with KubaGame.legal_moves."""
+        name = self._players[player_index][0]
+        for row, game_index in enumerate(active.tolist()):
+            expected = set(self._scalar_games[game_index].legal_moves(name))
+            found = {_move_to_play(move) for move in np.nonzero(legal[row])[0]}
+            if expected != found:
+                raise CrossCheckError("game %d: legal moves differ: KubaGame %s, batch %s"
+                                      % (game_index, sorted(expected), sorted(found)))
+
+    def _check_moves(self, active, player_index, moves):
+        """Cross-check: plays the moves through KubaGame and compares the boards, captured counts and winners."""
+        name = self._players[player_index][0]
+        positions = boards_to_positions(self._boards[active])
+        for row, game_index in enumerate(active.tolist()):
+            game = self._scalar_games[game_index]
+            coord, direction = _move_to_play(moves[row])
+            if not game.make_move(name, coord, direction):
+                raise CrossCheckError("game %d: KubaGame rejected %s %s" % (game_index, coord, direction))
+            state = game.get_state()
+            winner = self._winners[game_index]
+            if (state[1] != positions[row] or state[3] != tuple(self._captured[game_index].tolist())
+                    or game.get_winner() != (None if winner < 0 else self._players[winner][0])):
+                raise CrossCheckError("game %d: state differs after %s %s" % (game_index, coord, direction))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Plays a batch of random Kuba games.")
+    parser.add_argument("--games", type=int, default=1000, help="number of games to play at once")
+    parser.add_argument("--max-moves", type=int, default=500, help="move limit per game")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    parser.add_argument("--cross-check", action="store_true", help="check every move against KubaGame")
+    arguments = parser.parse_args()
+
+    batch = KubaBatch(arguments.games, max_moves=arguments.max_moves, seed=arguments.seed,
+                      cross_check=arguments.cross_check).run()
+    winners = batch.get_winners()
+    for name in ("Player 1", "Player 2", None):
+        print("%-8s %d" % (name, winners.count(name)))
+    print("average moves per game: %.1f" % batch.get_move_counts().mean())
+    print("%.0f moves/s (%.2f s)" % (batch.get_moves_per_second(), batch.get_elapsed()))
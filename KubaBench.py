@@ -0,0 +1,396 @@
+# Description: This program is a benchmark suite for the hot paths of KubaGame. Every benchmark runs against a fixed
+# recorded position or a seeded random game so that runs can be compared. Each benchmark is timed in samples of many
+# calls and reported as operations per second with percentiles of the per-call time. Results can be saved as JSON and
+# compared against a saved baseline, failing when any benchmark is slower than the baseline by more than a threshold.
+# The size benchmarks repeat the pushes, move replays and winner checks on larger boards to show how they scale.
+# The memory benchmark reports the bytes allocated per live game, for new games and for games some moves in, with and
+# without the move history.
+#
+# Usage: python KubaBench.py [--filter NAME] [--save results.json] [--compare baseline.json] [--threshold 0.1]
+#        python KubaBench.py --memory [--memory-games 10000]
+
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import KubaGame
+
+
+# recorded positions: (board rows, previous board rows, captured counts, turns) with Player 1 on W and Player 2 on B
+OPENING_ROWS = ['WW---BB', 'WW-R-BB', '--RRR--', '-RRRRR-', '--RRR--', 'BB-R-WW', 'BB---WW']
+MIDGAME = (['--W-BBB', '-WRRR--', 'WWRRB--', '-RRRRR-', '-BRRBW-', '-----R-', '-BW---W'],
+           ['--W-BBB', '-WRRR--', '-WWRRB-', '-RRRRR-', '-BRRBW-', '-----R-', '-BW---W'],
+           (0, 0), (True, False))
+ENDGAME = (['-------', '-------', '-------', '--W-R-B', '-RB---W', '-B-W---', 'W---B--'],
+           ['-------', '-------', '-------', '--W-R-B', '-R-B--W', '-B-W---', 'W---B--'],
+           (5, 6), (True, False))
+# a full middle row, so a push from (3, 0) moves all seven marbles and knocks the last one off
+LONG_CHAIN = (['WW---BB', 'WW-R-BB', '--RRR--', 'WRRRRRB', '--RRR--', 'BB-R-WW', 'BB---WW'], None,
+              (0, 0), (True, True))
+
+PLAYERS = (("Player 1", "W"), ("Player 2", "B"))
+SEED = 20210706
+
+# board sizes for the size benchmarks, and the number of moves of a random game replayed on each
+SCALING_SIZES = (7, 19, 51)
+SCALING_MOVES = 100
+
+# each sample runs for about this many seconds
+SAMPLE_SECONDS = 0.01
+
+# moves played on every game for each line of the memory benchmark
+MEMORY_MOVES = (0, 10, 50)
+
+
+def game_from_rows(recorded):
+    """Requires a recorded position (board rows, previous board rows or None, captured counts, turns) and returns a
+    KubaGame in that position."""
+    rows, prev_rows, captured, turns = recorded
+    board = KubaGame.Board()
+    board.set_current_board(rows)
+    position = board.get_position()
+    prev_position = None
+    if prev_rows is not None:
+        board.set_current_board(prev_rows)
+        prev_position = board.get_position()
+    return KubaGame.KubaGame.from_state((PLAYERS, position, prev_position, captured, turns, None))
+
+
+def record_random_game(seed, size=7, max_moves=None):
+    """Plays a random game from the opening of a board of the size given with a seeded random generator and returns
+    its moves as a list of (player_name, coord, direction) tuples. Stops after max_moves moves if given."""
+    rng = random.Random(seed)
+    game = KubaGame.KubaGame(*PLAYERS, size=size)
+    player_name = PLAYERS[0][0]
+    moves = []
+    while game.get_winner() is None and (max_moves is None or len(moves) < max_moves):
+        move = rng.choice(list(game.legal_moves(player_name)))
+        game.make_move(player_name, move[0], move[1])
+        moves.append((player_name, move[0], move[1]))
+        player_name = PLAYERS[1][0] if player_name == PLAYERS[0][0] else PLAYERS[0][0]
+    return moves
+
+
+def _bench_move_marbles_short():
+    """Board.move_marbles for a two marble push on the opening board."""
+    game = game_from_rows((OPENING_ROWS, None, (0, 0), (True, True)))
+    board = game._board
+    player = game.get_player_by_name("Player 1")
+    return lambda: board.move_marbles((0, 0), player, "R"), 1
+
+
+def _bench_move_marbles_long():
+    """Board.move_marbles for a seven marble push that knocks a marble off."""
+    game = game_from_rows(LONG_CHAIN)
+    board = game._board
+    player = game.get_player_by_name("Player 1")
+    return lambda: board.move_marbles((3, 0), player, "R"), 1
+
+
+def _bench_push_short():
+    """Board.push for a two marble push on the opening board."""
+    board = game_from_rows((OPENING_ROWS, None, (0, 0), (True, True)))._board
+    return lambda: board.push((0, 0), "R"), 1
+
+
+def _bench_push_long():
+    """Board.push for a seven marble push that knocks a marble off."""
+    board = game_from_rows(LONG_CHAIN)._board
+    return lambda: board.push((3, 0), "R"), 1
+
+
+def _bench_move_permission():
+    """KubaGame.move_permission for every marble and direction of the player to move in the midgame position."""
+    game = game_from_rows(MIDGAME)
+    player = game.get_player_by_name("Player 1")
+    candidates = [(coord, direction) for coord in game._board.get_marble_coords(player) for direction in "LRFB"]
+
+    def run():
+        for coord, direction in candidates:
+            game.move_permission(player, coord, direction)
+    return run, len(candidates)
+
+
+def _bench_move_permission_cached():
+    """KubaGame.move_permission for every marble and direction in the midgame position with a warm MoveCache."""
+    game = game_from_rows(MIDGAME)
+    game.set_move_cache(KubaGame.MoveCache())
+    player = game.get_player_by_name("Player 1")
+    candidates = [(coord, direction) for coord in game._board.get_marble_coords(player) for direction in "LRFB"]
+
+    def run():
+        for coord, direction in candidates:
+            game.move_permission(player, coord, direction)
+    run()
+    return run, len(candidates)
+
+
+def _bench_next_legal_move():
+    """KubaGame.next_legal_move for both players in the midgame and endgame positions."""
+    games = [game_from_rows(MIDGAME), game_from_rows(ENDGAME)]
+    checks = [(game, game.get_player_by_name(name)) for game in games for name, color in PLAYERS]
+
+    def run():
+        for game, player in checks:
+            game.next_legal_move(player)
+    return run, len(checks)
+
+
+def _bench_get_winner():
+    """KubaGame.get_winner in the midgame and endgame positions (neither has a winner, so every call does the full
+    check)."""
+    games = [game_from_rows(MIDGAME), game_from_rows(ENDGAME)]
+
+    def run():
+        for game in games:
+            game.get_winner()
+    return run, len(games)
+
+
+def _bench_make_move():
+    """KubaGame.make_move replaying a recorded random game from the opening."""
+    moves = record_random_game(SEED)
+
+    def run():
+        game = KubaGame.KubaGame(*PLAYERS)
+        for player_name, coord, direction in moves:
+            game.make_move(player_name, coord, direction)
+    return run, len(moves)
+
+
+def _bench_make_undo():
+    """KubaGame.make_move followed by KubaGame.undo_move for every legal move in the midgame position."""
+    game = game_from_rows(MIDGAME).copy_game()
+    moves = list(game.legal_moves("Player 1"))
+
+    def run():
+        for coord, direction in moves:
+            game.make_move("Player 1", coord, direction)
+            game.undo_move()
+    return run, len(moves)
+
+
+def _bench_random_playout():
+    """A full random game from the opening to the end, replayed with the same seed every call."""
+
+    def run():
+        rng = random.Random(SEED)
+        game = KubaGame.KubaGame(*PLAYERS)
+        player_name = PLAYERS[0][0]
+        while game.get_winner() is None:
+            moves = list(game.legal_moves(player_name))
+            move = moves[rng.randrange(len(moves))]
+            game.make_move(player_name, move[0], move[1])
+            player_name = PLAYERS[1][0] if player_name == PLAYERS[0][0] else PLAYERS[0][0]
+    return run, 1
+
+
+def _scaling_benchmarks(size):
+    """Returns the size benchmarks for a board of the size given as a dictionary of benchmark name: setup function."""
+
+    def push_short():
+        board = KubaGame.Board(size)
+        return lambda: board.push((0, 0), "R"), 1
+
+    def push_long():
+        # a full middle row, so the push moves every marble in the row and knocks the last one off
+        rows = [["-"] * size for _ in range(size)]
+        rows[size // 2] = ["W"] + ["R"] * (size - 2) + ["B"]
+        board = KubaGame.Board(layout=rows)
+        return lambda: board.push((size // 2, 0), "R"), 1
+
+    def make_move():
+        moves = record_random_game(SEED, size, SCALING_MOVES)
+
+        def run():
+            game = KubaGame.KubaGame(*PLAYERS, size=size)
+            for player_name, coord, direction in moves:
+                game.make_move(player_name, coord, direction)
+        return run, len(moves)
+
+    def get_winner():
+        game = KubaGame.KubaGame(*PLAYERS, size=size)
+        for player_name, coord, direction in record_random_game(SEED, size, SCALING_MOVES):
+            game.make_move(player_name, coord, direction)
+        return game.get_winner, 1
+
+    push_short.__doc__ = "Board.push for a two marble push on the %d by %d opening board." % (size, size)
+    push_long.__doc__ = "Board.push for a %d marble push across a %d by %d board." % (size, size, size)
+    make_move.__doc__ = "KubaGame.make_move replaying %d random moves on a %d by %d board." % (
+        SCALING_MOVES, size, size)
+    get_winner.__doc__ = "KubaGame.get_winner after %d random moves on a %d by %d board." % (SCALING_MOVES, size, size)
+    prefix = "size%d." % size
+    return {prefix + "board.push.short": push_short, prefix + "board.push.long": push_long,
+            prefix + "game.make_move": make_move, prefix + "game.get_winner": get_winner}
+
+
+# benchmark name: setup function returning (function to time, operations per call)
+BENCHMARKS = {
+    "board.move_marbles.short": _bench_move_marbles_short,
+    "board.move_marbles.long": _bench_move_marbles_long,
+    "board.push.short": _bench_push_short,
+    "board.push.long": _bench_push_long,
+    "game.move_permission": _bench_move_permission,
+    "game.move_permission.cached": _bench_move_permission_cached,
+    "game.next_legal_move": _bench_next_legal_move,
+    "game.get_winner": _bench_get_winner,
+    "game.make_move": _bench_make_move,
+    "game.make_move+undo_move": _bench_make_undo,
+    "game.random_playout": _bench_random_playout,
+}
+for _size in SCALING_SIZES:
+    BENCHMARKS.update(_scaling_benchmarks(_size))
+
+
+def _percentile(sorted_values, fraction):
+    """Returns the value at the fraction given (0 to 1) of a sorted list, interpolating between neighbours."""
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def time_benchmark(name, samples=30):
+    """Runs one benchmark by name and returns its results as a dictionary: operations per second (from the median
+    sample), the 50th/90th/99th percentile and minimum time per operation in microseconds, and the sample counts."""
+    function, operations = BENCHMARKS[name]()
+
+    # calibrate the calls per sample so that a sample takes about SAMPLE_SECONDS
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= SAMPLE_SECONDS or calls >= 1 << 20:
+            break
+        calls *= 2
+
+    per_operation = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        per_operation.append((time.perf_counter() - start) / (calls * operations))
+    per_operation.sort()
+    median = _percentile(per_operation, 0.5)
+    return {
+        "ops_per_sec": 1 / median,
+        "p50_us": median * 1e6,
+        "p90_us": _percentile(per_operation, 0.9) * 1e6,
+        "p99_us": _percentile(per_operation, 0.99) * 1e6,
+        "min_us": per_operation[0] * 1e6,
+        "samples": samples,
+        "ops_per_sample": calls * operations,
+    }
+
+
+def run_benchmarks(names=None, samples=30, report=None):
+    """Runs the benchmarks named (all of them by default) and returns a dictionary with the machine details and the
+    results keyed by benchmark name. If report is given it is called with (name, result) as each benchmark finishes."""
+    results = {}
+    for name in names or BENCHMARKS:
+        results[name] = time_benchmark(name, samples)
+        if report is not None:
+            report(name, results[name])
+    return {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def compare(results, baseline):
+    """Compares results against a baseline (both as returned by run_benchmarks) and returns a list of
+    (name, baseline ops/sec, current ops/sec, change) for every benchmark in both, with change as a fraction
+    (negative is slower)."""
+    rows = []
+    for name, result in results["results"].items():
+        if name in baseline["results"]:
+            before = baseline["results"][name]["ops_per_sec"]
+            after = result["ops_per_sec"]
+            rows.append((name, before, after, after / before - 1))
+    return rows
+
+
+def measure_memory(games=10000, moves=0, size=7, keep_history=False):
+    """Creates games games of the size given (keeping their move history if keep_history is True), plays the first
+    moves moves of a seeded random game on each and returns the bytes allocated per game (the games are kept alive
+    while they are measured, the way a server holds them)."""
+    recorded = record_random_game(SEED, size, moves) if moves else []
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        live_games = []
+        for _ in range(games):
+            game = KubaGame.KubaGame(*PLAYERS, size=size, keep_history=keep_history)
+            for player_name, coord, direction in recorded:
+                game.make_move(player_name, coord, direction)
+            live_games.append(game)
+        # the list holding the games isn't part of a game
+        used = tracemalloc.get_traced_memory()[0] - before - sys.getsizeof(live_games)
+    finally:
+        tracemalloc.stop()
+    return used / games
+
+
+def _print_result(name, result):
+    """Prints one benchmark result as a table row."""
+    print("%-28s %12.0f ops/s  p50 %9.2f us  p90 %9.2f us  p99 %9.2f us" % (
+        name, result["ops_per_sec"], result["p50_us"], result["p90_us"], result["p99_us"]))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmarks the KubaGame hot paths.")
+    parser.add_argument("--filter", action="append", help="only run benchmarks whose name contains this text")
+    parser.add_argument("--samples", type=int, default=30, help="timing samples per benchmark")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against a baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="fail if a benchmark is slower than the baseline by more than this fraction")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    parser.add_argument("--memory", action="store_true", help="report the bytes per live game and exit")
+    parser.add_argument("--memory-games", type=int, default=10000, help="games held at once for --memory")
+    arguments = parser.parse_args()
+
+    if arguments.list:
+        for benchmark_name, setup in BENCHMARKS.items():
+            print("%-28s %s" % (benchmark_name, setup.__doc__))
+        sys.exit(0)
+
+    if arguments.memory:
+        for move_count in MEMORY_MOVES:
+            print("%6d moves: %10.0f bytes per game, %10.0f with history" % (
+                move_count, measure_memory(arguments.memory_games, move_count),
+                measure_memory(arguments.memory_games, move_count, keep_history=True)))
+        sys.exit(0)
+
+    selected = [benchmark_name for benchmark_name in BENCHMARKS
+                if not arguments.filter or any(text in benchmark_name for text in arguments.filter)]
+    current = run_benchmarks(selected, arguments.samples, _print_result)
+
+    if arguments.save:
+        with open(arguments.save, "w") as results_file:
+            json.dump(current, results_file, indent=2, sort_keys=True)
+
+    if arguments.compare:
+        with open(arguments.compare) as baseline_file:
+            saved = json.load(baseline_file)
+        regressions = 0
+        print()
+        for benchmark_name, before_ops, after_ops, change in compare(current, saved):
+            flag = "REGRESSION" if change < -arguments.threshold else ""
+            regressions += change < -arguments.threshold
+            print("%-28s %12.0f -> %12.0f ops/s  %+7.1f%%  %s" % (
+                benchmark_name, before_ops, after_ops, change * 100, flag))
+        if regressions:
+            print("%d benchmark(s) slower than the baseline by more than %.0f%%" % (
+                regressions, arguments.threshold * 100))
+            sys.exit(1)
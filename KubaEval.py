@@ -0,0 +1,301 @@
+# Description: This program scores Kuba positions for search and training code. It contains the KubaEvaluator class,
+# which works out five features of a whole batch of positions with NumPy array operations and returns one score per
+# position as the weighted sum of the features, from the point of view of the player to move. Every feature is the
+# player to move's value minus the opponent's:
+# material - marbles of the player's color on the board
+# captured - neutral (red) marbles captured
+# mobility - legal moves, each side counted as if it were their turn (Ko rule included)
+# edge     - marbles of the player's color on the outer ring of the board
+# at_risk  - marbles of the player's color the other side could push off the board with one legal move
+# A scalar reference path scores one KubaGame at a time through the public KubaGame methods (get_marble_count,
+# get_captured, legal_moves and get_marble) for cross-checking the batch path.
+#
+# Positions are encoded as in KubaBatch (7 by 7 boards only): int8 boards of shape (N, 7, 7) holding EMPTY, WHITE,
+# BLACK or RED, the previous boards for the Ko rule with a flag for each position that has one, the captured counts of
+# shape (N, 2) for the player to move and the opponent, and the marble value of the player to move (WHITE or BLACK).
+# encode_games builds these arrays from KubaGame objects. Positions that already have a winner are scored like any
+# other; search code should check KubaGame.get_winner first.
+#
+# Usage in code:
+#     evaluator = KubaEval.KubaEvaluator({"mobility": 2})
+#     scores = evaluator.evaluate_batch(*KubaEval.encode_games(games, player_names))
+#
+# Usage: python KubaEval.py [--positions 2000] [--seed 1] [--check] [--batch-sizes 1 10 100 1000 10000 100000]
+
+import random
+import time
+
+import numpy as np
+
+import KubaBatch
+import KubaGame
+from KubaBatch import EMPTY, WHITE, BLACK, RED, SIZE
+
+
+# the features in the order of the columns returned by features_batch
+FEATURES = ("material", "captured", "mobility", "edge", "at_risk")
+
+# the weight of each feature when none is given (material and captured match KubaAI's evaluation)
+DEFAULT_WEIGHTS = {"material": 10, "captured": 12, "mobility": 1, "edge": -1, "at_risk": -4}
+
+# the batch sizes timed by the benchmark
+BATCH_SIZES = (1, 10, 100, 1000, 10000, 100000)
+
+# each batch size is timed for about this many seconds
+BENCH_SECONDS = 0.5
+
+_PLAYERS = (("Player 1", "W"), ("Player 2", "B"))
+
+# the (row, col) step of a push in each direction
+_STEPS = {"L": (0, -1), "R": (0, 1), "F": (-1, 0), "B": (1, 0)}
+
+# the spaces on the outer ring of the board
+_RING = np.ones((SIZE, SIZE), dtype=bool)
+_RING[1:-1, 1:-1] = False
+
+
+def _build_end_cells():
+    """Returns an array of shape (4, 7) with the space (row * 7 + col) at the far end of every line of the oriented
+    views (see KubaBatch._view): the space a push along that line knocks a marble off from."""
+    cells = np.arange(SIZE * SIZE).reshape(SIZE, SIZE)
+    return np.stack([KubaBatch._view(cells, direction)[:, -1] for direction in range(len(KubaBatch.DIRECTIONS))])
+
+
+def _build_knock_masks():
+    """Returns a table indexed by line code of 7-bit masks of the start columns whose push to the right knocks a
+    marble off the end of the line."""
+    return ((KubaBatch._FALLEN != EMPTY) << KubaBatch._COLUMNS).sum(axis=1).astype(np.int16)
+
+
+_END_CELLS = _build_end_cells()
+_KNOCK_MASKS = _build_knock_masks()
+_END_VALUES = KubaBatch._LINE_VALUES[:, -1]
+_CELL_BITS = np.arange(SIZE * SIZE, dtype=np.int64)
+
+
+def positions_to_boards(positions):
+    """Takes a list of KubaGame position bitmasks (white, black, red), or None for no position, and returns an int8
+    array of shape (N, 7, 7) of boards (all EMPTY for None). The reverse of KubaBatch.boards_to_positions."""
+    masks = np.array([position if position is not None else (0, 0, 0) for position in positions],
+                     dtype=np.int64).reshape(-1, 3)
+    bits = (masks[:, :, None] >> _CELL_BITS) & 1
+    boards = bits[:, 0] * WHITE + bits[:, 1] * BLACK + bits[:, 2] * RED
+    return boards.astype(np.int8).reshape(-1, SIZE, SIZE)
+
+
+def encode_games(games, player_names):
+    """Requires a list of 7 by 7 KubaGames and the name of the player to move in each (or one name for all of them)
+    and returns the arrays taken by evaluate_batch and features_batch: (boards, prev_boards, has_prev, captured,
+    colors)."""
+    if isinstance(player_names, str):
+        player_names = [player_names] * len(games)
+    states = [game.get_state() for game in games]
+    for state in states:
+        if len(state) > 6 and state[6] != SIZE:
+            raise ValueError("only %d by %d boards can be evaluated in a batch" % (SIZE, SIZE))
+    boards = positions_to_boards([state[1] for state in states])
+    prev_boards = positions_to_boards([state[2] for state in states])
+    has_prev = np.array([state[2] is not None for state in states], dtype=bool)
+    captured = np.zeros((len(games), 2), dtype=np.int16)
+    colors = np.zeros(len(games), dtype=np.int8)
+    for index, (state, player_name) in enumerate(zip(states, player_names)):
+        players = state[0]
+        mover = 0 if players[0][0] == player_name else 1
+        captured[index] = state[3][mover], state[3][1 - mover]
+        colors[index] = KubaBatch.COLOR_VALUES[players[mover][1]]
+    return boards, prev_boards, has_prev, captured, colors
+
+
+class KubaEvaluator:
+    """Represents a position evaluation with a weight for each feature in FEATURES. Scores a batch of encoded
+    positions in one call (evaluate_batch) or one KubaGame at a time (evaluate, the reference path). Contains methods
+    as follows: get_weights, set_weights, features_batch, evaluate_batch, features, and evaluate."""
+
+    def __init__(self, weights=None):
+        """Creates an evaluator. Takes an optional dictionary of feature name: weight; features left out keep their
+        weight from DEFAULT_WEIGHTS."""
+        self._weights = None
+        self.set_weights(weights)
+
+    def get_weights(self):
+        """Returns a dictionary of feature name: weight."""
+        return dict(zip(FEATURES, self._weights.tolist()))
+
+    def set_weights(self, weights=None):
+        """Takes a dictionary of feature name: weight and replaces the weights of the features given (all of them are
+        reset to DEFAULT_WEIGHTS first). Raises ValueError for a name that isn't in FEATURES."""
+        merged = dict(DEFAULT_WEIGHTS)
+        for name, weight in (weights or {}).items():
+            if name not in merged:
+                raise ValueError("unknown feature %r (features are %s)" % (name, ", ".join(FEATURES)))
+            merged[name] = weight
+        self._weights = np.array([merged[name] for name in FEATURES], dtype=np.float64)
+
+    def features_batch(self, boards, prev_boards, has_prev, captured, colors):
+        """Takes encoded positions (see encode_games) and returns an int32 array of shape (N, len(FEATURES)) holding
+        every feature of every position, each the player to move's value minus the opponent's."""
+        boards = np.asarray(boards, dtype=np.int8)
+        colors = np.asarray(colors, dtype=np.int8)
+        has_prev = np.asarray(has_prev, dtype=bool)
+        captured = np.asarray(captured)
+        opponent_colors = (WHITE + BLACK) - colors
+        codes = KubaBatch.line_codes(boards)
+        prev_codes = KubaBatch.line_codes(np.asarray(prev_boards, dtype=np.int8))
+        features = np.empty((len(boards), len(FEATURES)), dtype=np.int32)
+
+        own = boards == colors[:, None, None]
+        opponent = boards == opponent_colors[:, None, None]
+        features[:, 0] = own.sum(axis=(1, 2)) - opponent.sum(axis=(1, 2))
+        features[:, 1] = captured[:, 0] - captured[:, 1]
+        features[:, 3] = (own & _RING).sum(axis=(1, 2)) - (opponent & _RING).sum(axis=(1, 2))
+
+        own_masks = KubaBatch.start_masks(codes, prev_codes, has_prev, colors)
+        opponent_masks = KubaBatch.start_masks(codes, prev_codes, has_prev, opponent_colors)
+        features[:, 2] = (KubaBatch._SET_BITS[own_masks].sum(axis=(1, 2))
+                          - KubaBatch._SET_BITS[opponent_masks].sum(axis=(1, 2)))
+        features[:, 4] = (self._at_risk(codes, opponent_masks, colors)
+                          - self._at_risk(codes, own_masks, opponent_colors))
+        return features
+
+    def _at_risk(self, codes, pusher_masks, colors):
+        """Returns the number of marbles of the color given (one value per position) that the other side can push off
+        the board with a legal move, from the line codes and the other side's start masks. A corner marble that can
+        be pushed off along its row and its column is counted once."""
+        end_values = _END_VALUES[codes]
+        threatened = ((pusher_masks & _KNOCK_MASKS[codes]) != 0) & (end_values == colors[:, None, None])
+        cells = np.zeros((len(codes), SIZE * SIZE), dtype=bool)
+        for direction in range(len(KubaBatch.DIRECTIONS)):
+            cells[:, _END_CELLS[direction]] |= threatened[:, direction]
+        return cells.sum(axis=1)
+
+    def evaluate_batch(self, boards, prev_boards, has_prev, captured, colors):
+        """Takes encoded positions (see encode_games) and returns a float64 array with the score of every position
+        from the point of view of the player to move."""
+        return self.features_batch(boards, prev_boards, has_prev, captured, colors) @ self._weights
+
+    def features(self, game, player_name):
+        """Returns the features of a KubaGame from the point of view of player_name as a tuple in the order of
+        FEATURES, worked out one space and one move at a time through the KubaGame methods. This is the reference the
+        batch path is checked against, and works for every board size."""
+        names = game.get_player_names()
+        opponent_name = names[1] if names[0] == player_name else names[0]
+        color = game.get_player_by_name(player_name).get_marble_color()
+        opponent_color = game.get_player_by_name(opponent_name).get_marble_color()
+        size = game.get_size()
+
+        counts = dict(zip("WBR", game.get_marble_count()))
+        own_moves = list(game.legal_moves(player_name))
+        opponent_moves = list(game.legal_moves(opponent_name))
+        edge = 0
+        for row in range(size):
+            for col in range(size):
+                if row in (0, size - 1) or col in (0, size - 1):
+                    marble = game.get_marble((row, col))
+                    edge += (marble == color) - (marble == opponent_color)
+        return (counts[color] - counts[opponent_color],
+                game.get_captured(player_name) - game.get_captured(opponent_name),
+                len(own_moves) - len(opponent_moves),
+                edge,
+                len(_knocked_off(game, opponent_moves, color)) - len(_knocked_off(game, own_moves, opponent_color)))
+
+    def evaluate(self, game, player_name):
+        """Returns the score of a KubaGame from the point of view of player_name, worked out with features."""
+        return float(np.dot(self.features(game, player_name), self._weights))
+
+
+def _knocked_off(game, moves, color):
+    """Returns the set of spaces holding a marble of the color given that one of the moves would push off the board:
+    the marble on the edge at the end of a push's line when the line is full from the pushed marble to the edge."""
+    size = game.get_size()
+    spaces = set()
+    for (row, col), direction in moves:
+        d_row, d_col = _STEPS[direction]
+        while 0 <= row + d_row < size and 0 <= col + d_col < size and game.get_marble((row, col)) != "X":
+            row, col = row + d_row, col + d_col
+        if game.get_marble((row, col)) == color:
+            spaces.add((row, col))
+    return spaces
+
+
+def sample_games(count, seed=1, max_moves=200):
+    """Plays random games from the opening with a seeded random generator and returns count of the positions they
+    pass through as (KubaGame, name of the player to move) pairs, skipping positions that have a winner."""
+    rng = random.Random(seed)
+    samples = []
+    while len(samples) < count:
+        game = KubaGame.KubaGame(*_PLAYERS)
+        player_index = 0
+        for _ in range(max_moves):
+            if game.get_winner() is not None or len(samples) >= count:
+                break
+            player_name = _PLAYERS[player_index][0]
+            samples.append((KubaGame.KubaGame.from_state(game.get_state()), player_name))
+            move = rng.choice(list(game.legal_moves(player_name)))
+            game.make_move(player_name, move[0], move[1])
+            player_index = 1 - player_index
+    return samples
+
+
+def cross_check(evaluator, samples):
+    """Compares the batch features of the sampled (KubaGame, player_name) pairs with the reference features. Returns
+    a list of (index, reference features, batch features) for every position where they differ."""
+    games = [game for game, player_name in samples]
+    names = [player_name for game, player_name in samples]
+    batch = evaluator.features_batch(*encode_games(games, names))
+    differences = []
+    for index, (game, player_name) in enumerate(samples):
+        expected = evaluator.features(game, player_name)
+        found = tuple(batch[index].tolist())
+        if expected != found:
+            differences.append((index, expected, found))
+    return differences
+
+
+def benchmark(evaluator, encoded, batch_sizes=BATCH_SIZES, seconds=BENCH_SECONDS):
+    """Times evaluate_batch on batches of each size built by repeating the encoded positions, and returns a list of
+    (batch size, positions per second)."""
+    results = []
+    for batch_size in batch_sizes:
+        indexes = np.resize(np.arange(len(encoded[0])), batch_size)
+        batch = tuple(array[indexes] for array in encoded)
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            evaluator.evaluate_batch(*batch)
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= seconds:
+                break
+        results.append((batch_size, calls * batch_size / elapsed))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Benchmarks and cross-checks the batched Kuba position evaluator.")
+    parser.add_argument("--positions", type=int, default=2000, help="distinct positions sampled from random games")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--check", action="store_true", help="compare every position with the reference path")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES, help="batch sizes to time")
+    arguments = parser.parse_args()
+
+    position_evaluator = KubaEvaluator()
+    sampled = sample_games(arguments.positions, arguments.seed)
+    if arguments.check:
+        mismatches = cross_check(position_evaluator, sampled)
+        for mismatch in mismatches[:10]:
+            print("position %d: reference %s, batch %s" % mismatch)
+        print("%d of %d positions differ" % (len(mismatches), len(sampled)))
+        if mismatches:
+            sys.exit(1)
+
+    start_time = time.perf_counter()
+    for sample_game, sample_name in sampled:
+        position_evaluator.evaluate(sample_game, sample_name)
+    print("%-10s %14.0f positions/s" % ("reference", len(sampled) / (time.perf_counter() - start_time)))
+    encoded_positions = encode_games([sample_game for sample_game, sample_name in sampled],
+                                     [sample_name for sample_game, sample_name in sampled])
+    for size_of_batch, rate in benchmark(position_evaluator, encoded_positions, arguments.batch_sizes):
+        print("batch %-6d %12.0f positions/s" % (size_of_batch, rate))
@@ -2,6 +2,10 @@
 # Date: 06/02/2021
 # Description: This program is the GUI that allows for player input as part of playing KubaGame.
 
+import collections
+import sys
+import time
+
 import pygame
 import KubaGame
 
@@ -38,6 +42,15 @@ rules_button_right_edge = rules_button_location[0] + 30
 rules_button_top = rules_button_location[1] - 15
 rules_button_bottom = rules_button_location[1] + 15
 
+# define the screen regions that are redrawn on their own when their text changes
+player_one_scoreboard_rect = pygame.Rect(left_edge - 200, top_edge + grid_size/2, 190, 60)
+player_two_scoreboard_rect = pygame.Rect(right_edge + 50, top_edge + grid_size/2, 170, 60)
+player_turn_region = pygame.Rect(window_width/2 - 150, int(top_edge/2), 300, top_edge - int(top_edge/2))
+
+# frame rate cap while drawing, and how often the loop wakes up when there is no input
+max_fps = 60
+idle_fps = 4
+
 # create the colors
 black = (0, 0, 0)
 white = (255, 255, 255)
@@ -45,12 +58,53 @@ red = (214, 51, 51)
 grey = (176, 176, 176)
 board_color = (245, 242, 215)
 
+# the image files for the marble icons
+sprite_files = {'gor_image': 'gorilla.png', 'man_image': 'man-in-suit-and-tie.png', 'earth_image': 'planet-earth.png'}
+
+# the decoded images, the icons scaled to the board grid, and the grid size they were scaled to
+sprite_cache = {"images": {}, "scaled": {}, "grid_size": None}
+
+# the image type drawn for each marble color
+marble_images = {"W": 'gor_image', "B": 'man_image', "R": 'earth_image'}
+
+# what is on the screen now, so that only the regions that have changed get drawn. full is set when the whole screen
+# needs to be drawn again
+render_state = {"full": True, "board": None, "player_one": None, "player_two": None, "turn": None, "winner": None}
+
+# the time from an input event to the display update that showed its result, for the most recent redraws
+redraw_latencies = collections.deque(maxlen=1000)
+
+# the most text surfaces kept in the text cache
+max_cached_text = 64
+
 # initialize pygame
 pygame.init()
 # create a surface
 screen = pygame.display.set_mode((window_width, window_height))
 pygame.display.set_caption("Kuba Game")
 
+# create the fonts once, keyed by size
+fonts = {size: pygame.font.Font(None, size) for size in (18, 26, 50)}
+
+# rendered text surfaces keyed by (font size, string, color, background color), oldest first
+text_cache = collections.OrderedDict()
+
+
+def render_text(size, string, color, background=None):
+    """Returns a surface with the string rendered in the font size and colors given. Surfaces are cached, so a string
+    is only rendered again after it changes (or after it has dropped out of the cache)."""
+    key = (size, string, color, background)
+    surface = text_cache.get(key)
+    if surface is not None:
+        text_cache.move_to_end(key)
+        return surface
+
+    surface = fonts[size].render(string, True, color, background)
+    text_cache[key] = surface
+    if len(text_cache) > max_cached_text:
+        text_cache.popitem(last=False)
+    return surface
+
 
 def reset():
     """Resets the game and starts a new round."""
@@ -61,8 +115,7 @@ def declare_winner():
     """Creates a message that declares the winner once a winner has been crowned."""
     winner = game[0].get_winner()
     if winner is not None:
-        text = pygame.font.Font(None, 50)
-        winning_text = text.render(str(winner) + " is the winner!", True, black, white)
+        winning_text = render_text(50, str(winner) + " is the winner!", black, white)
         winning_text_rect = winning_text.get_rect()
         winning_text_rect.midtop = (window_width / 2, (window_height - board_height) / 2)
         screen.blit(winning_text, winning_text_rect)
@@ -70,12 +123,11 @@ def declare_winner():
 
 def draw_player_turn():
     """Displays the player turn on the screen"""
-    text = pygame.font.Font(None, 26)
     # render the player turn
     player_turn = game[0].get_current_turn()
     if player_turn is None:
         player_turn = "Either Player"
-    player_turn_text = text.render("Player turn: " + str(player_turn), True, black)
+    player_turn_text = render_text(26, "Player turn: " + str(player_turn), black)
     player_turn_rect = player_turn_text.get_rect()
     player_turn_rect.midtop = (int(window_width / 2), int(top_edge/2))
     screen.blit(player_turn_text, player_turn_rect)
@@ -83,11 +135,9 @@ def draw_player_turn():
 
 def draw_buttons():
     """Displays the reset button on the screen."""
-    text = pygame.font.Font(None, 26)
-
     # render the text
-    new_game_text = text.render("NEW GAME", True, black)
-    rules_text = text.render("RULES", True, black)
+    new_game_text = render_text(26, "NEW GAME", black)
+    rules_text = render_text(26, "RULES", black)
 
     # create a rectangle to house the text
     new_game_text_rect = new_game_text.get_rect()
@@ -103,15 +153,13 @@ def draw_buttons():
 
 def draw_player_one_scoreboard():
     """Creates a scoreboard on the screen that shows player marble count and # of marbles captured"""
-    text = pygame.font.Font(None, 18)
-
     # render the player_one text
     player_one_text = []
     player_one_marble_count = game[0].get_marble_count()[0]
     player_one_captured = game[0].get_captured("Player 1")
-    player_one_text.append(text.render("Player 1 Info", True, black))
-    player_one_text.append(text.render("Marble Count: " + str(player_one_marble_count), True, black))
-    player_one_text.append(text.render("Marbles Captured: " + str(player_one_captured), True, black))
+    player_one_text.append(render_text(18, "Player 1 Info", black))
+    player_one_text.append(render_text(18, "Marble Count: " + str(player_one_marble_count), black))
+    player_one_text.append(render_text(18, "Marbles Captured: " + str(player_one_captured), black))
 
     # create rectangles for player_one info
     player_one_rects = []
@@ -130,15 +178,13 @@ def draw_player_one_scoreboard():
 
 def draw_player_two_scoreboard():
     """Creates a scoreboard on the screen that shows player marble count and # of marbles captured"""
-    text = pygame.font.Font(None, 18)
-
     # render the player_two text
     player_two_text = []
     player_two_marble_count = game[0].get_marble_count()[1]
     player_two_captured = game[0].get_captured("Player 2")
-    player_two_text.append(text.render("Player 2 Info", True, black))
-    player_two_text.append(text.render("Marble Count: " + str(player_two_marble_count), True, black))
-    player_two_text.append(text.render("Marbles Captured: " + str(player_two_captured), True, black))
+    player_two_text.append(render_text(18, "Player 2 Info", black))
+    player_two_text.append(render_text(18, "Marble Count: " + str(player_two_marble_count), black))
+    player_two_text.append(render_text(18, "Marbles Captured: " + str(player_two_captured), black))
 
     # create rectangles for player_two info
     player_two_rects = []
@@ -160,18 +206,29 @@ def draw_marble(coords, color):
     pygame.draw.circle(screen, color, (coords[0], coords[1]), grid_size / 2 - 10)
 
 
+def get_sprite(image_type):
+    """Returns the icon surface for an image type ('gor_image', 'man_image' or 'earth_image') scaled to the board
+    grid. Each image file is only loaded and decoded once, and only scaled again if grid_size changes."""
+    # throw the scaled icons away if the grid size has changed since they were made
+    if sprite_cache["grid_size"] != grid_size:
+        sprite_cache["grid_size"] = grid_size
+        sprite_cache["scaled"] = {}
+
+    icon = sprite_cache["scaled"].get(image_type)
+    if icon is None:
+        image = sprite_cache["images"].get(image_type)
+        if image is None:
+            image = pygame.image.load(sprite_files[image_type]).convert_alpha()
+            sprite_cache["images"][image_type] = image
+        icon = pygame.transform.scale(image, (int(grid_size), int(grid_size)))
+        sprite_cache["scaled"][image_type] = icon
+    return icon
+
+
 def load_images(coord, image_type):
     """Loads an image onto the screen in the specified coordinate."""
-    # first create icon surfaces and transform their size to match the board grid
-    if image_type == 'gor_image':
-        icon = pygame.image.load('gorilla.png')
-        icon = pygame.transform.scale(icon, (int(grid_size), int(grid_size)))
-    if image_type == 'man_image':
-        icon = pygame.image.load('man-in-suit-and-tie.png')
-        icon = pygame.transform.scale(icon, (int(grid_size), int(grid_size)))
-    if image_type == 'earth_image':
-        icon = pygame.image.load('planet-earth.png')
-        icon = pygame.transform.scale(icon, (int(grid_size), int(grid_size)))
+    # get the icon surface, already sized to match the board grid
+    icon = get_sprite(image_type)
 
     # blit the surfaces onto the screen surface at the coordinate specified. Note that we have to adjust the coordinates
     # because the icons position themselves based on the top left corner of the icon
@@ -247,6 +304,70 @@ def draw_board():
         load_images(marble, 'earth_image')
 
 
+def get_cell_rect(row_index, col_index):
+    """Returns the rectangle on the screen covered by the board cell at (row_index, col_index)."""
+    return pygame.Rect(left_edge + grid_size * col_index, top_edge + grid_size * row_index, grid_size, grid_size)
+
+
+def draw_cell(row_index, col_index, marble):
+    """Draws one board cell again: the board and gridlines inside the cell and the marble on it, if any. Drawing is
+    clipped to the cell, so it matches what a full draw_board leaves there. Returns the cell rectangle."""
+    cell_rect = get_cell_rect(row_index, col_index)
+    screen.set_clip(cell_rect)
+    draw_border()
+    if marble in marble_images:
+        load_images(get_cell_center(row_index, col_index), marble_images[marble])
+    screen.set_clip(None)
+    return cell_rect
+
+
+def draw_region(region, draw_function):
+    """Clears a region of the background and draws it again with the draw function given. Returns the region."""
+    screen.set_clip(region)
+    screen.fill(grey)
+    draw_function()
+    screen.set_clip(None)
+    return region
+
+
+def render():
+    """Draws whatever has changed on the screen since the last render and updates only those regions of the display:
+    each board cell whose marble changed, each scoreboard whose numbers changed and the player turn. A new winner (or
+    a new game after one) draws the whole screen. Returns True if anything was drawn."""
+    current_game = game[0]
+    board = current_game._board.get_current_board()
+    marble_count = current_game.get_marble_count()
+    player_one = (marble_count[0], current_game.get_captured("Player 1"))
+    player_two = (marble_count[1], current_game.get_captured("Player 2"))
+    turn = current_game.get_current_turn()
+    winner = current_game.get_winner()
+
+    if render_state["full"] or winner != render_state["winner"]:
+        draw_board()
+        declare_winner()
+        pygame.display.update()
+        dirty_rects = [screen.get_rect()]
+    else:
+        dirty_rects = []
+        drawn_board = render_state["board"]
+        for row_index in range(len(board)):
+            for col_index in range(len(board[row_index])):
+                if board[row_index][col_index] != drawn_board[row_index][col_index]:
+                    dirty_rects.append(draw_cell(row_index, col_index, board[row_index][col_index]))
+        if player_one != render_state["player_one"]:
+            dirty_rects.append(draw_region(player_one_scoreboard_rect, draw_player_one_scoreboard))
+        if player_two != render_state["player_two"]:
+            dirty_rects.append(draw_region(player_two_scoreboard_rect, draw_player_two_scoreboard))
+        if turn != render_state["turn"]:
+            dirty_rects.append(draw_region(player_turn_region, draw_player_turn))
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
+
+    render_state.update(full=False, board=board, player_one=player_one, player_two=player_two, turn=turn,
+                        winner=winner)
+    return len(dirty_rects) > 0
+
+
 def get_player_by_marble(marble_color):
     if marble_color == "W":
         return game[0].get_player_by_name("Player 1")
@@ -254,22 +375,40 @@ def get_player_by_marble(marble_color):
         return game[0].get_player_by_name("Player 2")
 
 
+def get_cell_at_position(screen_pos):
+    """Returns the board coordinate (row_index, col_index) of the cell under a position on the screen (x-value,
+    y-value), or None if the position is off the board. This is the inverse of get_cell_center."""
+    col_index = int((screen_pos[0] - left_edge) // grid_size)
+    row_index = int((screen_pos[1] - top_edge) // grid_size)
+    if 0 <= row_index < num_row and 0 <= col_index < num_col:
+        return row_index, col_index
+    return None
+
+
+def get_cell_center(row_index, col_index):
+    """Returns the position on the screen (x-value, y-value) of the center of the board cell at (row_index,
+    col_index)."""
+    return left_edge + grid_size/2 + grid_size * col_index, top_edge + grid_size/2 + grid_size * row_index
+
+
 def get_marble_at_click(click_pos):
     """Returns the color of the marble at a position clicked on the screen. Will only return W or B marbles, as these
-    are the only ones that can be played. Requires a positional coordinate on the screen as input (x-value, y-value)."""
-    marble_screen_coords = get_marble_coords()
-    # get the color of the marble that was clicked on
-    for marble_group in marble_screen_coords:
-        for marble in marble_group:
-            # calculate the offset from the click to each marble. If the click was within the radius of a marble
-            # position, then find out which marble group it was in to return the correct color
-            click_offset = ((click_pos[0] - marble[0]) ** 2 + (click_pos[1] - marble[1]) ** 2) ** 0.5
-            if click_offset <= grid_size / 2 - 10:
-                if marble in marble_screen_coords[0]:
-                    return "W", marble
-                if marble in marble_screen_coords[1]:
-                    return "B", marble
-    # if we can't find a marble within the area clicked, then return None, None
+    are the only ones that can be played. Requires a positional coordinate on the screen as input (x-value, y-value).
+    The click is mapped straight to the cell under it, so this costs the same however many marbles are on the
+    board."""
+    cell = get_cell_at_position(click_pos)
+    if cell is None:
+        return None, None
+
+    # the click has to be within the radius of the marble drawn in the cell
+    marble = get_cell_center(cell[0], cell[1])
+    if (click_pos[0] - marble[0]) ** 2 + (click_pos[1] - marble[1]) ** 2 > (grid_size / 2 - 10) ** 2:
+        return None, None
+
+    marble_color = game[0].get_marble(cell)
+    if marble_color == "W" or marble_color == "B":
+        return marble_color, marble
+    # if there isn't a playable marble in the cell clicked, then return None, None
     return None, None
 
 
@@ -279,9 +418,7 @@ def make_move(player, play_marble_screen_coord, direction):
     from the screen, so they are converted to regular list indices in order to use the make_move function from the
     KubaGame.py file."""
     # need to convert the screen coordinates to the board coordinates of the game
-    col_index = int((play_marble_screen_coord[0] - (left_edge + grid_size/2)) / grid_size)
-    row_index = int((play_marble_screen_coord[1] - (top_edge + grid_size/2)) / grid_size)
-    play_marble_board_coord = (row_index, col_index)
+    play_marble_board_coord = get_cell_at_position(play_marble_screen_coord)
 
     game[0].make_move(player.get_player_name(), play_marble_board_coord, direction)
 
@@ -289,11 +426,26 @@ def make_move(player, play_marble_screen_coord, direction):
 # start the pygame loop
 running = True
 play_needs = [None, None, None]
+clock = pygame.time.Clock()
 while running:
-    for event in pygame.event.get():
+    # handle the input that is waiting. If there is none, sleep until some arrives (waking up idle_fps times a second)
+    events = pygame.event.get()
+    if not events:
+        events = [pygame.event.wait(1000 // idle_fps)]
+    input_time = time.perf_counter()
+    input_received = False
+
+    for event in events:
         if event.type == pygame.QUIT:
             running = False
 
+        # the window needs to be drawn again after it has been covered up
+        if event.type == pygame.VIDEOEXPOSE:
+            render_state["full"] = True
+
+        if event.type == pygame.MOUSEBUTTONDOWN or event.type == pygame.KEYDOWN:
+            input_received = True
+
         # if the player clicks on the screen, compare the location of the click to interactive objects
         if event.type == pygame.MOUSEBUTTONDOWN:
 
@@ -303,8 +455,7 @@ while running:
                 reset()
 
             # if they click a marble, get the location and color to run the make_move function
-            marble_color = get_marble_at_click(event.pos)[0]
-            marble_location = get_marble_at_click(event.pos)[1]
+            marble_color, marble_location = get_marble_at_click(event.pos)
             play_needs[0] = marble_location
             play_needs[1] = marble_color
 
@@ -323,10 +474,6 @@ while running:
                 direction = "B"
                 play_needs[2] = direction
 
-
-    # draw the board
-    draw_board()
-
     # check for a move command
     # enforce that a click goes first
     if not play_needs[0]:
@@ -334,5 +481,16 @@ while running:
     if None not in play_needs:
         make_move(get_player_by_marble(play_needs[1]), play_needs[0], play_needs[2])
         play_needs = [None, None, None]
-    declare_winner()
-    pygame.display.update()
+
+    # draw the changes, if there are any
+    if input_received or render_state["full"]:
+        if render() and input_received:
+            redraw_latencies.append(time.perf_counter() - input_time)
+    clock.tick(max_fps)
+
+# run with --render-stats to print the redraw latency after the window is closed
+if "--render-stats" in sys.argv and redraw_latencies:
+    latencies = sorted(redraw_latencies)
+    print("redraws: %d  latency p50: %.2f ms  p90: %.2f ms  max: %.2f ms" % (
+        len(latencies), latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.9)] * 1000,
+        latencies[-1] * 1000))
@@ -4,16 +4,288 @@
 # KubaGame - contains 2 player objects, a board object, and a winner name. Contains methods to interact with the game
 # Player - contains attributes for player_name, marble_color, whether it's their turn, and number of captured neutral
 #          marbles. Has methods to get and set those attributes
-# Board - contains attributes _board and _prev_board. Initializes the _board to the starting position and stores the
-#         previous move's board for the "Ko rule" comparison. Contains methods for getting marbles a various number
-#         of ways to support the KubaGame and Player classes as well as a method for moving the marbles and returning
-#         the "next board" for the Ko rule comparison.
+# Board - contains attributes _position and _prev_position. Stores the position as one integer bitmask per marble
+#         color, initializes it to the starting position and stores the previous move's position for the "Ko rule"
+#         comparison. Contains methods for getting marbles a various number of ways to support the KubaGame and Player
+#         classes as well as a method for pushing the marbles and returning the "next position" for the Ko rule
+#         comparison. Every position carries a Zobrist hash that is updated with each push.
+# The board is 7 by 7 with the standard opening by default, but any size of at least 3 and any starting layout can be
+# used.
+
+import random
+
+# the standard board has 7 rows and 7 columns. Position bitmasks use bit row * size + col for space (row, col)
+_SIZE = 7
+
+# (row step, column step) for each push direction
+_DIRECTIONS = {"L": (0, -1), "R": (0, 1), "F": (-1, 0), "B": (1, 0)}
+
+# the direction opposite to each push direction
+_OPPOSITE = {"L": "R", "R": "L", "F": "B", "B": "F"}
+
+# index of each marble color inside a position tuple
+_COLOR_INDEX = {"W": 0, "B": 1, "R": 2}
+
+# the known legal moves of a game that hasn't looked for any yet, shared by every game until it finds one
+_NO_MOBILITY = (None, None)
+
+# the seed of the random Zobrist keys, so that position hashes are the same from run to run
+_ZOBRIST_SEED = 20210521
+
+try:
+    _popcount = int.bit_count
+except AttributeError:      # Python < 3.10
+    def _popcount(mask):
+        """Returns the number of set bits in a bitmask."""
+        return bin(mask).count("1")
+
+
+def _default_layout(size):
+    """Returns the opening layout for a board of the size given as a list of row strings ('-' for a blank space). It
+    scales the standard 7 by 7 opening: a square of white marbles in the top left and bottom right corners, a square
+    of black marbles in the other two corners (each (size + 1) // 4 spaces wide), and a diamond of red marbles around
+    the center reaching size // 2 - 1 spaces out."""
+    corner = (size + 1) // 4
+    radius = size // 2 - 1
+    rows = []
+    for row in range(size):
+        spaces = []
+        for col in range(size):
+            top, left = row < corner, col < corner
+            bottom, right = row >= size - corner, col >= size - corner
+            if (top and left) or (bottom and right):
+                spaces.append("W")
+            elif (top and right) or (bottom and left):
+                spaces.append("B")
+            elif abs(2 * row - (size - 1)) + abs(2 * col - (size - 1)) <= 2 * radius:
+                spaces.append("R")
+            else:
+                spaces.append("-")
+        rows.append("".join(spaces))
+    return rows
+
+
+class _Geometry:
+    """Holds the lookup tables for one board size. For every push direction: the bit offset between neighbouring
+    spaces (steps) and, for every space, the number of spaces from it to the edge of the board (ray_lengths), the bits
+    of those spaces (ray_masks), the bit of the space on the edge at the end of them (edges), and the bit of the space
+    that has to be blank for a push from it (behind, 0 on the edge the push starts from). Also holds the random 64-bit
+    Zobrist key of every (color, space), the change to the hash when a marble of each color moves one space in each
+    direction from each space (move_keys, falling off the board from the edge), and the default opening position.
+    A push walks the bits of the spaces in its line (rays) and looks up the move keys by bit (bit_move_keys); both are
+    gathered per direction in push_tables. Every table shares one int object per space, so the rays of even a large
+    board hold only references."""
+    __slots__ = ("size", "steps", "zobrist", "ray_lengths", "ray_masks", "edges", "move_keys", "behind", "rays",
+                 "push_tables", "opening_position", "opening_hash", "opening_counts")
+
+    def __init__(self, size):
+        """Builds the tables for a board with size rows and size columns."""
+        cells = size * size
+        self.size = size
+        self.steps = {direction: d_row * size + d_col for direction, (d_row, d_col) in _DIRECTIONS.items()}
+
+        # the seeded generator draws the keys in the same order for every size, so a 7 by 7 board keeps the hashes it
+        # has always had
+        zobrist_random = random.Random(_ZOBRIST_SEED)
+        self.zobrist = tuple(tuple(zobrist_random.getrandbits(64) for _ in range(cells)) for _ in _COLOR_INDEX)
+
+        self.ray_lengths = {}
+        self.ray_masks = {}
+        self.edges = {}
+        self.move_keys = {}
+        for direction, (d_row, d_col) in _DIRECTIONS.items():
+            step = self.steps[direction]
+            lengths = [0] * cells
+            masks = [0] * cells
+            edges = [0] * cells
+            # visit the spaces starting from the edge the push runs into, so the next space along is always done first
+            for cell in (range(cells - 1, -1, -1) if step > 0 else range(cells)):
+                row, col = divmod(cell, size)
+                bit = 1 << cell
+                if 0 <= row + d_row < size and 0 <= col + d_col < size:
+                    lengths[cell] = lengths[cell + step] + 1
+                    masks[cell] = masks[cell + step] | bit
+                    edges[cell] = edges[cell + step]
+                else:
+                    lengths[cell] = 1
+                    masks[cell] = bit
+                    edges[cell] = bit
+            self.ray_lengths[direction] = tuple(lengths)
+            self.ray_masks[direction] = tuple(masks)
+            self.edges[direction] = tuple(edges)
+            self.move_keys[direction] = tuple(
+                tuple(keys[cell] ^ (keys[cell + step] if lengths[cell] > 1 else 0) for cell in range(cells))
+                for keys in self.zobrist)
+
+        self.behind = {}
+        for direction in _DIRECTIONS:
+            opposite_step = self.steps[_OPPOSITE[direction]]
+            opposite_lengths = self.ray_lengths[_OPPOSITE[direction]]
+            self.behind[direction] = tuple(1 << (cell + opposite_step) if opposite_lengths[cell] > 1 else 0
+                                           for cell in range(cells))
+
+        bits = tuple(1 << cell for cell in range(cells))
+        self.rays = {}
+        self.push_tables = {}
+        for direction in _DIRECTIONS:
+            step = self.steps[direction]
+            lengths = self.ray_lengths[direction]
+            self.rays[direction] = tuple(tuple(bits[start:start + step * lengths[start]:step]) if step > 0 else
+                                         tuple(bits[start::step][:lengths[start]]) for start in range(cells))
+            # (step, rays, white, black and red move keys by bit)
+            self.push_tables[direction] = (step, self.rays[direction]) + tuple(
+                dict(zip(bits, keys)) for keys in self.move_keys[direction])
+
+        self.opening_position = _rows_to_position(_default_layout(size))
+        self.opening_hash = _zobrist_hash(self.opening_position, self)
+        self.opening_counts = tuple(_popcount(mask) for mask in self.opening_position)
+
+
+# the tables for each board size that has been used, built the first time a size is needed
+_GEOMETRIES = {}
+
+
+def _get_geometry(size):
+    """Returns the lookup tables for a board of the size given, building them the first time."""
+    geometry = _GEOMETRIES.get(size)
+    if geometry is None:
+        if size < 3:
+            raise ValueError("the board must be at least 3 by 3")
+        geometry = _GEOMETRIES[size] = _Geometry(size)
+    return geometry
+
+
+def _rows_to_position(board):
+    """Requires a square board as a list of rows of marble colors ('-' for a blank space; lists or strings) and returns
+    the matching position as a tuple of (white, black, red) bitmasks."""
+    size = len(board)
+    masks = [0, 0, 0]
+    for row_index, row in enumerate(board):
+        if len(row) != size:
+            raise ValueError("the board must have as many columns as rows")
+        for col_index, space in enumerate(row):
+            if space in _COLOR_INDEX:
+                masks[_COLOR_INDEX[space]] |= 1 << (row_index * size + col_index)
+    return tuple(masks)
+
+
+def _zobrist_hash(position, geometry):
+    """Requires a position tuple of (white, black, red) bitmasks and the tables for its board size, and returns its
+    64-bit Zobrist hash."""
+    position_hash = 0
+    for keys, mask in zip(geometry.zobrist, position):
+        while mask:
+            low_bit = mask & -mask
+            mask ^= low_bit
+            position_hash ^= keys[low_bit.bit_length() - 1]
+    return position_hash
+
+
+def _position_to_rows(position, size=_SIZE):
+    """Requires a position tuple of (white, black, red) bitmasks and its board size, and returns the board as a list
+    of lists."""
+    white, black, red = position
+    rows = []
+    for row_index in range(size):
+        row = []
+        for col_index in range(size):
+            bit = 1 << (row_index * size + col_index)
+            if white & bit:
+                row.append('W')
+            elif black & bit:
+                row.append('B')
+            elif red & bit:
+                row.append('R')
+            else:
+                row.append('-')
+        rows.append(row)
+    return rows
+
+
+def _remove_marble(marble_counts, color):
+    """Requires a tuple of (white, black, red) marble counts and a marble color, and returns the counts with one
+    marble of that color taken off."""
+    counts = list(marble_counts)
+    counts[_COLOR_INDEX[color]] -= 1
+    return tuple(counts)
+
+
+def _add_marble(marble_counts, color):
+    """Requires a tuple of (white, black, red) marble counts and a marble color, and returns the counts with one
+    marble of that color put back."""
+    counts = list(marble_counts)
+    counts[_COLOR_INDEX[color]] += 1
+    return tuple(counts)
+
+
+class MoveCache:
+    """Represents an opt-in cache of move checks that any number of games can share (see KubaGame.check_move). Each
+    entry holds the result of checking one move (the reason it is rejected or None, the color it knocks off, the next
+    position and its hash) keyed by the Zobrist hashes of the board and the previous board, the move and the color of
+    the player making it, so a change to the previous board (and with it the Ko rule) gives a different key. Holds at
+    most max_entries entries and drops the least recently used one when full. Counts hits, misses and evictions.
+    Contains methods as follows: get, store, clear, get_max_entries, and get_stats."""
+    __slots__ = ("_max_entries", "_entries", "_hits", "_misses", "_evictions")
+
+    def __init__(self, max_entries=100000):
+        """Creates an empty cache that holds at most max_entries entries."""
+        self._max_entries = max_entries
+        self._entries = {}      # in order of use, least recently used first
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        """Returns the number of entries in the cache."""
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the entry stored for the key and marks it as the most recently used, or returns None if there is
+        no entry."""
+        entries = self._entries
+        entry = entries.pop(key, None)
+        if entry is None:
+            self._misses += 1
+            return None
+        entries[key] = entry
+        self._hits += 1
+        return entry
+
+    def store(self, key, entry):
+        """Stores an entry for the key, dropping the least recently used entry if the cache is full."""
+        entries = self._entries
+        if key not in entries and len(entries) >= self._max_entries:
+            del entries[next(iter(entries))]
+            self._evictions += 1
+        entries[key] = entry
+
+    def clear(self):
+        """Removes all entries from the cache and sets the counts back to 0."""
+        self._entries.clear()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_max_entries(self):
+        """Returns the most entries the cache holds."""
+        return self._max_entries
+
+    def get_stats(self):
+        """Returns a dictionary with the number of entries, the most entries held, the hits, misses and evictions, and
+        the fraction of lookups that were hits."""
+        lookups = self._hits + self._misses
+        return {"entries": len(self._entries), "max_entries": self._max_entries, "hits": self._hits,
+                "misses": self._misses, "evictions": self._evictions,
+                "hit_rate": self._hits / lookups if lookups else 0.0}
+
 
 class Player:
     """Represents a player of the game. Contains an init method that creates a new player instance with marble color
     and player name required as inputs. Each player has 4 attributes (name, marble color, turn, and captured marble
     count). Contains get and set methods for these attributes as well as an add_captured_marble_count method that
-    adds 1 to the captured_marble_count."""
+    adds 1 to the captured_marble_count (and remove_captured_marble_count to take it back)."""
+    __slots__ = ("_player_name", "_marble_color", "_turn", "_captured_marble_count")
+
     def __init__(self, player_name, marble_color):
         """Creates a new player for the game. Requires inputs for the player name (string) and player color (W or B).
         Initializes the "turn" attribute to True to start the game (switches between True and False when it is or is
@@ -57,29 +329,87 @@ class Player:
         """Adds 1 to the captured marble count. No input and no return."""
         self._captured_marble_count += 1
 
+    def set_captured_marble_count(self, count):
+        """Requires an integer input and sets the captured marble count to it. Used when a game is restored from a
+        saved state."""
+        self._captured_marble_count = count
+
+    def remove_captured_marble_count(self):
+        """Subtracts 1 from the captured marble count when a capturing move is taken back. No input and no return."""
+        self._captured_marble_count -= 1
+
 
 class KubaGame:
     """Represents a game of Kuba. Each game is initialized with 2 player objects of the Player class, a starting board
      object of the Board class, and a winner value of None. Each instance of the game contains methods as follows:
      make_move, get_current_turn, update_current_turn, get_marble, get_captured, get_marble_count, get_winner,
-     next_legal_move, move_permission, get_player_by_name, and print_board."""
-
-    def __init__(self, *args):
+     legal_moves, has_legal_move, next_legal_move, move_permission, check_move, undo_move, undo, redo, seek, get_ply,
+     get_history_length, position_key, prev_position_key, get_player_by_name, get_player_names, get_size,
+     get_captures_to_win, get_move_cache, set_move_cache, get_state, from_state, copy_game, and print_board. Games
+     keep their attributes in slots rather than a dictionary, so that a server can hold a very large number of them at
+     once."""
+    __slots__ = ("_players", "_board", "_captures_to_win", "_winner", "_history", "_history_start", "_ply",
+                 "_mobility", "_move_cache")
+
+    def __init__(self, *args, size=_SIZE, layout=None, captures_to_win=None, move_cache=None, keep_history=False):
         """Creates a new Kuba game. Requires a tuple input of (player_name (str), marble_color (W or B)) for two
-        players. Creates a list of the players as instances of the Player class and initializes the board with an
-        instance of the Board class. Initializes the winner to None."""
-        self._players = []
-        # loop through the tuple input and create player objects for each player, assign them to the list of players
-        for tuple_input in args:
-            self._players.append(Player(tuple_input[0], tuple_input[1]))
-        self._board = Board()
+        players. Creates a tuple of the players as instances of the Player class and initializes the board with an
+        instance of the Board class.
+        Initializes the winner to None. The board size and a starting layout (a list of rows, see Board) can be given
+        for a variant; by default the game is played on the standard 7 by 7 board. A player wins by capturing
+        captures_to_win neutral marbles, by default one more than half of the neutral marbles on the starting board (7
+        on the standard board). A MoveCache can be given to remember the result of checking each move (it can be
+        shared by any number of games). The moves made are only kept, for undo, redo and seek, if keep_history is
+        True; a game that doesn't keep them only remembers its last move (so undo_move can still take that one back)
+        and stays the same size however many moves are made."""
+        # loop through the tuple input and create player objects for each player, assign them to the tuple of players
+        self._players = tuple(Player(tuple_input[0], tuple_input[1]) for tuple_input in args)
+        self._board = Board(size, layout)
+        if captures_to_win is None:
+            captures_to_win = self._board.get_marble_count()[2] // 2 + 1
+        self._captures_to_win = captures_to_win
         self._winner = None
+        # one record per move of (white, black and red spaces changed, change to the hash, index of the player who
+        # moved, color knocked off or None), with the spaces changed as the XOR of the position before and after the
+        # move, so only the line that was pushed is stored. None when the game doesn't keep its history. Moves after
+        # _ply have been taken back and can be made again with redo
+        self._history = [] if keep_history else None
+        # (previous position, its hash, both turn values) before the first move of the history. A game without its
+        # history keeps them from before its last move instead, followed by the index of the player who made it and
+        # the color knocked off (or None), until the move is taken back
+        self._history_start = None
+        self._ply = 0                   # number of moves of the history on the board
+        self._mobility = _NO_MOBILITY   # for W and B, the last (cell, direction) found to be a legal move
+        self._move_cache = move_cache
 
     def get_player_by_name(self, player_name):
-        """Returns the player object that matches the player name."""
-        for player in self._players:
-            if player.get_player_name() == player_name:
-                return player
+        """Returns the player object that matches the player name, or None if neither player has that name."""
+        player_one, player_two = self._players
+        if player_one.get_player_name() == player_name:
+            return player_one
+        if player_two.get_player_name() == player_name:
+            return player_two
+
+    def get_player_names(self):
+        """Returns the names of the two players in a tuple, in the order they were passed in when the game was
+        created."""
+        return self._players[0].get_player_name(), self._players[1].get_player_name()
+
+    def get_size(self):
+        """Returns the number of rows (and columns) of the board."""
+        return self._board.get_size()
+
+    def get_captures_to_win(self):
+        """Returns the number of neutral marbles a player has to capture to win."""
+        return self._captures_to_win
+
+    def get_move_cache(self):
+        """Returns the MoveCache used by check_move, or None if moves aren't cached."""
+        return self._move_cache
+
+    def set_move_cache(self, move_cache):
+        """Requires a MoveCache (or None to stop caching) and uses it for the moves checked from now on."""
+        self._move_cache = move_cache
 
     def get_current_turn(self):
         """Returns the player's name whose turn it currently is. If no one has played a move yet, returns None."""
@@ -110,6 +440,17 @@ class KubaGame:
         returns 'X'."""
         return self._board.get_marble(coord)
 
+    def position_key(self):
+        """Returns the 64-bit Zobrist hash of the current board. Equal boards always have equal keys, so the key can be
+        used in place of the board wherever a dictionary key is needed (different boards share a key only on a hash
+        collision, which is very unlikely)."""
+        return self._board.get_hash()
+
+    def prev_position_key(self):
+        """Returns the 64-bit Zobrist hash of the previous move's board (the board the Ko rule compares against), or
+        None if no move has been made."""
+        return self._board.get_prev_hash()
+
     def get_captured(self, player_name):
         """Takes a player name as input and returns the number of neutral marbles captured by that player."""
         player_obj = self.get_player_by_name(player_name)
@@ -119,30 +460,82 @@ class KubaGame:
         """Returns the number of white, black, and red marbles still on the board in a tuple in that order."""
         return self._board.get_marble_count()
 
+    def legal_moves(self, player_name):
+        """Takes a player name as input and yields every legal move for that player on the current board as a tuple of
+        (coord, direction), marbles in row-major order and directions in the order L, R, F, B. Moves are listed as if
+        it were that player's turn. Uses the same rules as move_permission but works on the board bitmasks directly,
+        so no player state is changed and a push is only simulated when it could undo the previous player's move.
+        Yields nothing once a winner has been crowned."""
+        if self._winner is not None:
+            return
+        color_index = _COLOR_INDEX[self.get_player_by_name(player_name).get_marble_color()]
+        own_marbles = self._board.get_position()[color_index]
+        size = self._board.get_size()
+
+        while own_marbles:
+            low_bit = own_marbles & -own_marbles
+            own_marbles ^= low_bit
+            cell = low_bit.bit_length() - 1
+            coord = divmod(cell, size)
+            for direction in "LRFB":
+                if self._is_legal_start(color_index, cell, direction):
+                    yield coord, direction
+
+    def _is_legal_start(self, color_index, cell, direction):
+        """Returns True if the player with the marble color index given (0 for W, 1 for B) can push from the cell
+        (row * 7 + col) in the direction given, as if it were their turn. Only the spaces on the line of the push are
+        looked at: the marble must be the player's, the space behind it must be blank (or off the board), and if
+        the line is full to the edge the marble on the edge must not be the player's. The push is only simulated for
+        the Ko rule, when every difference from the previous position lies on the line of the push."""
+        board = self._board
+        geometry = board.get_geometry()
+        position = board.get_position()
+        own = position[color_index]
+        if not own >> cell & 1:
+            return False
+        occupied = position[0] | position[1] | position[2]
+        if occupied & geometry.behind[direction][cell]:
+            return False
+        ray = geometry.ray_masks[direction][cell]
+        if occupied & ray == ray and own & geometry.edges[direction][cell]:
+            return False
+
+        # a push only changes spaces on its line, so it can only bring back the previous position when all of the
+        # spaces that differ from it are on that line
+        prev_position = board.get_prev_position()
+        if prev_position is not None:
+            changed = ((position[0] ^ prev_position[0]) | (position[1] ^ prev_position[1]) |
+                       (position[2] ^ prev_position[2]))
+            if not changed & ~ray:
+                captured, next_position, next_hash = board.push(divmod(cell, geometry.size), direction)
+                return not board.is_prev_position(next_position, next_hash)
+        return True
+
+    def has_legal_move(self, player_name):
+        """Takes a player name as input and returns True if that player has at least one legal move on the current
+        board (as if it were their turn), otherwise returns False. The last legal move found for each color is kept
+        and checked first. A move only stops being legal when a push changes its row or column (or it would undo
+        the previous move), so most of the time that one check answers the question and the board isn't searched."""
+        if self._winner is not None:
+            return False
+        color_index = _COLOR_INDEX[self.get_player_by_name(player_name).get_marble_color()]
+        known_move = self._mobility[color_index]
+        if known_move is not None and self._is_legal_start(color_index, known_move[0], known_move[1]):
+            return True
+
+        if self._mobility is _NO_MOBILITY:
+            # the shared starting value is copied before this game writes to it
+            self._mobility = [None, None]
+        for coord, direction in self.legal_moves(player_name):
+            self._mobility[color_index] = (coord[0] * self._board.get_size() + coord[1], direction)
+            return True
+        self._mobility[color_index] = None
+        return False
+
     def next_legal_move(self, player):
         """Requires a player object input and determines if that player has any legal moves available. Returns True if
         a player has a legal move on the current board. Returns False otherwise."""
-        # find where the player's marbles are on the board
-        player_marble_coords = self._board.get_marble_coords(player)
-        # save the starting turn value so that we after checking permissions we can set it back to original
-        player_turn = player.get_turn()
-
-        # check permission method for every marble on the board. If a legal move is found, return True
-        for coord in player_marble_coords:
-            # need to overwrite the turn to True so that we don't fail on not being their turn
-            player.set_turn(True)
-
-            # check permission for every direction
-            if (self.move_permission(player, coord, "L") or self.move_permission(player, coord, "R")
-                    or self.move_permission(player, coord, "F") or self.move_permission(player, coord, "B")):
-
-                # update the current turn to original and return True
-                player.set_turn(player_turn)
-                return True
-
-        # if we've made it to the end without returning (finding a legal move), return False
-        player.set_turn(player_turn)
-        return False
+        return self.has_legal_move(player.get_player_name())
 
     def move_permission(self, player, play_coord, direction):
         """Requires a player object, a coordinate of where a play is starting from (in tuple format of (row, col) and
@@ -152,63 +545,73 @@ class KubaGame:
         if the player is not pushing on their own marble, if a move would result in the player's own color falling off
         the board, or if the marble that they're pushing does not have an empty spot adjacent to and opposite from the
         motion of the push (e.g. a marble at (1,1) being pushed right has to have an empty spot at (1,0))."""
-        prev_board = self._board.get_prev_board()
-        move_marbles = self._board.move_marbles(play_coord, player, direction, self.get_marble(play_coord))
-        next_board = move_marbles[1]
-        own_marble_captured = move_marbles[2]
-
-        if direction == "L":
-            blank_space = (play_coord[0], play_coord[1] + 1)
-            board_edge = len(self._board.get_current_board()[play_coord[0]]) - 1
-            start_index = play_coord[1]
-
-        elif direction == "R":
-            blank_space = (play_coord[0], play_coord[1] - 1)
-            board_edge = 0
-            start_index = play_coord[1]
-
-        elif direction == "F":
-            blank_space = (play_coord[0] + 1, play_coord[1])
-            board_edge = len(self._board.get_current_board()[play_coord[0]]) - 1
-            start_index = play_coord[0]
-
-        else:
-            blank_space = (play_coord[0] - 1, play_coord[1])
-            board_edge = 0
-            start_index = play_coord[0]
-
+        return self.check_move(player, play_coord, direction)[0] is None
+
+    def check_move(self, player, play_coord, direction):
+        """Takes the same input as move_permission and simulates the push at most once. Returns a tuple with 4 values:
+        the reason the move is rejected ("turn", "winner", "color", "blocked", "own_marble" or "ko"; None if the move
+        is permissible), the color of the marble the push knocks off (None if no marble falls off or the push wasn't
+        simulated), the next position and the Zobrist hash of the next position (both None if the push wasn't
+        simulated). If the game has a MoveCache, the checks that only depend on the board are looked up in it first."""
         # check to make sure it's their turn
         if not player.get_turn():
-            return False
+            return "turn", None, None, None
 
         # check to make sure no one else has won
         elif self._winner is not None:
-            return False
-
-        # check to make sure that the player is playing their color
-        elif player.get_marble_color() != self.get_marble(play_coord):
-            return False
-
-        # check to make sure that the space adjacent to the marble is empty OR that it's at the edge of the board
-        elif start_index != board_edge and self.get_marble(blank_space) != "X":
-            return False
+            return "winner", None, None, None
+
+        # the rest of the checks only depend on the board, the previous board (for the Ko rule), the move and the
+        # player's color, so their result can be cached under those
+        move_cache = self._move_cache
+        if move_cache is None:
+            return self._check_board_move(player, play_coord, direction)
+        board = self._board
+        key = (board.get_hash(), board.get_prev_hash(), play_coord[0], play_coord[1], direction,
+               player.get_marble_color())
+        result = move_cache.get(key)
+        if result is None:
+            result = self._check_board_move(player, play_coord, direction)
+            move_cache.store(key, result)
+        return result
+
+    def _check_board_move(self, player, play_coord, direction):
+        """Runs the checks of check_move that only depend on the board and returns the same tuple."""
+        # check to make sure that the player is playing their color (get_marble counts a negative row or column from
+        # the far edge, but a push can only start from a space numbered from 0)
+        if player.get_marble_color() != self.get_marble(play_coord) or play_coord[0] < 0 or play_coord[1] < 0:
+            return "color", None, None, None
+
+        # check to make sure that the space adjacent to the marble is empty OR that it's at the edge of the board. The
+        # blank space is one step back from the direction of the push
+        d_row, d_col = _DIRECTIONS[direction]
+        blank_row = play_coord[0] - d_row
+        blank_col = play_coord[1] - d_col
+        size = self._board.get_size()
+        if 0 <= blank_row < size and 0 <= blank_col < size and self.get_marble((blank_row, blank_col)) != "X":
+            return "blocked", None, None, None
+
+        # only simulate the push once the cheap checks have passed
+        captured, next_position, next_hash = self._board.push(play_coord, direction)
 
         # check to make sure they won't knock their own color off
-        elif own_marble_captured:
-            return False
+        if captured is not None and captured == player.get_marble_color():
+            return "own_marble", captured, next_position, next_hash
 
-        # check to make sure moving the marbles right doesn't undo the previous player's move
-        elif next_board == prev_board:
-            return False
+        # check to make sure moving the marbles doesn't undo the previous player's move
+        elif self._board.is_prev_position(next_position, next_hash):
+            return "ko", captured, next_position, next_hash
 
         else:
-            return True
+            return None, captured, next_position, next_hash
 
     def get_winner(self):
         """This function requires no input. Determines if a winner has been crowned. If so, returns that player's
         name, otherwise returns None. A winner is crowned if any of the following occur: that player has collected 7
-        neutral balls, the opposing player has run out of legal moves, or the player has knocked off all of the opposing
-        player's balls."""
+        neutral balls (captures_to_win on a variant board), the opposing player has run out of legal moves, or the
+        player has knocked off all of the opposing player's balls. The marble counts are kept up to date by each move
+        and has_legal_move usually only has to check one move per player, so this takes about the same time whatever
+        the position."""
         # if the winner has already been crowned, just return the winner
         if self._winner is not None:
             return self._winner
@@ -220,7 +623,7 @@ class KubaGame:
             # how do we win?
             # if we capture 7 neutral balls
             for player in self._players:
-                if player.get_captured_marble_count() == 7:
+                if player.get_captured_marble_count() == self._captures_to_win:
                     self._winner = player.get_player_name()
                     return self._winner
 
@@ -236,10 +639,10 @@ class KubaGame:
                 return self._winner
 
             # if the opponent cannot move
-            if not self.next_legal_move(player_one):
+            if not self.has_legal_move(player_one.get_player_name()):
                 self._winner = player_two.get_player_name()
                 return self._winner
-            if not self.next_legal_move(player_two):
+            if not self.has_legal_move(player_two.get_player_name()):
                 self._winner = player_one.get_player_name()
                 return self._winner
 
@@ -247,35 +650,208 @@ class KubaGame:
         """Takes a coordinate in tuple format of the marble that the player would like to push from, the NAME of the
         player making the move, and the direction they wish to move. Directions can either be: L (left) R (right)
         F (forward) or B (backward). If the move is successful, updates the current turn, updates the captured marble
-        count of the player, and determines if a winner has been crowned. Returns True if the move was successful,
+        count of the player, and determines if a winning move was made. Returns True if the move was successful,
         otherwise returns false."""
         player_obj = self.get_player_by_name(player_name)
-        move_marbles_return = self._board.move_marbles(play_coord, player_obj, direction, self.get_marble(play_coord))
-
-        # check permission to move
-        if self.move_permission(player_obj, play_coord, direction):
-            # grab the next board
-            next_board = move_marbles_return[1]
 
-            # copy the current board
-            current_board = self._board.copy_board(self._board.get_current_board())
-
-            # set the current board to the previous board, and the next board to the current board
-            self._board.set_prev_board(current_board)
-            self._board.set_current_board(next_board)
-
-            # if a marble was captured, update the marble_captured count
-            if move_marbles_return[0]:
-                player_obj.add_captured_marble_count()
-
-            # update the current turn
-            self.update_current_turn(player_obj)
+        # check permission to move. The push is simulated once and the result is committed below
+        reason, captured, next_position, next_hash = self.check_move(player_obj, play_coord, direction)
+        if reason is not None:
+            return False
 
-            # determine if a winning move was made
-            self.get_winner()
-            return True
+        # remember what is needed to take the move back, if the game keeps its history. A new move drops the moves
+        # that were taken back
+        board = self._board
+        position = board.get_position()
+        position_hash = board.get_hash()
+        history = self._history
+        if history is not None:
+            ply = self._ply
+            if ply == 0:
+                self._history_start = (board.get_prev_position(), board.get_prev_hash(), self._players[0].get_turn(),
+                                       self._players[1].get_turn())
+            if ply < len(history):
+                del history[ply:]
+            history.append((position[0] ^ next_position[0], position[1] ^ next_position[1],
+                            position[2] ^ next_position[2], position_hash ^ next_hash,
+                            0 if player_obj is self._players[0] else 1, captured))
+            self._ply = ply + 1
         else:
-            return False
+            self._history_start = (board.get_prev_position(), board.get_prev_hash(), self._players[0].get_turn(),
+                                   self._players[1].get_turn(), 0 if player_obj is self._players[0] else 1, captured)
+
+        # set the current position to the previous position, and the next position to the current position. The
+        # marble counts only change when a marble is knocked off
+        marble_counts = board.get_marble_count()
+        if captured is not None:
+            marble_counts = _remove_marble(marble_counts, captured)
+        board.set_prev_position(position, position_hash)
+        board.set_position(next_position, next_hash, marble_counts)
+
+        # if a marble was captured, update the marble_captured count
+        if captured == "R":
+            player_obj.add_captured_marble_count()
+
+        # update the current turn
+        self.update_current_turn(player_obj)
+
+        # determine if a winning move was made
+        self.get_winner()
+        return True
+
+    def undo_move(self):
+        """Takes back the last move on the board. Restores the board, the previous board used by the Ko rule, the
+        captured marble count, the players' turns and the winner to what they were before that move. Returns True if a
+        move was taken back, or False if there is no move to take back. A game that keeps its history (see
+        keep_history and copy_game) can take back every move and make them again with redo; any other game can only
+        take back its last move, once."""
+        history = self._history
+        board = self._board
+        players = self._players
+        if history is None:
+            last_move = self._history_start
+            if last_move is None:
+                return False
+            self._history_start = None
+            before = last_move[:4]
+            mover_index, captured = last_move[4:]
+        else:
+            ply = self._ply
+            if not ply:
+                return False
+            ply -= 1
+            before = None if ply else self._history_start
+            mover_index, captured = history[ply][4:]
+
+        # the position before the move is the previous position kept for the Ko rule
+        position = board.get_prev_position()
+        position_hash = board.get_prev_hash()
+        marble_counts = board.get_marble_count()
+        if captured is not None:
+            marble_counts = _add_marble(marble_counts, captured)
+            if captured == "R":
+                players[mover_index].remove_captured_marble_count()
+        board.set_position(position, position_hash, marble_counts)
+
+        # the previous position is rebuilt from the move before, and the turns are the ones after that move (or the
+        # ones kept from before the move)
+        if before is None:
+            white_change, black_change, red_change, hash_change, mover_index = history[ply - 1][:5]
+            board.set_prev_position((position[0] ^ white_change, position[1] ^ black_change, position[2] ^ red_change),
+                                    position_hash ^ hash_change)
+            players[mover_index].set_turn(False)
+            players[1 - mover_index].set_turn(True)
+        else:
+            prev_position, prev_hash, player_one_turn, player_two_turn = before
+            board.set_prev_position(prev_position, prev_hash)
+            players[0].set_turn(player_one_turn)
+            players[1].set_turn(player_two_turn)
+
+        # a move can only be made while there is no winner
+        self._winner = None
+        if history is not None:
+            self._ply = ply
+        return True
+
+    def undo(self, moves=1):
+        """Takes back the last moves moves (or as many as have been made) one at a time with undo_move, and returns
+        the number taken back."""
+        moves_undone = 0
+        while moves_undone < moves and self.undo_move():
+            moves_undone += 1
+        return moves_undone
+
+    def redo(self, moves=1):
+        """Makes the next moves moves that were taken back again (or as many as there are) and returns the number
+        made. Making a new move after taking moves back drops them, so they can no longer be made with redo."""
+        if moves <= 0 or self._history is None or self._ply == len(self._history):
+            return 0
+        history = self._history
+        board = self._board
+        players = self._players
+        position = board.get_position()
+        position_hash = board.get_hash()
+        marble_counts = board.get_marble_count()
+        ply = self._ply
+        stop = min(ply + moves, len(history))
+        while ply < stop:
+            record = history[ply]
+            prev_position = position
+            prev_hash = position_hash
+            position = (position[0] ^ record[0], position[1] ^ record[1], position[2] ^ record[2])
+            position_hash ^= record[3]
+            captured = record[5]
+            if captured is not None:
+                marble_counts = _remove_marble(marble_counts, captured)
+                if captured == "R":
+                    players[record[4]].add_captured_marble_count()
+            ply += 1
+        board.set_prev_position(prev_position, prev_hash)
+        board.set_position(position, position_hash, marble_counts)
+        self.update_current_turn(players[record[4]])
+
+        # only the last move made can have won the game
+        moves_redone = ply - self._ply
+        self._ply = ply
+        self._winner = None
+        self.get_winner()
+        return moves_redone
+
+    def seek(self, ply):
+        """Takes back or makes again moves of the history until ply moves are on the board (0 for the position
+        before the first move). Raises ValueError if ply is outside the history."""
+        if not 0 <= ply <= self.get_history_length():
+            raise ValueError("ply must be from 0 to %d" % self.get_history_length())
+        if ply < self._ply:
+            self.undo(self._ply - ply)
+        elif ply > self._ply:
+            self.redo(ply - self._ply)
+
+    def get_ply(self):
+        """Returns the number of moves of the history that are on the board."""
+        return self._ply
+
+    def get_history_length(self):
+        """Returns the number of moves in the history, including moves that were taken back and can be made again
+        with redo."""
+        return 0 if self._history is None else len(self._history)
+
+    def get_state(self):
+        """Returns the state of the game as a compact tuple of plain values that is cheap to pickle and send to another
+        process: ((player_name, marble_color) for both players, the position bitmasks, the previous position bitmasks
+        (or None), both captured counts, both turn values, the winner, the board size and the captures needed to win.
+        The move history used by undo, redo and seek is not included."""
+        player_one, player_two = self._players
+        return (((player_one.get_player_name(), player_one.get_marble_color()),
+                 (player_two.get_player_name(), player_two.get_marble_color())),
+                self._board.get_position(), self._board.get_prev_position(),
+                (player_one.get_captured_marble_count(), player_two.get_captured_marble_count()),
+                (player_one.get_turn(), player_two.get_turn()), self._winner, self._board.get_size(),
+                self._captures_to_win)
+
+    @classmethod
+    def from_state(cls, state, move_cache=None, keep_history=False):
+        """Requires a state tuple from get_state and returns a new game in that state, using the MoveCache given (if
+        any) and keeping the moves made from now on if keep_history is True. The board size and captures needed to win
+        can be left off the end of the tuple for a standard game."""
+        players, position, prev_position, captured, turns, winner = state[:6]
+        size, captures_to_win = state[6:] if len(state) > 6 else (_SIZE, None)
+        game = cls(*players, size=size, captures_to_win=captures_to_win, move_cache=move_cache,
+                   keep_history=keep_history)
+        game._board.set_position(position)
+        game._board.set_prev_position(prev_position)
+        for player, captured_count, turn in zip(game._players, captured, turns):
+            player.set_captured_marble_count(captured_count)
+            player.set_turn(turn)
+        game._winner = winner
+        return game
+
+    def copy_game(self, keep_history=True):
+        """Returns a new game in the same state as this one, using the same MoveCache but without the moves made so
+        far. The copy keeps the moves made on it (so they can be taken back with undo_move) unless keep_history is
+        False. Search code makes and takes back its moves on a copy, so that the game it was given (including the
+        moves that can be made again with redo) is left untouched."""
+        return self.from_state(self.get_state(), self._move_cache, keep_history)
 
     def print_board(self):
         """This function prints the board for easier troubleshooting"""
@@ -285,44 +861,114 @@ class KubaGame:
 
 class Board:
     """Represents a board of a Kuba game. Initializes the board per the game instructions and keeps track of the
-    marble positions throughout the game. Contains two private data members (board and prev_board).
-    Contains methods as follows: get_current_board, set_current_board, get_prev_board, set_prev_board, copy_board,
-    get_marble, get_marble_coords, and move_marbles. Interacts with the Player class on certain methods as they
-    require a player object as input to return the correct information."""
-
-    def __init__(self):
-        """Creates a new game board and initializes it per the game instructions. No input required. The board is
-        modeled as a list of lists. Each row is a separate list. Each marble is represented by its color. Initializes
-        the prev_board to None."""
-        self._board = [
-            ['W', 'W', '-', '-', '-', 'B', 'B'],
-            ['W', 'W', '-', 'R', '-', 'B', 'B'],
-            ['-', '-', 'R', 'R', 'R', '-', '-'],
-            ['-', 'R', 'R', 'R', 'R', 'R', '-'],
-            ['-', '-', 'R', 'R', 'R', '-', '-'],
-            ['B', 'B', '-', 'R', '-', 'W', 'W'],
-            ['B', 'B', '-', '-', '-', 'W', 'W']
-        ]
-        self._prev_board = None
+    marble positions throughout the game. The position is stored as a tuple of three integer bitmasks (white, black,
+    red) where bit row * size + col is set when a marble of that color sits at (row, col), along with its Zobrist
+    hash. Contains six private data members (geometry, position, hash, marble_counts, prev_position and prev_hash).
+    Contains methods as follows: get_size, get_geometry, get_current_board, set_current_board, get_prev_board,
+    set_prev_board, get_position, set_position, get_hash, get_prev_position, set_prev_position, get_prev_hash,
+    is_prev_position, copy_board, get_marble, get_marble_coords, get_marble_count, push, and move_marbles. Interacts
+    with the Player class on certain methods as they require a player object as input to return the correct
+    information. Boards keep their attributes in slots, and a board at the standard opening shares the opening
+    position of its size (the bitmasks, hash and marble counts are immutable, so nothing is copied until a move is
+    made)."""
+    __slots__ = ("_geometry", "_position", "_hash", "_marble_counts", "_prev_position", "_prev_hash")
+
+    def __init__(self, size=_SIZE, layout=None):
+        """Creates a new game board and initializes it per the game instructions. By default the board is the standard
+        7 by 7 opening; a size (at least 3) gives the standard opening scaled to that size, and a layout (a square list
+        of rows of 'W', 'B', 'R' and '-' for a blank space, as lists or strings) sets the starting marbles, with the
+        size taken from the layout. The board is modeled as three bitmasks, one per marble color, along with the
+        Zobrist hash of that position. Initializes the prev_position (and its hash) to None. The number of marbles of
+        each color is kept with the position."""
+        if layout is not None:
+            size = len(layout)
+        self._geometry = _get_geometry(size)
+        self._prev_position = None
+        self._prev_hash = None
+        if layout is None:
+            self._position = self._geometry.opening_position
+            self._hash = self._geometry.opening_hash
+            self._marble_counts = self._geometry.opening_counts
+        else:
+            self.set_position(_rows_to_position(layout))
+
+    def get_size(self):
+        """Returns the number of rows (and columns) of the board."""
+        return self._geometry.size
+
+    def get_geometry(self):
+        """Returns the lookup tables for the size of the board (shared by every board of that size)."""
+        return self._geometry
 
     def get_current_board(self):
         """Returns the current board as a list of lists."""
-        return self._board
+        return _position_to_rows(self._position, self._geometry.size)
 
     def set_current_board(self, board):
-        """Requires a list of lists representing a board as input and sets the current board to that list. Used in this
-        program after the move permissions have passed to set the next_board from the move_direction methods to the
-        current board"""
-        self._board = board
+        """Requires a list of lists representing a board as input and sets the current board to that list."""
+        self.set_position(self._board_to_position(board))
+
+    def _board_to_position(self, board):
+        """Requires a list of lists representing a board and returns its position, checking it fits this board."""
+        if len(board) != self._geometry.size:
+            raise ValueError("the board must be %d by %d" % (self._geometry.size, self._geometry.size))
+        return _rows_to_position(board)
 
     def get_prev_board(self):
-        """Returns the previous move's board as a list of lists."""
-        return self._prev_board
+        """Returns the previous move's board as a list of lists, or None if no move has been made."""
+        if self._prev_position is None:
+            return None
+        return _position_to_rows(self._prev_position, self._geometry.size)
 
     def set_prev_board(self, prev_board):
         """Requires a list of lists as input representing the state of the board and sets the prev_board attribute
         equal to the input."""
-        self._prev_board = prev_board
+        if prev_board is None:
+            self.set_prev_position(None)
+        else:
+            self.set_prev_position(self._board_to_position(prev_board))
+
+    def get_position(self):
+        """Returns the current position as a tuple of (white, black, red) bitmasks."""
+        return self._position
+
+    def set_position(self, position, position_hash=None, marble_counts=None):
+        """Requires a tuple of (white, black, red) bitmasks and sets the current position to it. The Zobrist hash of
+        the position and its (white, black, red) marble counts can be passed in when they are already known,
+        otherwise they are computed."""
+        self._position = position
+        self._hash = _zobrist_hash(position, self._geometry) if position_hash is None else position_hash
+        if marble_counts is None:
+            marble_counts = (_popcount(position[0]), _popcount(position[1]), _popcount(position[2]))
+        self._marble_counts = marble_counts
+
+    def get_hash(self):
+        """Returns the 64-bit Zobrist hash of the current position."""
+        return self._hash
+
+    def get_prev_position(self):
+        """Returns the previous move's position as a tuple of bitmasks, or None if no move has been made."""
+        return self._prev_position
+
+    def set_prev_position(self, position, position_hash=None):
+        """Requires a tuple of (white, black, red) bitmasks (or None) and sets the previous position to it. The
+        Zobrist hash of the position can be passed in when it is already known, otherwise it is computed."""
+        self._prev_position = position
+        if position is None:
+            self._prev_hash = None
+        elif position_hash is None:
+            self._prev_hash = _zobrist_hash(position, self._geometry)
+        else:
+            self._prev_hash = position_hash
+
+    def get_prev_hash(self):
+        """Returns the Zobrist hash of the previous move's position, or None if no move has been made."""
+        return self._prev_hash
+
+    def is_prev_position(self, position, position_hash):
+        """Requires a position tuple and its Zobrist hash and returns True if it is the same as the previous move's
+        position (the Ko rule). The hashes are compared first and the full positions only when the hashes match."""
+        return position_hash == self._prev_hash and position == self._prev_position
 
     def copy_board(self, current_board):
         """Requires a board (list of lists) as input and returns a deep copy."""
@@ -336,96 +982,103 @@ class Board:
 
     def get_marble(self, coordinate):
         """Returns the marble color at a board coordinate specified in the input. Input must be in tuple format
-        (e.g. (row, column)) in list index numbering. If no marble is present returns an "X"."""
-        # check to make sure there is a marble at the location
-        if self._board[coordinate[0]][coordinate[1]] != "-":
-            return self._board[coordinate[0]][coordinate[1]]
-        else:
-            return "X"
+        (e.g. (row, column)) in list index numbering. If no marble is present returns an "X". As with the lists of rows
+        the board used to be kept in, a negative row or column counts from the far edge (-1 is the last one) and a
+        coordinate past either edge raises IndexError."""
+        row, col = coordinate
+        size = self._geometry.size
+        if not (-size <= row < size and -size <= col < size):
+            raise IndexError("list index out of range")
+        bit = 1 << (row % size * size + col % size)
+        white, black, red = self._position
+        if white & bit:
+            return "W"
+        if black & bit:
+            return "B"
+        if red & bit:
+            return "R"
+        return "X"
 
     def get_marble_coords(self, player):
         """Requires a player object as input and returns the location of their marbles as a list with coordinates in
         tuple format (row, column)"""
+        mask = self._position[_COLOR_INDEX[player.get_marble_color()]]
         marble_coords = []
-        for row_index in range(len(self._board[0])):
-            for col_index in range(len(self._board[0])):
-                if self.get_marble((row_index, col_index)) == player.get_marble_color():
-                    marble_coords.append((row_index, col_index))
+        while mask:
+            low_bit = mask & -mask
+            marble_coords.append(divmod(low_bit.bit_length() - 1, self._geometry.size))
+            mask ^= low_bit
         return marble_coords
 
     def get_marble_count(self):
         """Returns the number of white, black, and red marbles still on the board in a tuple in that order."""
-        white_marb = 0
-        black_marb = 0
-        red_marb = 0
-        for row in self._board:
-            for space in row:
-                if space == 'W':
-                    white_marb += 1
-                elif space == 'B':
-                    black_marb += 1
-                elif space == 'R':
-                    red_marb += 1
-        return white_marb, black_marb, red_marb
-
-    def move_marbles(self, play_coord, player, direction, current_marble, next_board=None):
-        """Takes a coordinate in tuple format of the marble that the player would like to push from (with (0, 0) being
-        the top left corner of the board), the player object making the move, the direction they wish to move (L, R, F,
-        or B), and the current_marble. Current_marble should always be initialized to the marble color at the starting
-        coordinates. Loops through the marbles that are adjacent to each other through use of a recursive function,
-        passing the adjacent marble in for the current_marble in each loop. Once a blank space or edge of the board
-        is reached, returns a tuple with 3 values: marble_captured (True if the player has knocked off a neutral red
-        ball, False otherwise), next_board (list of lists showing what the next move will look like), and
-        own_marble_captured (True if the player has knocked off their own color of marble, False otherwise)."""
-
-        play_row = play_coord[0]
-        play_col = play_coord[1]
-        neut_marble_captured = False
-        own_marble_captured = False
-
-        # at the start of the recursion copy the board to next_board so that we modify next_board instead of
-        # the current board. Only want to move marbles right if we pass the permissions
-        if next_board is None:
-            next_board = self.copy_board(self._board)
-            # if we're on the first move, a blank space will replace the current_marble that shifted to the next spot
-            next_board[play_row][play_col] = '-'
-
-        if direction == "L" or direction == "R":
-            if direction == "L":
-                next_marble_coord = (play_row, play_col - 1)
+        return self._marble_counts
+
+    def push(self, play_coord, direction):
+        """Takes a coordinate in tuple format of the marble that the player would like to push from and the direction
+        they wish to move (L, R, F, or B). Walks the line of adjacent marbles starting at the coordinate until a blank
+        space or the edge of the board is reached and shifts that line one space in the direction of the push. Does
+        not modify the board. Returns a tuple with 3 values: the color of the marble pushed off the board (None if no
+        marble fell off), the next position as a tuple of bitmasks, and the Zobrist hash of the next position. The work
+        grows with the length of the line of marbles pushed, not with the size of the board."""
+        row, col = play_coord
+        geometry = self._geometry
+        size = geometry.size
+        if not (0 <= row < size and 0 <= col < size):
+            raise IndexError("board coordinate out of range")
+        white, black, red = self._position
+        step, rays, white_keys, black_keys, red_keys = geometry.push_tables[direction]
+
+        # collect the line of marbles that will move and the change to the hash as each of them moves one space. The
+        # ray holds the bit of every space from the play coordinate to the edge of the board in the direction of the
+        # push
+        chain = 0
+        hash_change = 0
+        captured = None
+        for bit in rays[row * size + col]:
+            if white & bit:
+                hash_change ^= white_keys[bit]
+            elif black & bit:
+                hash_change ^= black_keys[bit]
+            elif red & bit:
+                hash_change ^= red_keys[bit]
             else:
-                next_marble_coord = (play_row, play_col + 1)
-            # if we hit the end of the list or the end of marble line, end the recursion and return marble_captured
-            if next_marble_coord[1] < 0 or next_marble_coord[1] == len(self._board[play_row]) or current_marble == "X":
-                # if we're on the last col and current_marble is R, update marble_captured to True
-                if current_marble == "R":
-                    neut_marble_captured = True
-                # if we're on the last col and current_marble is same color as player color, update own_marble_captured
-                # to True
-                if current_marble == player.get_marble_color():
-                    own_marble_captured = True
-                return neut_marble_captured, next_board, own_marble_captured
-
-        elif direction == "F" or direction == "B":
-            if direction == "F":
-                next_marble_coord = (play_row - 1, play_col)
+                break
+            chain |= bit
+        else:
+            # the line runs into the edge of the board, so the last marble in the line falls off
+            if white & bit:
+                captured = "W"
+            elif black & bit:
+                captured = "B"
             else:
-                next_marble_coord = (play_row + 1, play_col)
-            if next_marble_coord[0] < 0 or next_marble_coord[0] == len(self._board[play_row]) or current_marble == "X":
-                if current_marble == "R":
-                    neut_marble_captured = True
-                if current_marble == player.get_marble_color():
-                    own_marble_captured = True
-                return neut_marble_captured, next_board, own_marble_captured
-
-        # grab the marble color next to current_marble before we overwrite it
-        next_marble = self.get_marble(next_marble_coord)
-
-        # shift the current marble over into the next_marble spot
-        next_board[next_marble_coord[0]][next_marble_coord[1]] = current_marble
-
-        # run again
-        return self.move_marbles(next_marble_coord, player, direction, next_marble, next_board)
+                captured = "R"
+        if not chain:
+            return None, self._position, self._hash
+
+        # shift every marble in the line over by one space
+        moving = chain ^ bit if captured is not None else chain
+        if step > 0:
+            next_position = ((white & ~chain) | (white & moving) << step,
+                             (black & ~chain) | (black & moving) << step,
+                             (red & ~chain) | (red & moving) << step)
+        else:
+            step = -step
+            next_position = ((white & ~chain) | (white & moving) >> step,
+                             (black & ~chain) | (black & moving) >> step,
+                             (red & ~chain) | (red & moving) >> step)
+        return captured, next_position, self._hash ^ hash_change
+
+    def move_marbles(self, play_coord, player, direction, current_marble=None, next_board=None):
+        """Takes a coordinate in tuple format of the marble that the player would like to push from (with (0, 0) being
+        the top left corner of the board), the player object making the move, and the direction they wish to move (L,
+        R, F, or B). The current_marble and next_board inputs are kept for compatibility and are not used. Returns a
+        tuple with 3 values: marble_captured (True if the player has knocked off a neutral red ball, False
+        otherwise), next_board (list of lists showing what the next move will look like), and own_marble_captured
+        (True if the player has knocked off their own color of marble, False otherwise)."""
+        captured, next_position, next_hash = self.push(play_coord, direction)
+        return (captured == "R", _position_to_rows(next_position, self._geometry.size),
+                captured == player.get_marble_color())
 
 
 if __name__ == "__main__":
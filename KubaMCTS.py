@@ -0,0 +1,238 @@
+# Description: This program is a Monte Carlo Tree Search player for KubaGame that spreads its random playouts over
+# every CPU core. It contains the following classes:
+# SearchNode - one node of a search tree: the move that led to it, the player that made that move, its children, and
+#              its visit and win counts
+# KubaMCTS - runs root parallel MCTS. Each worker process grows its own tree from a compact copy of the game state
+#            (KubaGame.get_state) and the root statistics of all the trees are added together to pick the move.
+
+import concurrent.futures
+import math
+import os
+import random
+import time
+
+import KubaGame
+
+
+class SearchNode:
+    """Represents a node of the search tree. Holds the move that led to the node, the name of the player that made
+    that move, the child nodes, the moves that haven't been expanded yet, and the visit and win counts (wins are
+    counted for the player that made the move)."""
+    __slots__ = ("move", "mover", "parent", "children", "untried", "visits", "wins")
+
+    def __init__(self, move, mover, parent, untried):
+        """Creates a new node. Requires the move that led to it, the name of the player that made the move, the parent
+        node, and the list of legal moves from the node."""
+        self.move = move
+        self.mover = mover
+        self.parent = parent
+        self.children = []
+        self.untried = untried
+        self.visits = 0
+        self.wins = 0.0
+
+    def select_child(self, exploration):
+        """Returns the child with the highest UCT score."""
+        log_visits = math.log(self.visits)
+        best_child = None
+        best_score = -1.0
+        for child in self.children:
+            score = child.wins / child.visits + exploration * math.sqrt(log_visits / child.visits)
+            if score > best_score:
+                best_score = score
+                best_child = child
+        return best_child
+
+
+def _other_player(names, player_name):
+    """Returns the name of the player that isn't player_name."""
+    return names[1] if names[0] == player_name else names[0]
+
+
+def _make_move(game, player_name, move):
+    """Makes a move in a worker's game. Raises RuntimeError if the game rejects it, since the tree and the moves to
+    take back would no longer match the game."""
+    if not game.make_move(player_name, move[0], move[1]):
+        raise RuntimeError("%s can't make the move %s %s" % (player_name, move[0], move[1]))
+
+
+def _grow_tree(state, player_name, playouts, deadline, exploration, max_playout_moves, seed):
+    """Grows one search tree from a game state until either the playout budget is used up or the wall clock passes
+    the deadline (seconds since the epoch, None for no deadline). Returns a tuple with the number of playouts run and a
+    dictionary mapping each root move to a list of [visits, wins] for the player to move. Runs in the worker
+    processes."""
+    rng = random.Random(seed)
+    game = KubaGame.KubaGame.from_state(state, keep_history=True)
+    names = game.get_player_names()
+    root = SearchNode(None, _other_player(names, player_name), None, list(game.legal_moves(player_name)))
+
+    playouts_run = 0
+    while (playouts is None or playouts_run < playouts) and (deadline is None or time.time() < deadline):
+        node = root
+        moves_made = 0
+
+        # selection: follow the best children while every move of the node has been expanded
+        while not node.untried and node.children:
+            node = node.select_child(exploration)
+            _make_move(game, node.mover, node.move)
+            moves_made += 1
+
+        # expansion: add one child for a move that hasn't been tried yet
+        if node.untried and game.get_winner() is None:
+            move = node.untried.pop(rng.randrange(len(node.untried)))
+            mover = _other_player(names, node.mover)
+            _make_move(game, mover, move)
+            moves_made += 1
+            next_moves = [] if game.get_winner() is not None else list(game.legal_moves(_other_player(names, mover)))
+            child = SearchNode(move, mover, node, next_moves)
+            node.children.append(child)
+            node = child
+
+        # playout: random moves until someone wins or the playout runs too long (counted as a draw)
+        player_to_move = _other_player(names, node.mover)
+        playout_moves = 0
+        while game.get_winner() is None and playout_moves < max_playout_moves:
+            moves = list(game.legal_moves(player_to_move))
+            if not moves:
+                break
+            move = moves[rng.randrange(len(moves))]
+            _make_move(game, player_to_move, move)
+            moves_made += 1
+            playout_moves += 1
+            player_to_move = _other_player(names, player_to_move)
+        winner = game.get_winner()
+
+        # backpropagation
+        while node is not None:
+            node.visits += 1
+            if winner is None:
+                node.wins += 0.5
+            elif winner == node.mover:
+                node.wins += 1.0
+            node = node.parent
+
+        while moves_made:
+            game.undo_move()
+            moves_made -= 1
+        playouts_run += 1
+
+    return playouts_run, {child.move: [child.visits, child.wins] for child in root.children}
+
+
+class KubaMCTS:
+    """Represents a Monte Carlo Tree Search player. The playouts are split over a pool of worker processes (root
+    parallelization) and each worker only receives the compact game state. Contains methods as follows: search,
+    close, get_playouts, get_elapsed, get_playouts_per_second, and get_root_stats."""
+
+    def __init__(self, playouts=None, time_ms=None, workers=None, exploration=1.4, max_playout_moves=200, seed=None):
+        """Creates a new player. Takes a total playout budget and/or a time budget in milliseconds (at least one is
+        required), the number of worker processes (defaults to the number of CPU cores, 1 runs the search in this
+        process), the UCT exploration constant, the move limit for one playout before it counts as a draw, and an
+        optional random seed."""
+        if playouts is None and time_ms is None:
+            raise ValueError("a playout budget or a time budget is required")
+        self._playouts = playouts
+        self._time_ms = time_ms
+        self._workers = workers or os.cpu_count() or 1
+        self._exploration = exploration
+        self._max_playout_moves = max_playout_moves
+        self._rng = random.Random(seed)
+        self._pool = None
+        self._playouts_run = 0
+        self._elapsed = 0.0
+        self._root_stats = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Shuts down the worker processes."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def get_playouts(self):
+        """Returns the number of playouts run by the last search, over all workers."""
+        return self._playouts_run
+
+    def get_elapsed(self):
+        """Returns the wall clock time of the last search in seconds."""
+        return self._elapsed
+
+    def get_playouts_per_second(self):
+        """Returns the playouts run per second by the last search, over all workers."""
+        if self._elapsed == 0:
+            return 0.0
+        return self._playouts_run / self._elapsed
+
+    def get_root_stats(self):
+        """Returns a dictionary mapping each root move of the last search to [visits, wins] summed over all workers."""
+        return self._root_stats
+
+    def search(self, game, player_name):
+        """Takes a KubaGame and the name of the player to move, and returns the move with the most visits over all of
+        the workers' trees as (coord, direction), or None if the player has no legal move, it isn't their turn or the
+        game is over. The game isn't changed."""
+        start = time.perf_counter()
+        if game.get_winner() is not None or not game.get_player_by_name(player_name).get_turn():
+            self._playouts_run = 0
+            self._root_stats = {}
+            self._elapsed = time.perf_counter() - start
+            return None
+        deadline = None if self._time_ms is None else time.time() + self._time_ms / 1000
+        state = game.get_state()
+
+        # split the playout budget between the workers
+        if self._playouts is None:
+            budgets = [None] * self._workers
+        else:
+            share, extra = divmod(self._playouts, self._workers)
+            budgets = [share + (index < extra) for index in range(self._workers)]
+        jobs = [(state, player_name, budget, deadline, self._exploration, self._max_playout_moves,
+                 self._rng.getrandbits(64)) for budget in budgets if budget != 0]
+
+        if self._workers == 1:
+            results = [_grow_tree(*job) for job in jobs]
+        else:
+            if self._pool is None:
+                self._pool = concurrent.futures.ProcessPoolExecutor(self._workers)
+            futures = [self._pool.submit(_grow_tree, *job) for job in jobs]
+            results = [future.result() for future in futures]
+
+        # add the root statistics of every tree together
+        self._playouts_run = 0
+        self._root_stats = {}
+        for playouts_run, root_stats in results:
+            self._playouts_run += playouts_run
+            for move, (visits, wins) in root_stats.items():
+                totals = self._root_stats.setdefault(move, [0, 0.0])
+                totals[0] += visits
+                totals[1] += wins
+        self._elapsed = time.perf_counter() - start
+
+        if not self._root_stats:
+            moves = list(game.legal_moves(player_name))
+            return moves[0] if moves else None
+        return max(self._root_stats, key=lambda move: self._root_stats[move][0])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Runs one MCTS search from the opening position.")
+    parser.add_argument("--playouts", type=int, default=None, help="total playout budget")
+    parser.add_argument("--time-ms", type=int, default=2000, help="time budget in milliseconds")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    arguments = parser.parse_args()
+
+    opening = KubaGame.KubaGame(("Player 1", "W"), ("Player 2", "B"))
+    time_ms = None if arguments.playouts is not None else arguments.time_ms
+    with KubaMCTS(arguments.playouts, time_ms, arguments.workers, seed=arguments.seed) as player:
+        best_move = player.search(opening, "Player 1")
+        print("best move:", best_move)
+        print("playouts: %d in %.2f s (%.0f playouts/s)" % (
+            player.get_playouts(), player.get_elapsed(), player.get_playouts_per_second()))
@@ -0,0 +1,370 @@
+# Description: This program saves and loads full KubaGame states (board, previous board for the Ko rule, captured
+# counts, turn, player colors and captures needed to win) in two formats, and analyzes files of saved positions.
+#
+# Text notation - one line with six fields separated by spaces:
+#     WW3BB/WW1R1BB/2RRR2/1RRRRR1/2RRR2/BB1R1WW/BB3WW - 0,0 - WB 7
+#   1. the board, top row first, rows separated by '/': W, B and R are marbles and a number is that many blank spaces
+#   2. the previous board in the same format, or '-' if no move has been made
+#   3. the neutral marbles captured by player 1 and player 2
+#   4. whose turn it is: 1, 2, '-' if either player may move (the start of the game), or 0 if neither may (a game
+#      whose turns were both set to False, e.g. through KubaGame.from_state)
+#   5. the marble colors of player 1 and player 2 (WB or BW)
+#   6. the neutral marbles needed to win
+#
+# Binary encoding - a fixed-width record per state (30 bytes for the 7 by 7 board), little endian:
+#   board           2 bits per space: the (W or R) bitmask followed by the (B or R) bitmask, in record_size bytes
+#   previous board  the same (all zero if there is none)
+#   captured        one byte each for player 1 and player 2
+#   flags           bits 0-1: turn (1 = player 1, 2 = player 2, 3 = either, 0 = neither), bit 2: previous board present,
+#                   bit 3: player 1 plays B
+#   captures to win one byte
+#
+# The analyze command streams a file of positions (text lines, or binary records with --binary) through a pool of
+# worker processes in batches, so files of millions of positions are never loaded whole, and writes one line per
+# position: the legal moves for player 1, the legal moves for player 2 (each counted as if it were their turn) and the
+# winner's number (1 or 2, or '-').
+#
+# Usage: python KubaNotation.py sample --games 1000 --output positions.txt [--binary]
+#        python KubaNotation.py analyze positions.txt [--binary] [--workers 4] [--output results.txt]
+#        python KubaNotation.py convert positions.txt positions.bin [--to-text]
+
+import concurrent.futures
+import os
+import random
+import sys
+import time
+
+import KubaGame
+
+
+PLAYER_NAMES = ("Player 1", "Player 2")
+
+# positions sent to a worker at a time by analyze, and batches a worker can have queued
+BATCH_SIZE = 2000
+BATCHES_PER_WORKER = 4
+
+_MARBLE_INDEX = {"W": 0, "B": 1, "R": 2}
+_TURNS = {(True, False): "1", (False, True): "2", (True, True): "-", (False, False): "0"}
+_TURN_VALUES = {"1": (True, False), "2": (False, True), "-": (True, True), "0": (False, False)}
+_TURN_FLAGS = {(True, False): 1, (False, True): 2, (True, True): 3, (False, False): 0}
+_FLAG_TURNS = {1: (True, False), 2: (False, True), 3: (True, True), 0: (False, False)}
+
+
+# the text of each row seen so far, both ways: (size, white bits, black bits, red bits) <-> row text. Rows repeat a
+# lot from position to position, so most rows are looked up rather than built. Each cache is cleared when it fills.
+MAX_CACHED_ROWS = 100000
+_row_texts = {}
+_row_masks = {}
+
+
+def _row_to_text(size, white, black, red):
+    """Returns the text of one row from its white, black and red bits (bit 0 is the first column)."""
+    text = []
+    blanks = 0
+    for col in range(size):
+        bit = 1 << col
+        if white & bit:
+            space = "W"
+        elif black & bit:
+            space = "B"
+        elif red & bit:
+            space = "R"
+        else:
+            blanks += 1
+            continue
+        if blanks:
+            text.append(str(blanks))
+            blanks = 0
+        text.append(space)
+    if blanks:
+        text.append(str(blanks))
+    return "".join(text)
+
+
+def _text_to_row(size, text):
+    """Returns the white, black and red bits of one row from its text. Raises ValueError if the row doesn't have
+    size spaces or has a character other than W, B, R or a digit."""
+    masks = [0, 0, 0]
+    col = 0
+    blanks = 0
+    for character in text:
+        if character.isdigit():
+            blanks = blanks * 10 + int(character)
+            continue
+        col += blanks
+        blanks = 0
+        marble = _MARBLE_INDEX.get(character)
+        if marble is None:
+            raise ValueError("unknown board character %r" % character)
+        masks[marble] |= 1 << col
+        col += 1
+    col += blanks
+    if col != size:
+        raise ValueError("a row of the board has %d spaces, expected %d" % (col, size))
+    return tuple(masks)
+
+
+def board_to_text(position, size=7):
+    """Requires a position tuple of (white, black, red) bitmasks and its board size, and returns the board field of
+    the text notation."""
+    white, black, red = position
+    row_mask = (1 << size) - 1
+    rows = []
+    for shift in range(0, size * size, size):
+        key = (size, white >> shift & row_mask, black >> shift & row_mask, red >> shift & row_mask)
+        text = _row_texts.get(key)
+        if text is None:
+            if len(_row_texts) >= MAX_CACHED_ROWS:
+                _row_texts.clear()
+            text = _row_texts[key] = _row_to_text(*key)
+        rows.append(text)
+    return "/".join(rows)
+
+
+def text_to_board(text):
+    """Requires the board field of the text notation and returns a tuple of (position tuple, board size). Raises
+    ValueError if the board isn't square or has a character other than W, B, R or a digit."""
+    rows = text.split("/")
+    size = len(rows)
+    white = black = red = 0
+    shift = 0
+    for row in rows:
+        key = (size, row)
+        masks = _row_masks.get(key)
+        if masks is None:
+            if len(_row_masks) >= MAX_CACHED_ROWS:
+                _row_masks.clear()
+            masks = _row_masks[key] = _text_to_row(size, row)
+        white |= masks[0] << shift
+        black |= masks[1] << shift
+        red |= masks[2] << shift
+        shift += size
+    return (white, black, red), size
+
+
+def state_to_text(state):
+    """Requires a state tuple from KubaGame.get_state and returns it in the text notation. The player names and the
+    winner are not saved (the winner follows from the rest of the state)."""
+    players, position, prev_position, captured, turns, winner, size, captures_to_win = state
+    return "%s %s %d,%d %s %s%s %d" % (
+        board_to_text(position, size), "-" if prev_position is None else board_to_text(prev_position, size),
+        captured[0], captured[1], _TURNS[tuple(turns)], players[0][1], players[1][1], captures_to_win)
+
+
+def text_to_state(text, player_names=PLAYER_NAMES):
+    """Requires a line of the text notation and returns a state tuple for KubaGame.from_state, naming the players
+    with player_names. Raises ValueError if the line isn't valid notation."""
+    fields = text.split()
+    if len(fields) != 6:
+        raise ValueError("expected 6 fields, found %d" % len(fields))
+    board_field, prev_field, captured_field, turn_field, colors, captures_to_win = fields
+    position, size = text_to_board(board_field)
+    prev_position = None
+    if prev_field != "-":
+        prev_position, prev_size = text_to_board(prev_field)
+        if prev_size != size:
+            raise ValueError("the previous board is a different size")
+    captured = tuple(int(count) for count in captured_field.split(","))
+    if len(captured) != 2 or turn_field not in _TURN_VALUES or colors not in ("WB", "BW"):
+        raise ValueError("invalid captured, turn or color field")
+    players = ((player_names[0], colors[0]), (player_names[1], colors[1]))
+    return players, position, prev_position, captured, _TURN_VALUES[turn_field], None, size, int(captures_to_win)
+
+
+def encode_text(game):
+    """Returns the state of a KubaGame in the text notation."""
+    return state_to_text(game.get_state())
+
+
+def decode_text(text, player_names=PLAYER_NAMES):
+    """Returns a new KubaGame in the state given by a line of the text notation."""
+    return KubaGame.KubaGame.from_state(text_to_state(text, player_names))
+
+
+def record_size(size=7):
+    """Returns the number of bytes in a binary record for a board of the size given."""
+    return 2 * _board_bytes(size) + 4
+
+
+def _board_bytes(size):
+    """Returns the number of bytes a board of the size given takes in a binary record."""
+    return (2 * size * size + 7) // 8
+
+
+def state_to_binary(state):
+    """Requires a state tuple from KubaGame.get_state and returns it as a binary record (bytes). Raises ValueError
+    if a captured count or the captures needed to win doesn't fit in a byte."""
+    players, position, prev_position, captured, turns, winner, size, captures_to_win = state
+    cells = size * size
+    board_bytes = _board_bytes(size)
+    white, black, red = position
+    board = (white | red) | (black | red) << cells
+    flags = _TURN_FLAGS[tuple(turns)] | (players[0][1] == "B") << 3
+    prev_board = 0
+    if prev_position is not None:
+        white, black, red = prev_position
+        prev_board = (white | red) | (black | red) << cells
+        flags |= 4
+    return (board.to_bytes(board_bytes, "little") + prev_board.to_bytes(board_bytes, "little") +
+            bytes((captured[0], captured[1], flags, captures_to_win)))
+
+
+def binary_to_state(record, size=7, player_names=PLAYER_NAMES):
+    """Requires a binary record for a board of the size given and returns a state tuple for KubaGame.from_state,
+    naming the players with player_names."""
+    cells = size * size
+    board_bytes = _board_bytes(size)
+    low_mask = (1 << cells) - 1
+    board = int.from_bytes(record[:board_bytes], "little")
+    low, high = board & low_mask, board >> cells
+    position = (low & ~high, high & ~low, low & high)
+    captured_one, captured_two, flags, captures_to_win = record[2 * board_bytes:2 * board_bytes + 4]
+    prev_position = None
+    if flags & 4:
+        board = int.from_bytes(record[board_bytes:2 * board_bytes], "little")
+        low, high = board & low_mask, board >> cells
+        prev_position = (low & ~high, high & ~low, low & high)
+    colors = "BW" if flags & 8 else "WB"
+    players = ((player_names[0], colors[0]), (player_names[1], colors[1]))
+    return (players, position, prev_position, (captured_one, captured_two), _FLAG_TURNS[flags & 3], None, size,
+            captures_to_win)
+
+
+def encode_binary(game):
+    """Returns the state of a KubaGame as a binary record."""
+    return state_to_binary(game.get_state())
+
+
+def decode_binary(record, size=7, player_names=PLAYER_NAMES):
+    """Returns a new KubaGame in the state given by a binary record for a board of the size given."""
+    return KubaGame.KubaGame.from_state(binary_to_state(record, size, player_names))
+
+
+def read_batches(path, binary=False, size=7, batch_size=BATCH_SIZE):
+    """Reads a file of positions a batch at a time and yields each batch as a list of text lines (blank lines
+    skipped) or binary records. Only one batch is held in memory at a time."""
+    if binary:
+        width = record_size(size)
+        with open(path, "rb") as positions_file:
+            while True:
+                data = positions_file.read(width * batch_size)
+                if not data:
+                    return
+                if len(data) % width:
+                    raise ValueError("%s ends with a partial record" % path)
+                yield [data[offset:offset + width] for offset in range(0, len(data), width)]
+    else:
+        batch = []
+        with open(path) as positions_file:
+            for line in positions_file:
+                if line.strip():
+                    batch.append(line)
+                    if len(batch) == batch_size:
+                        yield batch
+                        batch = []
+        if batch:
+            yield batch
+
+
+def analyze_batch(batch, binary=False, size=7):
+    """Decodes a batch of positions and returns a list with one (player 1 legal moves, player 2 legal moves, winner
+    number or 0) tuple per position. Runs in the worker processes."""
+    results = []
+    for item in batch:
+        state = binary_to_state(item, size) if binary else text_to_state(item)
+        game = KubaGame.KubaGame.from_state(state)
+        winner = game.get_winner()
+        results.append((sum(1 for _ in game.legal_moves(PLAYER_NAMES[0])),
+                        sum(1 for _ in game.legal_moves(PLAYER_NAMES[1])),
+                        0 if winner is None else PLAYER_NAMES.index(winner) + 1))
+    return results
+
+
+def analyze_file(path, binary=False, size=7, workers=1, batch_size=BATCH_SIZE):
+    """Analyzes every position in a file and yields the results in file order (see analyze_batch). The batches are
+    spread over workers processes when workers is more than 1, with at most BATCHES_PER_WORKER batches per worker
+    waiting at a time so that reading the file never gets far ahead of the workers."""
+    batches = read_batches(path, binary, size, batch_size)
+    if workers <= 1:
+        for batch in batches:
+            for result in analyze_batch(batch, binary, size):
+                yield result
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = []
+        for batch in batches:
+            pending.append(pool.submit(analyze_batch, batch, binary, size))
+            if len(pending) >= workers * BATCHES_PER_WORKER:
+                for result in pending.pop(0).result():
+                    yield result
+        for future in pending:
+            for result in future.result():
+                yield result
+
+
+def sample_positions(games, seed, size=7):
+    """Plays random games from the opening and yields the state tuple before every move."""
+    rng = random.Random(seed)
+    for _ in range(games):
+        game = KubaGame.KubaGame((PLAYER_NAMES[0], "W"), (PLAYER_NAMES[1], "B"), size=size)
+        player_name = PLAYER_NAMES[0]
+        while game.get_winner() is None:
+            yield game.get_state()
+            move = rng.choice(list(game.legal_moves(player_name)))
+            game.make_move(player_name, move[0], move[1])
+            player_name = PLAYER_NAMES[1] if player_name == PLAYER_NAMES[0] else PLAYER_NAMES[0]
+        yield game.get_state()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Saves, converts and analyzes Kuba positions.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sample_parser = commands.add_parser("sample", help="write the positions of random games to a file")
+    sample_parser.add_argument("--games", type=int, default=1000, help="random games to play")
+    sample_parser.add_argument("--seed", type=int, default=1, help="random seed")
+    sample_parser.add_argument("--output", required=True, help="file to write")
+    sample_parser.add_argument("--binary", action="store_true", help="write binary records instead of text")
+    analyze_parser = commands.add_parser("analyze", help="count legal moves and find the winner of every position")
+    analyze_parser.add_argument("input", help="file of positions")
+    analyze_parser.add_argument("--binary", action="store_true", help="the file holds binary records")
+    analyze_parser.add_argument("--size", type=int, default=7, help="board size of binary records")
+    analyze_parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    analyze_parser.add_argument("--output", help="write the results here instead of standard output")
+    convert_parser = commands.add_parser("convert", help="convert a file between text and binary")
+    convert_parser.add_argument("input", help="file to read")
+    convert_parser.add_argument("output", help="file to write")
+    convert_parser.add_argument("--to-text", action="store_true", help="convert binary records to text")
+    convert_parser.add_argument("--size", type=int, default=7, help="board size of binary records")
+    arguments = parser.parse_args()
+
+    if arguments.command == "sample":
+        with open(arguments.output, "wb" if arguments.binary else "w") as output_file:
+            for sampled_state in sample_positions(arguments.games, arguments.seed):
+                output_file.write(state_to_binary(sampled_state) if arguments.binary else
+                                  state_to_text(sampled_state) + "\n")
+
+    elif arguments.command == "analyze":
+        start = time.perf_counter()
+        output_file = open(arguments.output, "w") if arguments.output else sys.stdout
+        analyzed = 0
+        for moves_one, moves_two, winner_number in analyze_file(arguments.input, arguments.binary, arguments.size,
+                                                                arguments.workers or os.cpu_count() or 1):
+            output_file.write("%d %d %s\n" % (moves_one, moves_two, winner_number or "-"))
+            analyzed += 1
+        if arguments.output:
+            output_file.close()
+        elapsed = time.perf_counter() - start
+        print("%d positions in %.2f s (%.0f positions/s)" % (analyzed, elapsed, analyzed / elapsed if elapsed else 0),
+              file=sys.stderr)
+
+    else:
+        with open(arguments.output, "w" if arguments.to_text else "wb") as output_file:
+            for position_batch in read_batches(arguments.input, arguments.to_text, arguments.size):
+                for item in position_batch:
+                    if arguments.to_text:
+                        output_file.write(state_to_text(binary_to_state(item, arguments.size)) + "\n")
+                    else:
+                        output_file.write(state_to_binary(text_to_state(item)))
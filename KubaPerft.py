@@ -0,0 +1,195 @@
+# Description: This program counts the full tree of legal moves from a position to a fixed depth (a "perft" count).
+# For every depth it reports the number of moves (nodes), the moves that push a neutral marble off (captures), the
+# moves that push an opponent's marble off (knockouts) and the moves that end the game (wins), along with the nodes
+# searched per second. The moves at the root can be split over a pool of worker processes. REFERENCE_COUNTS holds
+# counts recorded with the original list-of-lists rules (move_permission and move_marbles on every marble and
+# direction), so that a new board backend or move generator can be checked against them move for move: a change to
+# the rules shows up as a different count at some depth.
+#
+# Usage: python KubaPerft.py [--position opening] [--depth 4] [--workers 4] [--rules] [--check]
+#        python KubaPerft.py --board WW---BB/WW-R-BB/--RRR--/-RRRRR-/--RRR--/BB-R-WW/BB---WW --player "Player 2"
+
+import concurrent.futures
+import os
+import sys
+import time
+
+import KubaGame
+
+
+PLAYERS = (("Player 1", "W"), ("Player 2", "B"))
+
+# recorded positions: (board rows, previous board rows or None, captured counts, turns, player to move) with Player 1
+# on W and Player 2 on B. The midgame position has a previous board so the Ko rule is tested from the first move, and
+# the endgame position is close enough to the end that games are won inside the tree.
+POSITIONS = {
+    "opening": (['WW---BB', 'WW-R-BB', '--RRR--', '-RRRRR-', '--RRR--', 'BB-R-WW', 'BB---WW'], None,
+                (0, 0), (True, True), "Player 1"),
+    "midgame": (['--W-BBB', '-WRRR--', 'WWRRB--', '-RRRRR-', '-BRRBW-', '-----R-', '-BW---W'],
+                ['--W-BBB', '-WRRR--', '-WWRRB-', '-RRRRR-', '-BRRBW-', '-----R-', '-BW---W'],
+                (0, 0), (True, False), "Player 1"),
+    "endgame": (['-------', '-------', '-------', '--W-R-B', '-RB---W', '-B-W---', 'W---B--'],
+                ['-------', '-------', '-------', '--W-R-B', '-R-B--W', '-B-W---', 'W---B--'],
+                (5, 6), (True, False), "Player 1"),
+}
+
+# position name: (nodes, captures, knockouts, wins) for depth 1, 2, ... counted with the original rules
+REFERENCE_COUNTS = {
+    "opening": ((8, 0, 0, 0), (64, 0, 0, 0), (640, 0, 0, 0), (6384, 0, 16, 0), (70812, 0, 624, 0),
+                (782832, 0, 9380, 0)),
+    "midgame": ((12, 0, 0, 0), (109, 0, 11, 0), (1393, 0, 34, 0), (14096, 12, 1224, 0), (180086, 463, 6569, 0),
+                (1906992, 11114, 145302, 0)),
+    "endgame": ((11, 0, 0, 0), (103, 0, 1, 0), (1072, 0, 16, 0), (10084, 95, 203, 95), (104033, 225, 2027, 0),
+                (1004125, 13060, 24108, 13060)),
+}
+
+
+def game_from_rows(rows, prev_rows=None, captured=(0, 0), turns=(True, True)):
+    """Requires the board rows (strings or lists of 'W', 'B', 'R' and '-'), and optionally the previous board rows
+    for the Ko rule, both captured counts and both turn values. Returns a KubaGame in that position with Player 1
+    on W and Player 2 on B."""
+    board = KubaGame.Board(layout=rows)
+    prev_position = None if prev_rows is None else KubaGame.Board(layout=prev_rows).get_position()
+    return KubaGame.KubaGame.from_state((PLAYERS, board.get_position(), prev_position, captured, turns, None,
+                                         board.get_size(), None))
+
+
+def rule_moves(game, player_name):
+    """Yields every legal move for a player as (coord, direction) by asking move_permission about every one of their
+    marbles in every direction, the way the original game found moves. Slower than KubaGame.legal_moves, but it
+    checks each move with the rules directly."""
+    player = game.get_player_by_name(player_name)
+    for coord in game._board.get_marble_coords(player):
+        for direction in "LRFB":
+            if game.move_permission(player, coord, direction):
+                yield coord, direction
+
+
+def _count_move(game, player_name, opponent_name, coord, direction, counts):
+    """Makes one move and adds it to the counts for its depth ([nodes, captures, knockouts, wins]). The move is left
+    on the board for the caller to take back."""
+    red_before = game.get_marble_count()[2]
+    opponent_before = game.get_player_by_name(opponent_name).get_player_marble_count(game._board)
+    game.make_move(player_name, coord, direction)
+    counts[0] += 1
+    if game.get_marble_count()[2] != red_before:
+        counts[1] += 1
+    elif game.get_player_by_name(opponent_name).get_player_marble_count(game._board) != opponent_before:
+        counts[2] += 1
+    if game.get_winner() is not None:
+        counts[3] += 1
+
+
+def perft(game, player_name, depth, rules=False):
+    """Takes a KubaGame, the name of the player to move and a depth, and returns a list with [nodes, captures,
+    knockouts, wins] for every depth from 1 to depth. Moves come from KubaGame.legal_moves, or from move_permission
+    if rules is True. A copy of the game is searched with make_move and undo_move, so the game is left as it was."""
+    game = game.copy_game()
+    names = game.get_player_names()
+    totals = [[0, 0, 0, 0] for _ in range(depth)]
+
+    def search(player_name, opponent_name, ply):
+        # the move list is taken before any move is made, since the moves change the board it was read from
+        moves = list(rule_moves(game, player_name) if rules else game.legal_moves(player_name))
+        counts = totals[ply]
+        for coord, direction in moves:
+            _count_move(game, player_name, opponent_name, coord, direction, counts)
+            if ply + 1 < depth and game.get_winner() is None:
+                search(opponent_name, player_name, ply + 1)
+            game.undo_move()
+
+    if depth > 0 and game.get_winner() is None:
+        search(player_name, names[1] if names[0] == player_name else names[0], 0)
+    return totals
+
+
+def _perft_subtree(state, player_name, move, depth, rules):
+    """Makes one root move on the game restored from state and returns its counts for depth 1 to depth, the root
+    move included. Runs in the worker processes."""
+    game = KubaGame.KubaGame.from_state(state, keep_history=True)
+    names = game.get_player_names()
+    opponent_name = names[1] if names[0] == player_name else names[0]
+    root = [0, 0, 0, 0]
+    _count_move(game, player_name, opponent_name, move[0], move[1], root)
+    below = perft(game, opponent_name, depth - 1, rules) if game.get_winner() is None else []
+    return [root] + below + [[0, 0, 0, 0]] * (depth - 1 - len(below))
+
+
+def run_perft(game, player_name, depth, workers=1, rules=False):
+    """Counts the move tree of a game to depth for the player to move, splitting the root moves over workers processes
+    when workers is more than 1. Returns a tuple with the counts per depth (as returned by perft) and the time taken
+    in seconds. The game isn't changed."""
+    start = time.perf_counter()
+    if workers <= 1 or depth <= 1:
+        totals = perft(game, player_name, depth, rules)
+    else:
+        state = game.get_state()
+        moves = list(rule_moves(game, player_name) if rules else game.legal_moves(player_name))
+        totals = [[0, 0, 0, 0] for _ in range(depth)]
+        if game.get_winner() is None:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                futures = [pool.submit(_perft_subtree, state, player_name, move, depth, rules) for move in moves]
+                for future in futures:
+                    for total, counts in zip(totals, future.result()):
+                        for index, count in enumerate(counts):
+                            total[index] += count
+    return totals, time.perf_counter() - start
+
+
+def check_counts(name, totals):
+    """Compares counts per depth (as returned by perft) for a recorded position with its reference counts. Returns a
+    list of (depth, expected, counted) for every depth that differs, empty when they all match. Depths without a
+    reference count are skipped."""
+    expected = REFERENCE_COUNTS[name]
+    return [(depth + 1, tuple(expected[depth]), tuple(counts)) for depth, counts in enumerate(totals)
+            if depth < len(expected) and tuple(expected[depth]) != tuple(counts)]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Counts the legal move tree of a position to a fixed depth.")
+    parser.add_argument("--position", choices=sorted(POSITIONS), default="opening", help="recorded position to count")
+    parser.add_argument("--board", help="count this board instead, rows separated by / (e.g. WW---BB/WW-R-BB/...)")
+    parser.add_argument("--prev-board", help="the previous board for the Ko rule, in the same format as --board")
+    parser.add_argument("--captured", default="0,0", help="neutral marbles captured by Player 1 and Player 2")
+    parser.add_argument("--player", default="Player 1", help="player to move (Player 1 is W, Player 2 is B)")
+    parser.add_argument("--depth", type=int, default=3, help="depth of the tree to count")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes to split the root moves over")
+    parser.add_argument("--rules", action="store_true",
+                        help="find moves with move_permission on every marble instead of legal_moves")
+    parser.add_argument("--check", action="store_true",
+                        help="compare with the reference counts of the recorded position and exit 1 if they differ")
+    arguments = parser.parse_args()
+
+    if arguments.board:
+        player_one_captured, player_two_captured = (int(count) for count in arguments.captured.split(","))
+        start_game = game_from_rows(arguments.board.split("/"),
+                                    arguments.prev_board.split("/") if arguments.prev_board else None,
+                                    (player_one_captured, player_two_captured),
+                                    (True, True) if arguments.prev_board is None else
+                                    (arguments.player == PLAYERS[0][0], arguments.player == PLAYERS[1][0]))
+        to_move = arguments.player
+    else:
+        rows, prev_rows, captured_counts, turn_values, to_move = POSITIONS[arguments.position]
+        start_game = game_from_rows(rows, prev_rows, captured_counts, turn_values)
+
+    workers = arguments.workers or os.cpu_count() or 1
+    depth_counts, elapsed = run_perft(start_game, to_move, arguments.depth, workers, arguments.rules)
+    print("%5s %14s %12s %12s %12s" % ("depth", "nodes", "captures", "knockouts", "wins"))
+    for depth_index, (nodes, captures, knockouts, wins) in enumerate(depth_counts):
+        print("%5d %14d %12d %12d %12d" % (depth_index + 1, nodes, captures, knockouts, wins))
+    total_nodes = sum(counts[0] for counts in depth_counts)
+    print("%d nodes in %.2f s (%.0f nodes/s)" % (total_nodes, elapsed, total_nodes / elapsed if elapsed else 0.0))
+
+    if arguments.check:
+        if arguments.board:
+            print("--check only works with a recorded --position")
+            sys.exit(2)
+        differences = check_counts(arguments.position, depth_counts)
+        for depth_index, expected_counts, counted in differences:
+            print("depth %d: expected %s, counted %s" % (depth_index, expected_counts, counted))
+        if differences:
+            sys.exit(1)
+        checked = min(arguments.depth, len(REFERENCE_COUNTS[arguments.position]))
+        print("matches the reference counts to depth %d" % checked)
@@ -0,0 +1,236 @@
+# Description: This program is an opt-in profiler for the KubaGame engine. While a Profiler is enabled, the engine's
+# hot methods (make_move, move_permission, check_move, get_winner, next_legal_move, has_legal_move, undo_move,
+# move_marbles, push and copy_board) are replaced on their classes by wrappers that count and time every call, record
+# the length of every line of marbles a push walks and count the reason every rejected move was turned down. When it
+# is disabled the original methods are put back, so the engine runs exactly as before with no cost at all. The
+# results can be written as JSON or as a folded-stack file (one "caller;callee self-time" line per call path, in
+# microseconds) for flamegraph.pl, speedscope and similar tools.
+#
+# Usage in code:
+#     with KubaProfile.Profiler() as profiler:
+#         ... play games ...
+#     profiler.write_json("profile.json")
+#     profiler.write_folded("profile.folded")
+#
+# Usage: python KubaProfile.py [--games 20] [--seed 1] [--json profile.json] [--folded profile.folded]
+
+import functools
+import json
+import random
+import time
+
+import KubaGame
+
+
+# the methods wrapped while a profiler is enabled, as (class name in KubaGame, method name)
+INSTRUMENTED = (
+    ("KubaGame", "make_move"),
+    ("KubaGame", "move_permission"),
+    ("KubaGame", "check_move"),
+    ("KubaGame", "get_winner"),
+    ("KubaGame", "next_legal_move"),
+    ("KubaGame", "has_legal_move"),
+    ("KubaGame", "undo_move"),
+    ("Board", "move_marbles"),
+    ("Board", "push"),
+    ("Board", "copy_board"),
+)
+
+# the profiler that is enabled, if any (the wrappers are shared by every game, so only one can be enabled at a time)
+_active = None
+
+
+class Profiler:
+    """Represents a profiling session. Enabling it instruments the engine methods listed in INSTRUMENTED for every
+    game in the process, and disabling it restores them. Calls are timed with their callers, so the time spent inside
+    each method itself (not in the instrumented methods it calls) is known for every call path. Not thread safe.
+    Contains methods as follows: enable, disable, is_enabled, reset, get_function_stats, get_chain_lengths,
+    get_rejections, to_dict, write_json, and write_folded (also usable with a with statement)."""
+
+    def __init__(self):
+        """Creates a new profiler. It is not enabled until enable is called (or the with statement starts)."""
+        self._originals = {}
+        self._stack = []
+        self.reset()
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def enable(self):
+        """Instruments the engine methods. Raises RuntimeError if another profiler is already enabled."""
+        global _active
+        if _active is self:
+            return
+        if _active is not None:
+            raise RuntimeError("another profiler is already enabled")
+        for class_name, method_name in INSTRUMENTED:
+            engine_class = getattr(KubaGame, class_name)
+            original = engine_class.__dict__[method_name]
+            self._originals[(engine_class, method_name)] = original
+            setattr(engine_class, method_name,
+                    self._wrap(class_name + "." + method_name, original, _AFTER.get(method_name)))
+        _active = self
+
+    def disable(self):
+        """Puts the original engine methods back. The results collected so far are kept."""
+        global _active
+        if _active is not self:
+            return
+        for (engine_class, method_name), original in self._originals.items():
+            setattr(engine_class, method_name, original)
+        self._originals = {}
+        del self._stack[:]
+        _active = None
+
+    def is_enabled(self):
+        """Returns True if the profiler is enabled."""
+        return _active is self
+
+    def reset(self):
+        """Clears the results collected so far."""
+        self._functions = {}        # name -> [calls, total seconds, fastest call, slowest call]
+        self._folded = {}           # call path -> seconds spent in the last method of the path itself
+        self._chain_lengths = {}    # marbles in the line pushed -> pushes
+        self._rejections = {}       # reason -> rejected moves
+
+    def _wrap(self, name, function, after):
+        """Returns a wrapper for an engine method that times it, adds it to the call path and then calls after (if
+        given) with the profiler, the call's arguments and its return value."""
+        stack = self._stack
+        functions = self._functions
+        folded = self._folded
+        perf_counter = time.perf_counter
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # each stack frame is [call path, time spent in the instrumented methods it called]
+            frame = [stack[-1][0] + ";" + name if stack else name, 0.0]
+            stack.append(frame)
+            start = perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                stack.pop()
+                if stack:
+                    stack[-1][1] += elapsed
+                stats = functions.get(name)
+                if stats is None:
+                    functions[name] = [1, elapsed, elapsed, elapsed]
+                else:
+                    stats[0] += 1
+                    stats[1] += elapsed
+                    if elapsed < stats[2]:
+                        stats[2] = elapsed
+                    if elapsed > stats[3]:
+                        stats[3] = elapsed
+                folded[frame[0]] = folded.get(frame[0], 0.0) + elapsed - frame[1]
+            if after is not None:
+                after(self, args, result)
+            return result
+        return wrapper
+
+    def get_function_stats(self):
+        """Returns a dictionary keyed by method name ("KubaGame.make_move" and so on) of dictionaries with the number
+        of calls, the total time in milliseconds and the mean, fastest and slowest call in microseconds."""
+        return {name: {"calls": calls, "total_ms": total * 1e3, "mean_us": total / calls * 1e6,
+                       "min_us": fastest * 1e6, "max_us": slowest * 1e6}
+                for name, (calls, total, fastest, slowest) in self._functions.items()}
+
+    def get_chain_lengths(self):
+        """Returns a dictionary of marbles in the line pushed: number of pushes (0 for a push from a blank space)."""
+        return dict(self._chain_lengths)
+
+    def get_rejections(self):
+        """Returns a dictionary of reason ("turn", "winner", "color", "blocked", "own_marble" or "ko", see
+        KubaGame.check_move): number of moves rejected for that reason."""
+        return dict(self._rejections)
+
+    def to_dict(self):
+        """Returns all of the results as a dictionary that can be written as JSON."""
+        return {
+            "functions": self.get_function_stats(),
+            "push_chain_lengths": {str(length): count for length, count in sorted(self._chain_lengths.items())},
+            "rejected_moves": self.get_rejections(),
+        }
+
+    def write_json(self, path):
+        """Writes the results to a JSON file."""
+        with open(path, "w") as json_file:
+            json.dump(self.to_dict(), json_file, indent=2, sort_keys=True)
+
+    def write_folded(self, path):
+        """Writes the time spent in each method itself, by call path, to a folded-stack file: one line per path of
+        "caller;callee microseconds", the input format of flamegraph.pl."""
+        with open(path, "w") as folded_file:
+            for call_path, seconds in sorted(self._folded.items()):
+                folded_file.write("%s %d\n" % (call_path, max(1, round(seconds * 1e6))))
+
+
+def _after_push(profiler, args, result):
+    """Records the length of the line of marbles a push walked."""
+    board, play_coord, direction = args[:3]
+    geometry = board.get_geometry()
+    white, black, red = board.get_position()
+    occupied = white | black | red
+    length = 0
+    for bit in geometry.rays[direction][play_coord[0] * geometry.size + play_coord[1]]:
+        if not occupied & bit:
+            break
+        length += 1
+    profiler._chain_lengths[length] = profiler._chain_lengths.get(length, 0) + 1
+
+
+def _after_check_move(profiler, args, result):
+    """Counts the reason a move was rejected."""
+    reason = result[0]
+    if reason is not None:
+        profiler._rejections[reason] = profiler._rejections.get(reason, 0) + 1
+
+
+# extra recording done after a call, by method name
+_AFTER = {"push": _after_push, "check_move": _after_check_move}
+
+
+def _play_random_games(games, seed):
+    """Plays random games from the opening, trying random moves (legal or not) the way a player clicking around would
+    before falling back to a legal one, so that rejected moves are recorded as well."""
+    rng = random.Random(seed)
+    for _ in range(games):
+        game = KubaGame.KubaGame(("Player 1", "W"), ("Player 2", "B"))
+        player_name = "Player 1"
+        while game.get_winner() is None:
+            coord = (rng.randrange(7), rng.randrange(7))
+            if not game.make_move(player_name, coord, rng.choice("LRFB")):
+                move = rng.choice(list(game.legal_moves(player_name)))
+                game.make_move(player_name, move[0], move[1])
+            player_name = "Player 2" if player_name == "Player 1" else "Player 1"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Profiles random games of Kuba.")
+    parser.add_argument("--games", type=int, default=20, help="random games to play")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    parser.add_argument("--folded", help="write the folded stacks to this file")
+    arguments = parser.parse_args()
+
+    with Profiler() as session:
+        _play_random_games(arguments.games, arguments.seed)
+
+    print("%-24s %10s %12s %10s %10s" % ("method", "calls", "total ms", "mean us", "max us"))
+    for method, method_stats in sorted(session.get_function_stats().items(), key=lambda item: -item[1]["total_ms"]):
+        print("%-24s %10d %12.1f %10.2f %10.1f" % (method, method_stats["calls"], method_stats["total_ms"],
+                                                 method_stats["mean_us"], method_stats["max_us"]))
+    print("push line lengths:", dict(sorted(session.get_chain_lengths().items())))
+    print("rejected moves:", session.get_rejections())
+    if arguments.json:
+        session.write_json(arguments.json)
+    if arguments.folded:
+        session.write_folded(arguments.folded)
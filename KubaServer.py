@@ -0,0 +1,697 @@
+# Description: This program is a headless game server that hosts many KubaGame sessions in one process using asyncio.
+# Clients talk to it over TCP with one JSON object per line. It contains the following classes:
+# GameSession - one hosted game: its session ID, the two seats (connection and player name), the KubaGame, and the
+#               move timer
+# ClientConnection - the asyncio protocol for one client connection. Splits the incoming bytes into request lines and
+#                    queues the outgoing lines so they can be written in batches.
+# KubaServer - keeps every session in memory keyed by session ID, checks moves with KubaGame.make_move, sends the new
+#              state to both players after every move, and ends a game when the player to move runs out of time.
+# LoadClient - a load generator that opens many sessions against a server and plays random legal moves in all of them,
+#              reporting moves per second and move latency.
+#
+# Requests (client to server), each may carry a "ref" value that is echoed back in the direct reply:
+#   {"op": "create", "name": "Alice"}                                    -> {"op": "created", "session": ID, ...}
+#   {"op": "join", "session": ID, "name": "Bob"}                         -> "start" state sent to both players
+#   {"op": "move", "session": ID, "coord": [row, col], "direction": "L"} -> "state" sent to both players
+#   {"op": "state", "session": ID}                                       -> "state" sent to the caller
+#   {"op": "leave", "session": ID}                                       -> the other player wins by forfeit
+# A rejected request is answered with {"op": "error", "reason": ...}. For an illegal move the reason is the one given
+# by KubaGame.check_move ("turn", "color", "blocked", "own_marble", "ko", ...), and a request that can't be handled at
+# all gets "bad_request". The last state of a game has "over" set to true, with the winner and how the game ended
+# ("win", "forfeit", "timeout" or "disconnect").
+#
+# Usage: python KubaServer.py serve [--port 8765] [--move-timeout 30]
+#        python KubaServer.py load [--port 8765] [--sessions 10000] [--connections 200] [--think-ms 0]
+
+import asyncio
+import json
+import random
+import secrets
+import time
+
+import KubaGame
+
+
+# the longest request line accepted, in bytes
+MAX_LINE_BYTES = 4096
+
+# a client whose unsent output grows past this many bytes is too slow to keep up and is disconnected
+MAX_OUTBOX_BYTES = 1 << 20
+
+# seconds a player has to make each move before they lose the game
+DEFAULT_MOVE_TIMEOUT = 30.0
+
+MAX_NAME_LENGTH = 32
+BOARD_SIZE = 7
+COLORS = ("W", "B")
+
+
+def _encode(message):
+    """Returns a message as one line of compact JSON in bytes."""
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+class GameSession:
+    """Represents one hosted game. Holds the session ID, the connection and player name of each seat (the first seat
+    plays W and the second B), the KubaGame (created once the second player joins), the number of moves made, the last
+    move, the winner, how the game ended and the move timer."""
+    __slots__ = ("session_id", "connections", "names", "game", "ply", "last_move", "winner", "reason", "timer")
+
+    def __init__(self, session_id, connection, name):
+        """Creates a session waiting for a second player. Requires the session ID and the connection and name of the
+        player creating it."""
+        self.session_id = session_id
+        self.connections = [connection, None]
+        self.names = [name, None]
+        self.game = None
+        self.ply = 0
+        self.last_move = None
+        self.winner = None
+        self.reason = None
+        self.timer = None
+
+    def get_seat(self, connection):
+        """Returns the seat (0 or 1) held by the connection, or None if it doesn't play in this session."""
+        if self.connections[0] is connection:
+            return 0
+        if self.connections[1] is connection:
+            return 1
+        return None
+
+    def state_message(self, op, move_timeout):
+        """Returns the state of the game as an encoded message line with the op given."""
+        game = self.game
+        names = self.names
+        return _encode({
+            "op": op,
+            "session": self.session_id,
+            "players": [[names[0], COLORS[0]], [names[1], COLORS[1]]],
+            "board": ["".join(row) for row in game._board.get_current_board()],
+            "captured": [game.get_captured(names[0]), game.get_captured(names[1])],
+            "turn": game.get_current_turn(),
+            "ply": self.ply,
+            "last_move": self.last_move,
+            "over": self.reason is not None,
+            "winner": self.winner,
+            "reason": self.reason,
+            "move_timeout": move_timeout,
+        })
+
+
+class ClientConnection(asyncio.Protocol):
+    """Represents one client connection to the server. Incoming bytes are split into lines and handed to the server.
+    Outgoing lines are queued and written together when the server flushes, once per pass of the event loop."""
+
+    def __init__(self, server):
+        """Creates a connection for the server given."""
+        self._server = server
+        self._transport = None
+        self._buffer = b""
+        self._outbox = []
+        self._outbox_bytes = 0
+        self._paused = False
+        self.sessions = set()
+
+    def connection_made(self, transport):
+        """Called by asyncio when the connection is open."""
+        self._transport = transport
+        self._server.connection_opened(self)
+
+    def connection_lost(self, exc):
+        """Called by asyncio when the connection is closed."""
+        self._transport = None
+        self._outbox = []
+        self._server.connection_closed(self)
+
+    def data_received(self, data):
+        """Called by asyncio with incoming bytes. Hands every complete line to the server."""
+        if b"\n" not in data:
+            self._buffer += data
+        else:
+            lines = (self._buffer + data).split(b"\n")
+            self._buffer = lines.pop()
+            for line in lines:
+                if len(line) > MAX_LINE_BYTES:
+                    self.send(_encode({"op": "error", "reason": "line_too_long"}))
+                elif line.strip():
+                    self._server.handle_line(self, line)
+        if len(self._buffer) > MAX_LINE_BYTES:
+            self.send(_encode({"op": "error", "reason": "line_too_long"}))
+            self.close()
+
+    def pause_writing(self):
+        """Called by asyncio when the socket's write buffer is full. Output is queued until it drains."""
+        self._paused = True
+
+    def resume_writing(self):
+        """Called by asyncio when the socket's write buffer has drained."""
+        self._paused = False
+        if self._outbox:
+            self._server.schedule_flush(self)
+
+    def send(self, line):
+        """Queues an encoded line to be written with the next flush. A client that falls too far behind is
+        disconnected."""
+        if self._transport is None or self._transport.is_closing():
+            return
+        self._outbox.append(line)
+        self._outbox_bytes += len(line)
+        if self._outbox_bytes > MAX_OUTBOX_BYTES:
+            self._transport.abort()
+            return
+        self._server.schedule_flush(self)
+
+    def flush(self):
+        """Writes every queued line to the socket in one call."""
+        if self._paused or not self._outbox or self._transport is None or self._transport.is_closing():
+            return
+        self._transport.write(b"".join(self._outbox))
+        self._outbox = []
+        self._outbox_bytes = 0
+
+    def close(self):
+        """Closes the connection once the queued output has been written."""
+        if self._transport is not None:
+            self.flush()
+            self._transport.close()
+
+
+class KubaServer:
+    """Represents the game server. Sessions are kept in a dictionary keyed by session ID and every request is handled
+    straight away in the event loop, so the cost of a request doesn't depend on how many sessions are open. Move
+    timers are event loop timer handles rather than tasks. Contains methods as follows: start, serve_forever, close,
+    handle_line, connection_opened, connection_closed, schedule_flush, get_session_count, get_connection_count,
+    get_move_count, get_request_count, and get_finished_count."""
+
+    def __init__(self, move_timeout=DEFAULT_MOVE_TIMEOUT):
+        """Creates a server. Takes the seconds a player has to make each move."""
+        self._move_timeout = move_timeout
+        self._sessions = {}
+        self._connections = set()
+        self._dirty = set()
+        self._flush_scheduled = False
+        self._loop = None
+        self._server = None
+        self._moves = 0
+        self._requests = 0
+        self._finished = 0
+        self._handlers = {
+            "create": self._create,
+            "join": self._join,
+            "move": self._move,
+            "state": self._state,
+            "leave": self._leave,
+        }
+
+    async def start(self, host="127.0.0.1", port=8765):
+        """Starts listening on the host and port given (port 0 picks a free port) and returns the port."""
+        self._loop = asyncio.get_running_loop()
+        self._server = await self._loop.create_server(lambda: ClientConnection(self), host, port, backlog=1024)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """Serves until the server is closed."""
+        await self._server.serve_forever()
+
+    async def close(self):
+        """Stops listening, cancels the move timers and closes every connection."""
+        self._server.close()
+        for session in self._sessions.values():
+            if session.timer is not None:
+                session.timer.cancel()
+        for connection in list(self._connections):
+            connection.close()
+        await self._server.wait_closed()
+
+    def get_session_count(self):
+        """Returns the number of open sessions."""
+        return len(self._sessions)
+
+    def get_connection_count(self):
+        """Returns the number of open connections."""
+        return len(self._connections)
+
+    def get_move_count(self):
+        """Returns the number of moves made over all sessions."""
+        return self._moves
+
+    def get_request_count(self):
+        """Returns the number of requests handled."""
+        return self._requests
+
+    def get_finished_count(self):
+        """Returns the number of games that have ended."""
+        return self._finished
+
+    def connection_opened(self, connection):
+        """Registers a new connection."""
+        self._connections.add(connection)
+
+    def connection_closed(self, connection):
+        """Removes a closed connection. The other player wins any game it was playing and sessions it was waiting in
+        are closed."""
+        self._connections.discard(connection)
+        self._dirty.discard(connection)
+        for session_id in list(connection.sessions):
+            session = self._sessions.get(session_id)
+            if session is None:
+                continue
+            if session.game is None:
+                self._remove(session)
+            else:
+                seat = session.get_seat(connection)
+                self._finish(session, session.names[1 - seat], "disconnect")
+
+    def schedule_flush(self, connection):
+        """Marks a connection as having output to write. All marked connections are flushed together once the event
+        loop has handled the input that is ready."""
+        self._dirty.add(connection)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        """Writes the queued output of every marked connection."""
+        self._flush_scheduled = False
+        dirty = self._dirty
+        self._dirty = set()
+        for connection in dirty:
+            connection.flush()
+
+    def handle_line(self, connection, line):
+        """Decodes one request line from a connection and passes it to the handler for its op."""
+        self._requests += 1
+        try:
+            request = json.loads(line)
+        except ValueError:
+            connection.send(_encode({"op": "error", "reason": "bad_json"}))
+            return
+        if not isinstance(request, dict):
+            connection.send(_encode({"op": "error", "reason": "bad_json"}))
+            return
+        op = request.get("op")
+        handler = self._handlers.get(op) if isinstance(op, str) else None
+        if handler is None:
+            self._reply(connection, request, {"op": "error", "reason": "unknown_op"})
+            return
+        try:
+            handler(connection, request)
+        except Exception:
+            # a request the checks above let through must not take the whole connection down with it
+            self._reply(connection, request, {"op": "error", "reason": "bad_request"})
+
+    def _reply(self, connection, request, message):
+        """Sends a direct reply to a request, echoing its ref and session if it had them."""
+        if "ref" in request:
+            message["ref"] = request["ref"]
+        if "session" in request and "session" not in message:
+            message["session"] = request["session"]
+        connection.send(_encode(message))
+
+    def _get_session(self, request):
+        """Returns the session named by a request, or None if there is no such session."""
+        session_id = request.get("session")
+        if not isinstance(session_id, str):
+            return None
+        return self._sessions.get(session_id)
+
+    def _get_name(self, request, default):
+        """Returns the player name from a request (or the default), or None if it isn't a valid name."""
+        name = request.get("name", default)
+        if not isinstance(name, str) or not name or len(name) > MAX_NAME_LENGTH:
+            return None
+        return name
+
+    def _create(self, connection, request):
+        """Opens a new session with the caller in the first seat (W)."""
+        name = self._get_name(request, "Player 1")
+        if name is None:
+            self._reply(connection, request, {"op": "error", "reason": "bad_name"})
+            return
+        session_id = secrets.token_hex(8)
+        while session_id in self._sessions:
+            session_id = secrets.token_hex(8)
+        self._sessions[session_id] = GameSession(session_id, connection, name)
+        connection.sessions.add(session_id)
+        self._reply(connection, request, {"op": "created", "session": session_id, "name": name, "color": COLORS[0]})
+
+    def _join(self, connection, request):
+        """Puts the caller in the second seat (B) of a waiting session and starts the game."""
+        session = self._get_session(request)
+        if session is None:
+            self._reply(connection, request, {"op": "error", "reason": "no_session"})
+            return
+        if session.game is not None:
+            self._reply(connection, request, {"op": "error", "reason": "session_full"})
+            return
+        if session.connections[0] is connection:
+            self._reply(connection, request, {"op": "error", "reason": "own_session"})
+            return
+        name = self._get_name(request, "Player 2")
+        if name is None or name == session.names[0]:
+            self._reply(connection, request, {"op": "error", "reason": "bad_name"})
+            return
+        session.connections[1] = connection
+        session.names[1] = name
+        session.game = KubaGame.KubaGame((session.names[0], COLORS[0]), (name, COLORS[1]))
+        connection.sessions.add(session.session_id)
+        self._start_timer(session)
+        self._broadcast(session, "start")
+
+    def _move(self, connection, request):
+        """Makes a move for the caller's seat and sends the new state to both players."""
+        session = self._get_session(request)
+        if session is None:
+            self._reply(connection, request, {"op": "error", "reason": "no_session"})
+            return
+        seat = session.get_seat(connection)
+        if seat is None:
+            self._reply(connection, request, {"op": "error", "reason": "not_in_session"})
+            return
+        if session.game is None:
+            self._reply(connection, request, {"op": "error", "reason": "not_started"})
+            return
+        coord = request.get("coord")
+        direction = request.get("direction")
+        if (not isinstance(coord, list) or len(coord) != 2 or
+                not all(type(value) is int and 0 <= value < BOARD_SIZE for value in coord) or
+                direction not in ("L", "R", "F", "B")):
+            self._reply(connection, request, {"op": "error", "reason": "bad_move"})
+            return
+
+        game = session.game
+        name = session.names[seat]
+        coord = (coord[0], coord[1])
+        if not game.make_move(name, coord, direction):
+            reason = game.check_move(game.get_player_by_name(name), coord, direction)[0]
+            self._reply(connection, request, {"op": "error", "reason": reason})
+            return
+        self._moves += 1
+        session.ply += 1
+        session.last_move = [[coord[0], coord[1]], direction]
+        winner = game.get_winner()
+        if winner is not None:
+            self._finish(session, winner, "win")
+        else:
+            self._start_timer(session)
+            self._broadcast(session, "state")
+
+    def _state(self, connection, request):
+        """Sends the state of a session to the caller."""
+        session = self._get_session(request)
+        if session is None:
+            self._reply(connection, request, {"op": "error", "reason": "no_session"})
+        elif session.game is None:
+            self._reply(connection, request, {"op": "error", "reason": "not_started"})
+        else:
+            connection.send(session.state_message("state", self._move_timeout))
+
+    def _leave(self, connection, request):
+        """Takes the caller out of a session. The other player wins a game in progress by forfeit."""
+        session = self._get_session(request)
+        seat = None if session is None else session.get_seat(connection)
+        if seat is None:
+            self._reply(connection, request, {"op": "error", "reason": "not_in_session"})
+        elif session.game is None:
+            self._remove(session)
+            self._reply(connection, request, {"op": "left"})
+        else:
+            self._finish(session, session.names[1 - seat], "forfeit")
+
+    def _broadcast(self, session, op):
+        """Sends the state of a session to both players. The message is encoded once for both."""
+        line = session.state_message(op, self._move_timeout)
+        for connection in session.connections:
+            connection.send(line)
+
+    def _start_timer(self, session):
+        """Restarts the move timer of a session."""
+        if session.timer is not None:
+            session.timer.cancel()
+        session.timer = self._loop.call_later(self._move_timeout, self._move_timed_out, session)
+
+    def _move_timed_out(self, session):
+        """Ends a game whose player to move ran out of time. The other player wins, unless no move had been made yet
+        (either player could have moved first), in which case no one does."""
+        session.timer = None
+        turn = session.game.get_current_turn()
+        if turn is None:
+            self._finish(session, None, "timeout")
+        else:
+            winner = session.names[1] if turn == session.names[0] else session.names[0]
+            self._finish(session, winner, "timeout")
+
+    def _finish(self, session, winner, reason):
+        """Ends a game, sends the final state to both players and closes the session."""
+        session.winner = winner
+        session.reason = reason
+        self._finished += 1
+        self._broadcast(session, "state")
+        self._remove(session)
+
+    def _remove(self, session):
+        """Closes a session and stops its move timer."""
+        if session.timer is not None:
+            session.timer.cancel()
+            session.timer = None
+        del self._sessions[session.session_id]
+        for connection in session.connections:
+            if connection is not None:
+                connection.sessions.discard(session.session_id)
+
+
+class _LoadGame:
+    """Holds the load client's view of one session: the connections and names of both seats, a copy of the game used
+    to pick legal moves, the session ID, the number of moves applied, the seat, expected ply and send time of the
+    last move sent, and whether a move is waiting to be answered."""
+    __slots__ = ("connections", "names", "mirror", "session_id", "ply", "mover", "pending_ply", "sent_at", "waiting",
+                 "done")
+
+    def __init__(self, connections, names):
+        self.connections = connections
+        self.names = names
+        self.mirror = KubaGame.KubaGame((names[0], COLORS[0]), (names[1], COLORS[1]))
+        self.session_id = None
+        self.ply = 0
+        self.mover = None
+        self.pending_ply = None
+        self.sent_at = None
+        self.waiting = False
+        self.done = False
+
+
+class _LoadConnection(asyncio.Protocol):
+    """The asyncio protocol for one load client connection. Hands each incoming line to the load client."""
+
+    def __init__(self, client):
+        self._client = client
+        self._buffer = b""
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        lines = (self._buffer + data).split(b"\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            self._client.handle_message(self, json.loads(line))
+
+    def connection_lost(self, exc):
+        self._client.connection_lost(self)
+
+    def send(self, message):
+        self.transport.write(_encode(message))
+
+
+class LoadClient:
+    """Represents a load generator. Opens a number of sessions spread over a pool of connections (each session's two
+    seats are on different connections) and plays random legal moves in all of them until every game ends or reaches
+    the move limit, when the first player leaves. Contains methods as follows: run, handle_message, and
+    connection_lost."""
+
+    def __init__(self, sessions=1000, connections=100, max_moves=200, think_ms=0, seed=None):
+        """Creates a load client. Takes the number of sessions to open, the number of connections to spread them over
+        (at least 2), the moves to play in a session before leaving it, the milliseconds to wait before each move, and
+        an optional random seed."""
+        self._session_count = sessions
+        self._connection_count = max(2, connections)
+        self._max_moves = max_moves
+        self._think = think_ms / 1000
+        self._rng = random.Random(seed)
+        self._games = []
+        self._by_id = {}
+        self._loop = None
+        self._done = None
+        self._remaining = 0
+        self._started = 0
+        self._moves = 0
+        self._errors = 0
+        self._latencies = []
+        self._all_started_at = None
+
+    async def run(self, host="127.0.0.1", port=8765):
+        """Runs the load against the server at the host and port given and returns a dictionary of results."""
+        self._loop = asyncio.get_running_loop()
+        self._done = self._loop.create_future()
+        start = time.perf_counter()
+        connections = []
+        for _ in range(self._connection_count):
+            connections.append((await self._loop.create_connection(lambda: _LoadConnection(self), host, port))[1])
+
+        self._remaining = self._session_count
+        for index in range(self._session_count):
+            creator = connections[index % len(connections)]
+            joiner = connections[(index + 1) % len(connections)]
+            game = _LoadGame((creator, joiner), ("white %d" % index, "black %d" % index))
+            self._games.append(game)
+            creator.send({"op": "create", "name": game.names[0], "ref": index})
+        if self._session_count:
+            await self._done
+        elapsed = time.perf_counter() - start
+
+        for connection in connections:
+            connection.transport.close()
+        self._latencies.sort()
+        latencies = self._latencies or [0.0]
+        return {
+            "sessions": self._session_count,
+            "connections": len(connections),
+            "moves": self._moves,
+            "errors": self._errors,
+            "elapsed": elapsed,
+            "moves_per_second": self._moves / elapsed if elapsed else 0.0,
+            "all_started_after": self._all_started_at - start if self._all_started_at else None,
+            "latency_p50_ms": latencies[len(latencies) // 2] * 1000,
+            "latency_p90_ms": latencies[int(len(latencies) * 0.9)] * 1000,
+            "latency_p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        }
+
+    def connection_lost(self, connection):
+        """Stops the run if the server closes a connection before the games are over."""
+        if not self._done.done() and self._remaining:
+            self._done.set_exception(ConnectionError("the server closed a connection"))
+
+    def handle_message(self, connection, message):
+        """Handles one message from the server."""
+        op = message["op"]
+        if op == "created":
+            game = self._games[message["ref"]]
+            game.session_id = message["session"]
+            self._by_id[game.session_id] = game
+            game.connections[1].send({"op": "join", "session": game.session_id, "name": game.names[1]})
+        elif op in ("start", "state"):
+            self._handle_state(connection, self._by_id[message["session"]], message)
+        elif op == "error":
+            self._errors += 1
+            game = self._by_id.get(message.get("session"))
+            if game is not None and not game.done:
+                game.connections[0].send({"op": "leave", "session": game.session_id})
+
+    def _handle_state(self, connection, game, message):
+        """Brings the game's copy up to date with a state message and makes the next move if it is this seat's
+        turn."""
+        if game.done:
+            return
+        seat = 0 if connection is game.connections[0] else 1
+        if message["op"] == "start" and seat == 0:
+            self._started += 1
+            if self._started == self._session_count:
+                self._all_started_at = time.perf_counter()
+
+        if message["ply"] > game.ply:
+            coord, direction = message["last_move"]
+            game.mirror.make_move(game.names[game.mover], (coord[0], coord[1]), direction)
+            game.ply = message["ply"]
+            game.waiting = False
+            self._moves += 1
+        if seat == game.mover and message["ply"] == game.pending_ply:
+            # the latency of a move is measured on the connection that sent it
+            self._latencies.append(time.perf_counter() - game.sent_at)
+            game.pending_ply = None
+
+        if message["over"]:
+            game.done = True
+            self._remaining -= 1
+            if self._remaining == 0:
+                self._done.set_result(None)
+            return
+        turn = message["turn"]
+        to_move = 0 if turn is None or turn == game.names[0] else 1
+        if seat != to_move or game.waiting:
+            return
+        game.waiting = True
+        if game.ply >= self._max_moves:
+            connection.send({"op": "leave", "session": game.session_id})
+        elif self._think:
+            self._loop.call_later(self._think, self._send_move, game, seat)
+        else:
+            self._send_move(game, seat)
+
+    def _send_move(self, game, seat):
+        """Sends a random legal move for the seat given."""
+        if game.done:
+            return
+        moves = list(game.mirror.legal_moves(game.names[seat]))
+        coord, direction = moves[self._rng.randrange(len(moves))]
+        game.mover = seat
+        game.pending_ply = game.ply + 1
+        game.sent_at = time.perf_counter()
+        game.connections[seat].send({"op": "move", "session": game.session_id, "coord": list(coord),
+                                     "direction": direction})
+
+
+async def _serve(host, port, move_timeout, stats_interval):
+    """Runs a server until it is interrupted, printing statistics every stats_interval seconds (0 for none)."""
+    server = KubaServer(move_timeout)
+    port = await server.start(host, port)
+    print("serving on %s:%d" % (host, port))
+    serving = asyncio.ensure_future(server.serve_forever())
+    try:
+        last_moves = 0
+        while stats_interval:
+            await asyncio.sleep(stats_interval)
+            moves = server.get_move_count()
+            print("connections %6d  sessions %6d  finished %8d  moves %10d  %8.0f moves/s" % (
+                server.get_connection_count(), server.get_session_count(), server.get_finished_count(), moves,
+                (moves - last_moves) / stats_interval))
+            last_moves = moves
+        await serving
+    finally:
+        serving.cancel()
+        await server.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Hosts KubaGame sessions over TCP, or generates load against a host.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the game server")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--move-timeout", type=float, default=DEFAULT_MOVE_TIMEOUT,
+                              help="seconds a player has to make each move")
+    serve_parser.add_argument("--stats-interval", type=float, default=5.0,
+                              help="seconds between statistics lines (0 for none)")
+    load_parser = commands.add_parser("load", help="play random games against a running server")
+    load_parser.add_argument("--host", default="127.0.0.1")
+    load_parser.add_argument("--port", type=int, default=8765)
+    load_parser.add_argument("--sessions", type=int, default=10000, help="sessions to open at once")
+    load_parser.add_argument("--connections", type=int, default=200, help="connections to spread the sessions over")
+    load_parser.add_argument("--max-moves", type=int, default=200, help="moves to play before leaving a session")
+    load_parser.add_argument("--think-ms", type=int, default=0, help="milliseconds to wait before each move")
+    load_parser.add_argument("--seed", type=int, default=None, help="random seed")
+    arguments = parser.parse_args()
+
+    if arguments.command == "serve":
+        try:
+            asyncio.run(_serve(arguments.host, arguments.port, arguments.move_timeout, arguments.stats_interval))
+        except KeyboardInterrupt:
+            pass
+    else:
+        client = LoadClient(arguments.sessions, arguments.connections, arguments.max_moves, arguments.think_ms,
+                            arguments.seed)
+        results = asyncio.run(client.run(arguments.host, arguments.port))
+        for key, value in results.items():
+            print("%-20s %s" % (key, value))
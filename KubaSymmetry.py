@@ -0,0 +1,302 @@
+# Description: This program maps KubaGame positions to a canonical form. The rules of Kuba look the same after the
+# board is rotated or reflected (the 8 symmetries of the square), and after the W and B marbles swap colors along
+# with the players who own them. Every position therefore belongs to a class of up to 16 equivalent positions, and a
+# transposition table, opening book or tablebase only needs to store one of them: the canonical position. A position
+# is made canonical for the player to move by first swapping the colors if that player plays B (so the player to move
+# always plays W) and then picking the rotation or reflection with the smallest (white, black, red) bitmasks, with the
+# previous board used by the Ko rule going through the same transform. Moves are mapped between the original and the
+# canonical board with transform_move and the inverse transform.
+#
+# A transform is a number from 0 to 15: the low 3 bits pick one of the symmetries of the square in TRANSFORM_NAMES
+# (mapping space (row, col) on a board of n rows as listed there) and SWAP_COLORS (8) is set when the colors swap.
+#
+# Usage in code:
+#     key, transform = KubaSymmetry.canonical_key(game, "Player 1")
+#     ... look key up, and map a stored move back with transform_move(move, inverse(transform), size) ...
+#
+# Usage: python KubaSymmetry.py [--depth 4] [--size 7]
+
+import time
+
+import KubaGame
+
+
+# the symmetries of the square, by number: where space (row, col) goes on a board of n rows
+TRANSFORM_NAMES = (
+    "identity",             # (row, col)
+    "rotate 90",            # (col, n - 1 - row), clockwise
+    "rotate 180",           # (n - 1 - row, n - 1 - col)
+    "rotate 270",           # (n - 1 - col, row)
+    "mirror columns",       # (row, n - 1 - col), left and right swap
+    "mirror rows",          # (n - 1 - row, col), top and bottom swap
+    "transpose",            # (col, row)
+    "anti-transpose",       # (n - 1 - col, n - 1 - row)
+)
+_SPACE_MAPS = (
+    lambda row, col, last: (row, col),
+    lambda row, col, last: (col, last - row),
+    lambda row, col, last: (last - row, last - col),
+    lambda row, col, last: (last - col, row),
+    lambda row, col, last: (row, last - col),
+    lambda row, col, last: (last - row, col),
+    lambda row, col, last: (col, row),
+    lambda row, col, last: (last - col, last - row),
+)
+# the inverse of each symmetry of the square (only the rotations by 90 and 270 degrees undo each other)
+_INVERSES = (0, 3, 2, 1, 4, 5, 6, 7)
+
+# added to a transform when the W and B marbles (and the players who own them) swap colors
+SWAP_COLORS = 8
+
+# (row step, column step) for each push direction, as in KubaGame
+_DIRECTIONS = {"L": (0, -1), "R": (0, 1), "F": (-1, 0), "B": (1, 0)}
+
+# boards up to this size map bitmasks 8 spaces at a time through lookup tables; larger boards map them one marble at a
+# time, since the tables would hold too many large integers
+MAX_TABLE_SIZE = 11
+
+
+class _Symmetry:
+    """Holds the lookup tables for one board size: for every symmetry of the square, the bit each space goes to
+    (bits), tables that map each group of 8 spaces of a bitmask at once (chunk_tables, None for large boards) and the
+    direction each push direction turns into (directions)."""
+    __slots__ = ("size", "bits", "chunk_tables", "directions")
+
+    def __init__(self, size):
+        """Builds the tables for a board with size rows and size columns."""
+        cells = size * size
+        last = size - 1
+        self.size = size
+        self.bits = []
+        self.chunk_tables = []
+        self.directions = []
+        for space_map in _SPACE_MAPS:
+            bits = []
+            for cell in range(cells):
+                row, col = space_map(cell // size, cell % size, last)
+                bits.append(1 << (row * size + col))
+            self.bits.append(tuple(bits))
+
+            if size <= MAX_TABLE_SIZE:
+                tables = []
+                for first_cell in range(0, cells, 8):
+                    # each entry adds the lowest bit of its index to the entry without that bit
+                    table = [0] * 256
+                    for value in range(1, 256):
+                        low_bit = value & -value
+                        cell = first_cell + low_bit.bit_length() - 1
+                        table[value] = table[value ^ low_bit] | (bits[cell] if cell < cells else 0)
+                    tables.append(tuple(table))
+                self.chunk_tables.append(tuple(tables))
+            else:
+                self.chunk_tables.append(None)
+
+            # a step along a direction from any space is the same step everywhere once the board is turned
+            directions = {}
+            start_row, start_col = space_map(1, 1, last)
+            for direction, (d_row, d_col) in _DIRECTIONS.items():
+                row, col = space_map(1 + d_row, 1 + d_col, last)
+                step = (row - start_row, col - start_col)
+                directions[direction] = next(name for name, vector in _DIRECTIONS.items() if vector == step)
+            self.directions.append(directions)
+
+
+# the tables for each board size that has been used, built the first time a size is needed
+_SYMMETRIES = {}
+
+
+def _get_symmetry(size):
+    """Returns the lookup tables for a board of the size given, building them the first time."""
+    symmetry = _SYMMETRIES.get(size)
+    if symmetry is None:
+        symmetry = _SYMMETRIES[size] = _Symmetry(size)
+    return symmetry
+
+
+def _map_mask(symmetry, shape, mask):
+    """Returns a bitmask with every bit moved to where the symmetry of the square numbered shape (0 to 7) takes its
+    space."""
+    if not shape or not mask:
+        return mask
+    result = 0
+    tables = symmetry.chunk_tables[shape]
+    if tables is not None:
+        for table in tables:
+            result |= table[mask & 255]
+            mask >>= 8
+            if not mask:
+                break
+    else:
+        bits = symmetry.bits[shape]
+        while mask:
+            low_bit = mask & -mask
+            mask ^= low_bit
+            result |= bits[low_bit.bit_length() - 1]
+    return result
+
+
+def inverse(transform):
+    """Returns the transform that undoes the transform given."""
+    return _INVERSES[transform & 7] | transform & SWAP_COLORS
+
+
+def transform_position(position, transform, size=7):
+    """Requires a position tuple of (white, black, red) bitmasks (or None, for a missing previous board), a transform
+    and the board size, and returns the position after the transform."""
+    if position is None:
+        return None
+    symmetry = _get_symmetry(size)
+    shape = transform & 7
+    white, black, red = (_map_mask(symmetry, shape, mask) for mask in position)
+    if transform & SWAP_COLORS:
+        return black, white, red
+    return white, black, red
+
+
+def transform_coord(coord, transform, size=7):
+    """Returns the (row, col) coordinate that the space at coord goes to under the transform. Swapping colors doesn't
+    move any space."""
+    return _SPACE_MAPS[transform & 7](coord[0], coord[1], size - 1)
+
+
+def transform_move(move, transform, size=7):
+    """Requires a move as (coord, direction), a transform and the board size, and returns the same move on the board
+    after the transform. Map a move from the canonical board back to the original with the inverse transform."""
+    coord, direction = move
+    return transform_coord(coord, transform, size), _get_symmetry(size).directions[transform & 7][direction]
+
+
+def transform_state(state, transform):
+    """Requires a state tuple from KubaGame.get_state (or KubaNotation) and a transform, and returns the state after
+    the transform: both boards are transformed and, when the colors swap, each player keeps their name, captured count
+    and turn but plays the other color."""
+    players, position, prev_position, captured, turns, winner = state[:6]
+    size, captures_to_win = state[6:] if len(state) > 6 else (7, None)
+    if transform & SWAP_COLORS:
+        players = tuple((name, "B" if marble_color == "W" else "W") for name, marble_color in players)
+    return (players, transform_position(position, transform, size), transform_position(prev_position, transform, size),
+            captured, turns, winner, size, captures_to_win)
+
+
+def canonical_position(position, prev_position=None, color="W", size=7):
+    """Requires a position tuple of (white, black, red) bitmasks, the previous position for the Ko rule (or None), the
+    color of the player to move and the board size. Returns a tuple of (canonical position, canonical previous
+    position, transform) where the transform takes the position to the canonical one. The colors are swapped when B
+    is to move, so that W is always to move in the canonical position, and the symmetry of the square with the
+    smallest (white, black, red, previous white, previous black, previous red) bitmasks is picked; on a tie the
+    lowest numbered one is used, as the positions are then the same."""
+    swap = SWAP_COLORS if color == "B" else 0
+    if swap:
+        position = (position[1], position[0], position[2])
+        if prev_position is not None:
+            prev_position = (prev_position[1], prev_position[0], prev_position[2])
+
+    # compare one bitmask at a time and only map the next one for the symmetries still tied for the smallest, so
+    # that usually only the white marbles are mapped for every symmetry
+    symmetry = _get_symmetry(size)
+    shapes = range(8)
+    masks = position if prev_position is None else position + prev_position
+    mapped = []
+    for mask in masks:
+        values = [_map_mask(symmetry, shape, mask) for shape in shapes]
+        smallest = min(values)
+        mapped.append(smallest)
+        shapes = [shape for shape, value in zip(shapes, values) if value == smallest]
+        if len(shapes) == 1:
+            break
+    shape = shapes[0]
+    # the masks not compared yet are mapped with the symmetry picked
+    mapped.extend(_map_mask(symmetry, shape, mask) for mask in masks[len(mapped):])
+    return tuple(mapped[:3]), None if prev_position is None else tuple(mapped[3:]), shape | swap
+
+
+def canonical_state(state, player_name):
+    """Requires a state tuple from KubaGame.get_state (or KubaNotation) and the name of the player to move, and
+    returns a tuple of (canonical state, transform): the state after the transform picked by canonical_position (see
+    transform_state). KubaGame.from_state gives a game from it that plays the same way as the original."""
+    players, position, prev_position = state[:3]
+    size = state[6] if len(state) > 6 else 7
+    color = players[0][1] if players[0][0] == player_name else players[1][1]
+    transform = canonical_position(position, prev_position, color, size)[2]
+    return transform_state(state, transform), transform
+
+
+def canonical_key(game, player_name):
+    """Returns a tuple of (key, transform) for a KubaGame with player_name to move. The key is a hashable tuple that
+    is the same for every game equivalent to this one under the symmetries (whatever the player names): the canonical
+    position, the canonical previous position, the neutral marbles captured by the player to move and by their
+    opponent, the board size, the captures needed to win and the place of the player to move in the game's player
+    order (0 if they were passed to KubaGame first, else 1). The player order is part of the key because get_winner
+    checks the players in that order, so when neither player can move the second player wins; the color each player
+    owns is covered by the canonical position, where the player to move always plays W."""
+    names = game.get_player_names()
+    mover_index = 0 if names[0] == player_name else 1
+    opponent_name = names[1 - mover_index]
+    board = game._board
+    position, prev_position, transform = canonical_position(
+        board.get_position(), board.get_prev_position(), game.get_player_by_name(player_name).get_marble_color(),
+        board.get_size())
+    return (position, prev_position, game.get_captured(player_name), game.get_captured(opponent_name),
+            board.get_size(), game.get_captures_to_win(), mover_index), transform
+
+
+def count_classes(game, player_name, depth):
+    """Walks the move tree of a game to depth for the player to move and returns a list with (positions, canonical
+    positions) for every depth from 1 to depth: the number of different (board, previous board, captured counts,
+    player to move) states reached by exactly that many moves, and the number of classes of equivalent states among
+    them. A copy of the game is searched with make_move and undo_move, so the game is left as it was."""
+    game = game.copy_game()
+    names = game.get_player_names()
+    seen = [set() for _ in range(depth)]
+    canonical = [set() for _ in range(depth)]
+
+    def search(player_name, opponent_name, ply):
+        for coord, direction in list(game.legal_moves(player_name)):
+            game.make_move(player_name, coord, direction)
+            seen[ply].add((game.position_key(), game.prev_position_key(), game.get_captured(player_name),
+                           game.get_captured(opponent_name), opponent_name))
+            canonical[ply].add(canonical_key(game, opponent_name)[0])
+            if ply + 1 < depth and game.get_winner() is None:
+                search(opponent_name, player_name, ply + 1)
+            game.undo_move()
+
+    if depth > 0 and game.get_winner() is None:
+        search(player_name, names[1] if names[0] == player_name else names[0], 0)
+    return [(len(states), len(classes)) for states, classes in zip(seen, canonical)]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Counts the positions of a move tree that are the same up to the "
+                                                 "symmetries of the board and colors.")
+    parser.add_argument("--depth", type=int, default=4, help="depth of the move tree from the opening")
+    parser.add_argument("--size", type=int, default=7, help="rows (and columns) of the board")
+    arguments = parser.parse_args()
+
+    start_game = KubaGame.KubaGame(("Player 1", "W"), ("Player 2", "B"), size=arguments.size)
+    start = time.perf_counter()
+    counts = count_classes(start_game, "Player 1", arguments.depth)
+    elapsed = time.perf_counter() - start
+    print("%5s %12s %12s %8s" % ("depth", "positions", "canonical", "ratio"))
+    for depth_index, (positions, classes) in enumerate(counts):
+        print("%5d %12d %12d %8.2f" % (depth_index + 1, positions, classes, positions / classes if classes else 0.0))
+    print("searched in %.2f s" % elapsed)
+
+    # time canonical_key on the positions of a random game
+    timing_game = KubaGame.KubaGame(("Player 1", "W"), ("Player 2", "B"), size=arguments.size)
+    positions_timed = 0
+    timed = 0.0
+    to_move = "Player 1"
+    for _ in range(60):
+        if timing_game.get_winner() is not None:
+            break
+        start = time.perf_counter()
+        for _ in range(100):
+            canonical_key(timing_game, to_move)
+        timed += time.perf_counter() - start
+        positions_timed += 100
+        coord_to_play, direction_to_play = next(iter(timing_game.legal_moves(to_move)))
+        timing_game.make_move(to_move, coord_to_play, direction_to_play)
+        to_move = "Player 2" if to_move == "Player 1" else "Player 1"
+    print("canonical_key: %.1f us per position" % (timed / positions_timed * 1e6))
@@ -0,0 +1,1046 @@
+# Description: This program builds and reads an endgame tablebase for KubaGame: every position with only a few marbles
+# left, solved exactly. The generator works one material class (white, black and red marble counts) at a time, from
+# the fewest marbles up, since a push can only keep the marbles on the board or knock one off. Each class is split into
+# chunks of positions worked on by a pool of worker processes: every chunk lists the moves out of its positions, then
+# the class is solved backwards from the positions where the game ends in rounds, one ply further each round, with
+# each chunk settling its own positions and telling the others about the moves into them. Every chunk keeps its work
+# in files, so an interrupted run picks up from the last chunk listed or the last round settled. Every position is
+# stored as win, loss or draw for the player to move with the number of moves (plies) to the end of the game with
+# best play.
+#
+# A position in the table is the board, the color to move and the neutral marbles each color still needs to capture
+# (capped at one more than the red marbles left, since needing more than that is all the same). The Ko rule is solved
+# exactly: when the previous board can be brought back by a push, the position is stored again with that push
+# forbidden wherever the result differs. The table file is opened with mmap and read in place without copying:
+#
+#   header              magic, board size, color of the first player, number of classes
+#   class directory     white, black, red, offset of the values, offset and length of the Ko entries
+#   values              one unsigned 16-bit value per (board, captures needed, color to move), by index
+#   Ko entries          sorted (index * moves + forbidden move) keys and their values, found by binary search
+#
+# A value of 0 is a draw, (n << 1) | 1 a win in n plies and n << 1 a loss in n plies. The first player's color is
+# stored because get_winner checks the first player first when neither player can move; probes of games that list
+# the players the other way around return None.
+#
+# Usage: python KubaTablebase.py generate --white 2 --black 2 --red 0 [--workers 4] [--output kuba.tb]
+#        python KubaTablebase.py info --table kuba.tb
+#        python KubaTablebase.py probe --table kuba.tb --board -------/-W-B---/... [--prev-board ...] [--player ...]
+
+import array
+import bisect
+import concurrent.futures
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+import KubaGame
+
+
+MAGIC = b"KUBATB01"
+_HEADER = struct.Struct("<8sHHI")            # magic, board size, first player's color index, class count
+_CLASS_ENTRY = struct.Struct("<HHHHQQQ")     # white, black, red, padding, values offset, Ko offset, Ko entry count
+
+# the push directions in the order of the move codes (cell * 4 + direction index)
+DIRECTIONS = "LRFB"
+
+# a table value of DRAW means neither player can force a win
+DRAW = 0
+
+# the positions listed per chunk of work, and the marker for "no Ko move" in a chunk file
+CHUNK_POSITIONS = 40000
+_NO_KO = 0xFFFF
+
+# set in the move code of a message between chunks when the node the move leads to was won
+_WON_BIT = 0x8000
+
+# the outcomes of a move that ends the game, from the point of view of the player to move next
+_LOST_NOW = 1 << 16
+_WON_NOW = (1 << 16) + 1
+
+PLAYERS = (("Player 1", "W"), ("Player 2", "B"))
+
+
+def encode(result, distance):
+    """Returns the table value for a result ("win", "loss" or "draw") in distance plies."""
+    if result == "draw":
+        return DRAW
+    return distance << 1 | (result == "win")
+
+
+def decode(value):
+    """Returns a table value as a tuple of (result, distance in plies), with a distance of None for a draw."""
+    if value == DRAW:
+        return "draw", None
+    return ("win" if value & 1 else "loss"), value >> 1
+
+
+def _binomials(cells):
+    """Returns a table of binomial coefficients, C[n][k] for n and k from 0 to cells."""
+    table = [[0] * (cells + 2) for _ in range(cells + 2)]
+    for n in range(cells + 2):
+        table[n][0] = 1
+        for k in range(1, n + 1):
+            table[n][k] = table[n - 1][k - 1] + table[n - 1][k]
+    return table
+
+
+def _colex_masks(cells, count):
+    """Yields every bitmask with count of the cells (a list of cell numbers) set, in colex order, so the n-th mask
+    yielded has a _subset_rank of n."""
+    if count == 0:
+        yield 0
+        return
+    for top in range(count - 1, len(cells)):
+        top_bit = 1 << cells[top]
+        for rest in _colex_masks(cells[:top], count - 1):
+            yield rest | top_bit
+
+
+def _subset_rank(mask, removed, binomials):
+    """Returns the colex rank of the cells set in mask, numbering the cells without the ones set in removed."""
+    rank = 0
+    count = 1
+    while mask:
+        low_bit = mask & -mask
+        mask ^= low_bit
+        index = low_bit.bit_length() - 1 - KubaGame._popcount(removed & (low_bit - 1))
+        rank += binomials[index][count]
+        count += 1
+    return rank
+
+
+class _Material:
+    """Holds the sizes of one material class: the marble counts, the number of boards, the captures needed
+    combinations and the number of (board, captures needed, color to move) entries."""
+    __slots__ = ("counts", "black_boards", "red_boards", "boards", "need_range", "needs", "entries")
+
+    def __init__(self, counts, cells, binomials):
+        """Requires the (white, black, red) marble counts, the number of board spaces and a binomial table."""
+        white, black, red = counts
+        self.counts = counts
+        self.black_boards = binomials[cells - white][black]
+        self.red_boards = binomials[cells - white - black][red]
+        self.boards = binomials[cells][white] * self.black_boards * self.red_boards
+        self.need_range = red + 1
+        self.needs = self.need_range * self.need_range
+        self.entries = self.boards * self.needs * 2
+
+    def board_rank(self, position, binomials):
+        """Returns the index of a board (position tuple) among the boards of this class."""
+        white, black, red = position
+        return ((_subset_rank(white, 0, binomials) * self.black_boards + _subset_rank(black, white, binomials))
+                * self.red_boards + _subset_rank(red, white | black, binomials))
+
+    def need_index(self, white_needs, black_needs):
+        """Returns the index of the captures each color still needs (each capped at one more than the red marbles
+        left)."""
+        return (min(white_needs, self.need_range) - 1) * self.need_range + min(black_needs, self.need_range) - 1
+
+
+def material_classes(max_white, max_black, max_red, max_marbles=None):
+    """Returns the material classes up to the marble budget as a list of (white, black, red) counts, fewest marbles
+    first. Both players always have at least one marble, since the game is over when either has none."""
+    classes = [(white, black, red) for white in range(1, max_white + 1) for black in range(1, max_black + 1)
+               for red in range(max_red + 1) if max_marbles is None or white + black + red <= max_marbles]
+    return sorted(classes, key=lambda counts: (sum(counts), counts))
+
+
+def _is_legal(geometry, position, color_index, cell, direction):
+    """Returns True if the player of the color index given can push from the cell in the direction given, leaving
+    out the Ko rule: the marble must be theirs, the space behind it blank or off the board, and the push must not
+    knock off one of their own marbles."""
+    own = position[color_index]
+    occupied = position[0] | position[1] | position[2]
+    if occupied & geometry.behind[direction][cell]:
+        return False
+    ray = geometry.ray_masks[direction][cell]
+    return not (occupied & ray == ray and own & geometry.edges[direction][cell])
+
+
+def _push(geometry, position, cell, direction):
+    """Pushes the line of marbles starting at the cell one space in the direction given. Returns a tuple with the
+    color index of the marble knocked off (None if none fell off), the next position, and the bit of the space the
+    last marble of the line moved into (0 if a marble fell off)."""
+    white, black, red = position
+    occupied = white | black | red
+    chain = 0
+    end_bit = 0
+    for bit in geometry.rays[direction][cell]:
+        if not occupied & bit:
+            end_bit = bit
+            break
+        chain |= bit
+    captured = None
+    moving = chain
+    if not end_bit:
+        captured = 0 if white & bit else 1 if black & bit else 2
+        moving ^= bit
+    step = geometry.steps[direction]
+    if step > 0:
+        next_position = tuple((mask & ~chain) | (mask & moving) << step for mask in position)
+    else:
+        next_position = tuple((mask & ~chain) | (mask & moving) >> -step for mask in position)
+    return captured, next_position, end_bit
+
+
+def _has_move(geometry, position, color_index, forbidden):
+    """Returns True if the player of the color index given has a legal move other than the forbidden one (a move
+    code, or None)."""
+    own = position[color_index]
+    while own:
+        low_bit = own & -own
+        own ^= low_bit
+        cell = low_bit.bit_length() - 1
+        for direction_index, direction in enumerate(DIRECTIONS):
+            if cell * 4 + direction_index != forbidden and _is_legal(geometry, position, color_index, cell,
+                                                                     direction):
+                return True
+    return False
+
+
+def _reverse_move(geometry, position, end_bit, direction):
+    """Takes the position after a push that didn't knock anything off, the bit the last marble of the line moved
+    into and the direction of the push. Returns a tuple of (color index, move code) for the push that would put the
+    line back (the only push that brings back the previous position), or None if no player can make it."""
+    end_cell = end_bit.bit_length() - 1
+    opposite = KubaGame._OPPOSITE[direction]
+    occupied = position[0] | position[1] | position[2]
+    if occupied & geometry.behind[opposite][end_cell]:
+        return None
+    color_index = 0 if position[0] & end_bit else 1 if position[1] & end_bit else 2
+    if color_index == 2:
+        return None
+    return color_index, end_cell * 4 + DIRECTIONS.index(opposite)
+
+
+# the solved classes already opened by this process: counts -> (material, values)
+_SOLVED = {}
+
+
+def _solved_values(parts, counts, cells, binomials):
+    """Returns (material, values) for a class that has already been solved into the work directory, reading it the
+    first time it is needed."""
+    solved = _SOLVED.get((parts, counts))
+    if solved is None:
+        values = array.array("H")
+        with open(os.path.join(parts, "%d_%d_%d.values" % counts), "rb") as values_file:
+            values.fromfile(values_file, _Material(counts, cells, binomials).entries)
+        solved = _Material(counts, cells, binomials), values
+        _SOLVED[(parts, counts)] = solved
+    return solved
+
+
+def _generate_chunk(parts, size, first_color, counts, index, white_start, white_end, chunk_count, chunk_entries):
+    """Lists the moves out of every table entry whose white marbles are the white_start-th to white_end-th (colex
+    order) arrangement of the class given (chunk index of chunk_count, chunk_entries entries each) and writes them to
+    two work files. The edges file holds the offset of each entry's moves, each move's code and the entry it leads to
+    in this class (or -1 - an outcome code for a move that ends the game or knocks a marble off into an already
+    solved class), and for each entry the number of its moves to a won outcome and the rounds set by its outcomes
+    (see _outcome_round: the first round with a lost outcome and the last with a won one, 0 if none). The reverse
+    file sorts the moves that stay in the class by the chunk they lead to, as four arrays per chunk: the entries moved
+    to, the moves forbidden there by the Ko rule, the entries moved from and the move codes. Runs in the worker
+    processes."""
+    geometry = KubaGame._get_geometry(size)
+    cells = size * size
+    binomials = _binomials(cells)
+    material = _Material(counts, cells, binomials)
+    white_count, black_count, red_count = counts
+    first_index = KubaGame._COLOR_INDEX[first_color]
+    all_cells = list(range(cells))
+
+    offsets = array.array("I", [0])
+    move_codes = array.array("H")
+    targets = array.array("i")
+    won_counts = array.array("H")
+    win_rounds = array.array("H")
+    loss_rounds = array.array("H")
+    reverse = [(array.array("I"), array.array("H"), array.array("I"), array.array("H")) for _ in range(chunk_count)]
+    entry = index * chunk_entries
+
+    white_masks = _colex_masks(all_cells, white_count)
+    for _ in range(white_start):
+        next(white_masks)
+    for _ in range(white_start, white_end):
+        white = next(white_masks)
+        free_cells = [cell for cell in all_cells if not white >> cell & 1]
+        for black in _colex_masks(free_cells, black_count):
+            red_cells = [cell for cell in free_cells if not black >> cell & 1]
+            for red in _colex_masks(red_cells, red_count):
+                position = (white, black, red)
+                moves = (_list_moves(geometry, position, 0, first_index, material, parts, cells, binomials),
+                         _list_moves(geometry, position, 1, first_index, material, parts, cells, binomials))
+                for white_needs in range(1, material.need_range + 1):
+                    for black_needs in range(1, material.need_range + 1):
+                        needs = (white_needs, black_needs)
+                        for color_index in (0, 1):
+                            won = win_round = loss_round = 0
+                            for move in moves[color_index]:
+                                code, target, ko_move = _move_target(move, color_index, needs, material, cells,
+                                                                     binomials, parts)
+                                move_codes.append(code)
+                                targets.append(target)
+                                if target >= 0:
+                                    chunk_targets, chunk_ko, chunk_sources, chunk_codes = reverse[
+                                        target // chunk_entries]
+                                    chunk_targets.append(target)
+                                    chunk_ko.append(ko_move)
+                                    chunk_sources.append(entry)
+                                    chunk_codes.append(code)
+                                    continue
+                                result = _outcome_round(-1 - target)
+                                if result is None:
+                                    continue
+                                if result[0]:
+                                    won += 1
+                                    loss_round = max(loss_round, result[1])
+                                elif not win_round or result[1] < win_round:
+                                    win_round = result[1]
+                            offsets.append(len(move_codes))
+                            won_counts.append(won)
+                            win_rounds.append(win_round)
+                            loss_rounds.append(loss_round)
+                            entry += 1
+
+    # the edges file goes last, since the class picks up from the chunks that have one
+    _write_arrays(_work_name(parts, counts, "reverse", index), [values for arrays in reverse for values in arrays])
+    _write_arrays(_work_name(parts, counts, "edges", index),
+                  [offsets, move_codes, targets, won_counts, win_rounds, loss_rounds])
+    return len(offsets) - 1
+
+
+def _list_moves(geometry, position, color_index, first_index, material, parts, cells, binomials):
+    """Lists the legal moves of one color on a board of the class given, leaving out the Ko rule (which is handled
+    by the entry the move comes from). Returns a list with one tuple per move: (move code, color index knocked off or
+    None, outcome when the game ends on arrival (None otherwise), the next board's rank in its class and the move
+    the Ko rule forbids there)."""
+    moves = []
+    own = position[color_index]
+    opponent_index = 1 - color_index
+    while own:
+        low_bit = own & -own
+        own ^= low_bit
+        cell = low_bit.bit_length() - 1
+        for direction_index, direction in enumerate(DIRECTIONS):
+            if not _is_legal(geometry, position, color_index, cell, direction):
+                continue
+            captured, next_position, end_bit = _push(geometry, position, cell, direction)
+            code = cell * 4 + direction_index
+            outcome = None
+            forbidden = None
+            ko_move = _NO_KO
+            if captured == opponent_index and not next_position[opponent_index]:
+                # the last of the opponent's marbles was knocked off
+                outcome = _LOST_NOW
+            else:
+                # without a capture the push that puts the line back is forbidden by the Ko rule, for whichever
+                # player it belongs to
+                if captured is None:
+                    reverse = _reverse_move(geometry, next_position, end_bit, direction)
+                    if reverse is not None:
+                        forbidden = reverse
+                        if reverse[0] == opponent_index:
+                            ko_move = reverse[1]
+                # get_winner checks the first player before the second when looking for a player who can't move
+                for stuck_index in (first_index, 1 - first_index):
+                    stuck_forbidden = forbidden[1] if forbidden is not None and forbidden[0] == stuck_index else None
+                    if not _has_move(geometry, next_position, stuck_index, stuck_forbidden):
+                        outcome = _WON_NOW if stuck_index == color_index else _LOST_NOW
+                        break
+            if captured is None:
+                next_counts = material.counts
+            else:
+                next_counts = list(material.counts)
+                next_counts[captured] -= 1
+                next_counts = tuple(next_counts)
+            next_rank = None
+            if outcome is None:
+                if captured is None:
+                    next_rank = material.board_rank(next_position, binomials)
+                else:
+                    next_rank = _solved_values(parts, next_counts, cells, binomials)[0].board_rank(next_position,
+                                                                                                   binomials)
+            moves.append((code, captured, outcome, next_counts, next_rank, ko_move))
+    return moves
+
+
+def _move_target(move, color_index, needs, material, cells, binomials, parts):
+    """Returns (move code, target, Ko move) for one move listed by _list_moves from an entry with the captures needed
+    given (see _generate_chunk)."""
+    code, captured, outcome, next_counts, next_rank, ko_move = move
+    if captured == 2:
+        # a neutral marble captured: the mover needs one fewer, and wins if that was the last one needed
+        needs = list(needs)
+        needs[color_index] -= 1
+        if needs[color_index] == 0:
+            return code, -1 - _LOST_NOW, _NO_KO
+    if outcome is not None:
+        return code, -1 - outcome, _NO_KO
+    if captured is None:
+        return code, (next_rank * material.needs + material.need_index(*needs)) * 2 + 1 - color_index, ko_move
+    next_material, next_values = _solved_values(parts, next_counts, cells, binomials)
+    index = (next_rank * next_material.needs + next_material.need_index(*needs)) * 2 + 1 - color_index
+    return code, -1 - next_values[index], _NO_KO
+
+
+def _outcome_round(outcome):
+    """Returns (won, round) for the outcome code of a move that ends the game or leaves the class: whether the
+    player to move after it has won, and the settling round it counts in (one more than the plies to the end), or
+    None for a draw."""
+    if outcome == _LOST_NOW:
+        return False, 1
+    if outcome == _WON_NOW:
+        return True, 1
+    if outcome == DRAW:
+        return None
+    return bool(outcome & 1), (outcome >> 1) + 1
+
+
+def _write_arrays(name, arrays):
+    """Writes a list of arrays to a work file (the number of arrays, their lengths, then each array padded to 8
+    bytes), replacing the file in one step so an interrupted write leaves the old file in place."""
+    with open(name + ".tmp", "wb") as work_file:
+        work_file.write(struct.pack("<Q", len(arrays)))
+        array.array("Q", [len(values) for values in arrays]).tofile(work_file)
+        for values in arrays:
+            values.tofile(work_file)
+            work_file.write(bytes(-len(values) * values.itemsize % 8))
+    os.replace(name + ".tmp", name)
+
+
+def _array_layout(work_file, typecodes):
+    """Reads the header of a work file written by _write_arrays and returns (offset, length) for each array, given
+    the type codes of all of them."""
+    count, = struct.unpack("<Q", work_file.read(8))
+    if count != len(typecodes):
+        raise ValueError("%s holds %d arrays, expected %d" % (work_file.name, count, len(typecodes)))
+    lengths = array.array("Q")
+    lengths.fromfile(work_file, count)
+    layout = []
+    offset = 8 + 8 * count
+    for typecode, length in zip(typecodes, lengths):
+        layout.append((offset, length))
+        size = length * array.array(typecode).itemsize
+        offset += size + (-size % 8)
+    return layout
+
+
+def _read_arrays(name, typecodes, first=0, count=None):
+    """Reads count arrays (all of them if None) from a work file written by _write_arrays, starting with array
+    first. typecodes gives the type code of every array in the file."""
+    with open(name, "rb") as work_file:
+        layout = _array_layout(work_file, typecodes)
+        arrays = []
+        last = len(layout) if count is None else first + count
+        for typecode, (offset, length) in list(zip(typecodes, layout))[first:last]:
+            values = array.array(typecode)
+            work_file.seek(offset)
+            values.fromfile(work_file, length)
+            arrays.append(values)
+    return arrays
+
+
+def _map_arrays(name, typecodes):
+    """Memory maps a work file written by _write_arrays and returns (map, views) with a memoryview of each array, so
+    only the parts that are used are read. The views must be released before the map is closed."""
+    with open(name, "rb") as work_file:
+        layout = _array_layout(work_file, typecodes)
+        mapped = mmap.mmap(work_file.fileno(), 0, access=mmap.ACCESS_READ)
+    with memoryview(mapped) as whole:
+        views = [whole[offset:offset + length * array.array(typecode).itemsize].cast(typecode)
+                 for typecode, (offset, length) in zip(typecodes, layout)]
+    return mapped, views
+
+
+def _work_name(parts, counts, kind, index):
+    """Returns the name of a work file of one chunk of a class (kind is edges, reverse, static, state, out.<round> or
+    solved)."""
+    return os.path.join(parts, "%d_%d_%d.%s.%d" % (counts + (kind, index)))
+
+
+# the arrays in a chunk's edges file (see _generate_chunk), static file and state file (see _prepare_chunk)
+_EDGES_TYPES = "IHiHHH"
+_STATIC_TYPES = "IIHIIHHHIB"
+_STATE_TYPES = "QHHHI"
+
+
+def _prepare_chunk(parts, counts, index, chunk_count, chunk_entries, entry_count, cells):
+    """Gets chunk index of a class ready to be settled, writing two work files. The static file holds the nodes of
+    the chunk (its entries, then its entries with a Ko move forbidden) and what never changes while settling: the
+    moves into each node (as the entry moved from and the move code), the Ko nodes of each entry and the move each
+    forbids, the round from which each node can be lost, and the nodes settled by the moves that leave the class as
+    (round, node, won) events sorted by round. The state file holds the settling round reached, the messages sent and
+    the next round with an event (0 if none), then the value and the moves left to refute of each node, and the nodes
+    whose loss waits for a later round. Runs in the worker processes."""
+    base = index * chunk_entries
+    count = min(chunk_entries, entry_count - base)
+    moves = 4 * cells
+    offsets, move_codes, targets, won_counts, win_rounds, entry_loss_rounds = _read_arrays(
+        _work_name(parts, counts, "edges", index), _EDGES_TYPES)
+
+    # the moves into this chunk, from every chunk's reverse file
+    in_targets = array.array("I")
+    in_ko = array.array("H")
+    in_sources = array.array("I")
+    in_codes = array.array("H")
+    for source_index in range(chunk_count):
+        chunk_arrays = _read_arrays(_work_name(parts, counts, "reverse", source_index), "IHIH" * chunk_count,
+                                    4 * index, 4)
+        for values, chunk_values in zip((in_targets, in_ko, in_sources, in_codes), chunk_arrays):
+            values.extend(chunk_values)
+
+    # number the Ko nodes after the entries, and list the moves into each node
+    ko_nodes = {}           # entry in the chunk * moves + forbidden move -> node
+    move_nodes = array.array("I", bytes(4 * len(in_targets)))
+    for move_index, target in enumerate(in_targets):
+        ko_move = in_ko[move_index]
+        if ko_move == _NO_KO:
+            move_nodes[move_index] = target - base
+        else:
+            key = (target - base) * moves + ko_move
+            node = ko_nodes.get(key)
+            if node is None:
+                node = count + len(ko_nodes)
+                ko_nodes[key] = node
+            move_nodes[move_index] = node
+    node_count = count + len(ko_nodes)
+    predecessor_starts = array.array("I", bytes(4 * (node_count + 1)))
+    for node in move_nodes:
+        predecessor_starts[node + 1] += 1
+    for node in range(node_count):
+        predecessor_starts[node + 1] += predecessor_starts[node]
+    predecessor_sources = array.array("I", bytes(4 * len(move_nodes)))
+    predecessor_codes = array.array("H", bytes(2 * len(move_nodes)))
+    fill = predecessor_starts[:node_count]
+    for move_index, node in enumerate(move_nodes):
+        position = fill[node]
+        predecessor_sources[position] = in_sources[move_index]
+        predecessor_codes[position] = in_codes[move_index]
+        fill[node] = position + 1
+    del in_targets, in_ko, in_sources, in_codes, move_nodes, fill
+
+    # the Ko nodes of each entry, in key order
+    ko_starts = array.array("I", bytes(4 * (count + 1)))
+    ko_list = array.array("I")
+    ko_codes = array.array("H")
+    for key in sorted(ko_nodes):
+        entry, ko_move = divmod(key, moves)
+        ko_starts[entry + 1] += 1
+        ko_list.append(ko_nodes[key])
+        ko_codes.append(ko_move)
+    for entry in range(count):
+        ko_starts[entry + 1] += ko_starts[entry]
+
+    # the moves each node has to refute, and the rounds set by the moves that end the game or leave the class: a
+    # node is won in the first round with a lost outcome and can't be lost before the last round with a won one. A Ko
+    # node has the moves of its entry but the one it forbids, so its outcomes are gone through again.
+    remaining = array.array("H", bytes(2 * node_count))
+    loss_rounds = array.array("H", bytes(2 * node_count))
+    events = []
+    for entry in range(count):
+        start, end = offsets[entry], offsets[entry + 1]
+        nodes = [(entry, end - start, won_counts[entry], win_rounds[entry], entry_loss_rounds[entry])]
+        for ko_index in range(ko_starts[entry], ko_starts[entry + 1]):
+            won = win_round = loss_round = 0
+            for move_index in range(start, end):
+                if targets[move_index] >= 0 or move_codes[move_index] == ko_codes[ko_index]:
+                    continue
+                result = _outcome_round(-1 - targets[move_index])
+                if result is None:
+                    continue
+                if result[0]:
+                    won += 1
+                    loss_round = max(loss_round, result[1])
+                elif not win_round or result[1] < win_round:
+                    win_round = result[1]
+            nodes.append((ko_list[ko_index], end - start - 1, won, win_round, loss_round))
+        for node, total, won, win_round, loss_round in nodes:
+            remaining[node] = total - won
+            loss_rounds[node] = loss_round
+            if win_round:
+                events.append((win_round, node, 1))
+            elif total and total == won:
+                events.append((loss_round, node, 0))
+    events.sort()
+
+    _write_arrays(_work_name(parts, counts, "static", index), [
+        predecessor_starts, predecessor_sources, predecessor_codes, ko_starts, ko_list, ko_codes, loss_rounds,
+        array.array("H", [event[0] for event in events]), array.array("I", [event[1] for event in events]),
+        array.array("B", [event[2] for event in events])])
+    _write_arrays(_work_name(parts, counts, "state", index), [
+        array.array("Q", [0, 0, events[0][0] if events else 0]), array.array("H", bytes(2 * node_count)), remaining,
+        array.array("H"), array.array("I")])
+
+
+def _settle_round(parts, counts, index, chunk_count, chunk_entries, settle_round, last_round):
+    """Settles the nodes of chunk index that reach the end of the game in settle_round plies: a node is won when a
+    message from last_round says a move leads to a lost node (or an event says so) and lost when its last move to
+    refute is found to lead to a won node. Sends a message to the chunk of every move into each node settled, and
+    saves the chunk's state, so a round that was already saved is skipped when a class is picked up again. Returns
+    (messages sent, next round with an event or 0). Runs in the worker processes."""
+    state_name = _work_name(parts, counts, "state", index)
+    info, values, remaining, deferred_rounds, deferred_nodes = _read_arrays(state_name, _STATE_TYPES)
+    if info[0] >= settle_round:
+        return info[1], info[2]
+    base = index * chunk_entries
+    mapped, views = _map_arrays(_work_name(parts, counts, "static", index), _STATIC_TYPES)
+    (predecessor_starts, predecessor_sources, predecessor_codes, ko_starts, ko_list, ko_codes, loss_rounds,
+     event_rounds, event_nodes, event_won) = views
+    win_value = encode("win", settle_round)
+    loss_value = encode("loss", settle_round)
+    settled = []
+    deferred = []
+
+    # the moves found last round to lead to a settled node, applied to the entry moved from and each of its Ko nodes
+    # that doesn't forbid the move
+    if last_round:
+        for source_index in range(chunk_count):
+            sources, codes = _read_arrays(_work_name(parts, counts, "out.%d" % last_round, source_index),
+                                          "IH" * chunk_count, 2 * index, 2)
+            for source, code in zip(sources, codes):
+                entry = source - base
+                child_won = code & _WON_BIT
+                code &= ~_WON_BIT
+                nodes = [entry]
+                if ko_starts[entry] != ko_starts[entry + 1]:
+                    nodes.extend(ko_list[ko_index] for ko_index in range(ko_starts[entry], ko_starts[entry + 1])
+                                 if ko_codes[ko_index] != code)
+                for node in nodes:
+                    if values[node]:
+                        continue
+                    if not child_won:
+                        values[node] = win_value
+                        settled.append(node)
+                    else:
+                        remaining[node] -= 1
+                        if remaining[node] == 0:
+                            if loss_rounds[node] <= settle_round:
+                                values[node] = loss_value
+                                settled.append(node)
+                            else:
+                                deferred.append((loss_rounds[node], node))
+
+    # the events and the losses put off until this round
+    event_start = bisect.bisect_left(event_rounds, settle_round)
+    event_end = bisect.bisect_right(event_rounds, settle_round)
+    for event_index in range(event_start, event_end):
+        node = event_nodes[event_index]
+        if not values[node]:
+            values[node] = win_value if event_won[event_index] else loss_value
+            settled.append(node)
+    for deferred_round, node in zip(deferred_rounds, deferred_nodes):
+        if deferred_round > settle_round:
+            deferred.append((deferred_round, node))
+        elif not values[node]:
+            values[node] = loss_value
+            settled.append(node)
+
+    # tell the chunk of every move into a settled node
+    outgoing = [(array.array("I"), array.array("H")) for _ in range(chunk_count)]
+    for node in settled:
+        won_bit = _WON_BIT if values[node] & 1 else 0
+        for predecessor in range(predecessor_starts[node], predecessor_starts[node + 1]):
+            source = predecessor_sources[predecessor]
+            sources, codes = outgoing[source // chunk_entries]
+            sources.append(source)
+            codes.append(predecessor_codes[predecessor] | won_bit)
+    upcoming = [deferred_round for deferred_round, node in deferred]
+    if event_end < len(event_rounds):
+        upcoming.append(event_rounds[event_end])
+    next_round = min(upcoming, default=0)
+    for view in views:
+        view.release()
+    mapped.close()
+
+    sent = sum(len(sources) for sources, codes in outgoing)
+    _write_arrays(_work_name(parts, counts, "out.%d" % settle_round, index),
+                  [values for arrays in outgoing for values in arrays])
+    _write_arrays(state_name, [array.array("Q", [settle_round, sent, next_round]), values, remaining,
+                               array.array("H", [deferred_round for deferred_round, node in deferred]),
+                               array.array("I", [node for deferred_round, node in deferred])])
+    return sent, next_round
+
+
+def _finish_chunk(parts, counts, index, chunk_entries, entry_count, cells):
+    """Writes the solved file of chunk index: the values of its entries, then the keys and values of the Ko entries
+    that differ from them. Runs in the worker processes."""
+    base = index * chunk_entries
+    count = min(chunk_entries, entry_count - base)
+    values = _read_arrays(_work_name(parts, counts, "state", index), _STATE_TYPES, 1, 1)[0]
+    ko_starts, ko_list, ko_codes = _read_arrays(_work_name(parts, counts, "static", index), _STATIC_TYPES, 3, 3)
+
+    # keep a Ko entry only where forbidding the move changes the value
+    ko_keys = array.array("Q")
+    ko_values = array.array("H")
+    for entry in range(count):
+        for ko_index in range(ko_starts[entry], ko_starts[entry + 1]):
+            node = ko_list[ko_index]
+            if values[node] != values[entry]:
+                ko_keys.append((base + entry) * 4 * cells + ko_codes[ko_index])
+                ko_values.append(values[node])
+    _write_arrays(_work_name(parts, counts, "solved", index), [values[:count], ko_keys, ko_values])
+
+
+def _run_jobs(pool, function, jobs):
+    """Runs function on each job (a tuple of arguments), on the pool if there is one, and returns the results in
+    order."""
+    if pool is None:
+        return [function(*job) for job in jobs]
+    return [future.result() for future in [pool.submit(function, *job) for job in jobs]]
+
+
+def _solve_class(parts, size, first_color, counts, material, binomials, pool):
+    """Solves one class and writes its values (and the Ko entries that differ from them) to the work directory. The
+    entries and the entries with a Ko move forbidden are the nodes of a graph, split into chunks of entries that are
+    worked on by the pool. The moves out of each chunk are listed and sorted by the chunk they lead to, then the
+    nodes are settled in rounds, one ply further from the end of the game each round, starting from the moves that
+    end the game or leave the class. A node is won as soon as one move leads to a lost node and lost once every move
+    leads to a won node; whatever is left when no more nodes can be settled is a draw. Each chunk saves its state
+    every round, so an interrupted class carries on from the last round finished."""
+    cells = size * size
+    whites_per_chunk = max(1, CHUNK_POSITIONS // (material.black_boards * material.red_boards))
+    white_boards = binomials[cells][counts[0]]
+    chunk_entries = whites_per_chunk * material.black_boards * material.red_boards * material.needs * 2
+    chunk_count = -(-white_boards // whites_per_chunk)
+    entry_count = material.entries
+    name = os.path.join(parts, "%d_%d_%d" % counts)
+    chunks = range(chunk_count)
+
+    if not os.path.exists(name + ".round"):
+        _run_jobs(pool, _generate_chunk, [
+            (parts, size, first_color, counts, index, index * whites_per_chunk,
+             min((index + 1) * whites_per_chunk, white_boards), chunk_count, chunk_entries)
+            for index in chunks if not os.path.exists(_work_name(parts, counts, "edges", index))])
+        _run_jobs(pool, _prepare_chunk, [(parts, counts, index, chunk_count, chunk_entries, entry_count, cells)
+                                         for index in chunks
+                                         if not os.path.exists(_work_name(parts, counts, "state", index))])
+        _write_arrays(name + ".round", [array.array("Q", [1, 0])])
+        for index in chunks:
+            for kind in ("edges", "reverse"):
+                os.remove(_work_name(parts, counts, kind, index))
+
+    settle_round, last_round = _read_arrays(name + ".round", "Q")[0]
+    while settle_round:
+        results = _run_jobs(pool, _settle_round, [
+            (parts, counts, index, chunk_count, chunk_entries, settle_round, last_round) for index in chunks])
+        next_rounds = [next_round for sent, next_round in results if next_round]
+        if any(sent for sent, next_round in results):
+            next_round = settle_round + 1
+        else:
+            next_round = min(next_rounds, default=0)
+        _write_arrays(name + ".round", [array.array("Q", [next_round, settle_round])])
+        if last_round:
+            for index in chunks:
+                os.remove(_work_name(parts, counts, "out.%d" % last_round, index))
+        settle_round, last_round = next_round, settle_round
+
+    _run_jobs(pool, _finish_chunk, [(parts, counts, index, chunk_entries, entry_count, cells) for index in chunks
+                                    if not os.path.exists(_work_name(parts, counts, "solved", index))])
+    solved_names = [_work_name(parts, counts, "solved", index) for index in chunks]
+    with open(name + ".ko.tmp", "wb") as ko_file:
+        for array_index in (1, 2):
+            for solved_name in solved_names:
+                _read_arrays(solved_name, "HQH", array_index, 1)[0].tofile(ko_file)
+    os.replace(name + ".ko.tmp", name + ".ko")
+    with open(name + ".values.tmp", "wb") as values_file:
+        for solved_name in solved_names:
+            _read_arrays(solved_name, "HQH", 0, 1)[0].tofile(values_file)
+    os.replace(name + ".values.tmp", name + ".values")
+    prefix = "%d_%d_%d." % counts
+    for work_name in os.listdir(parts):
+        if work_name.startswith(prefix) and not work_name.endswith((".values", ".ko")):
+            os.remove(os.path.join(parts, work_name))
+
+
+def generate(output, max_white=2, max_black=2, max_red=0, max_marbles=None, workers=1, size=7, first_color="W",
+             report=None):
+    """Builds the tablebase for every class up to the marble budget and writes it to the output file. Work is kept in
+    a directory next to the output (output + ".parts") until the table is written, so running it again with the same
+    budget after an interruption carries on from the last chunk written or the last round settled. Splits the chunks
+    over workers processes when workers is more than 1. If report is given it is called with a line of text as each
+    class is solved."""
+    cells = size * size
+    binomials = _binomials(cells)
+    parts = output + ".parts"
+    os.makedirs(parts, exist_ok=True)
+    settings = {"size": size, "first_color": first_color, "max_white": max_white, "max_black": max_black,
+                "max_red": max_red, "max_marbles": max_marbles}
+    settings_name = os.path.join(parts, "settings.json")
+    if os.path.exists(settings_name):
+        with open(settings_name) as settings_file:
+            if json.load(settings_file) != settings:
+                raise ValueError("%s holds work for a different tablebase" % parts)
+    else:
+        with open(settings_name, "w") as settings_file:
+            json.dump(settings, settings_file)
+
+    classes = material_classes(max_white, max_black, max_red, max_marbles)
+    pool = concurrent.futures.ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        for counts in classes:
+            material = _Material(counts, cells, binomials)
+            name = os.path.join(parts, "%d_%d_%d" % counts)
+            if os.path.exists(name + ".values") and os.path.exists(name + ".ko"):
+                continue
+            start = time.perf_counter()
+            _solve_class(parts, size, first_color, counts, material, binomials, pool)
+            if report is not None:
+                report("class %d/%d/%d: %d entries in %.1f s" % (counts + (material.entries,
+                                                                          time.perf_counter() - start)))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    _write_table(output, parts, classes, size, first_color)
+    for counts in classes:
+        for suffix in (".values", ".ko"):
+            os.remove(os.path.join(parts, "%d_%d_%d" % counts + suffix))
+    os.remove(settings_name)
+    os.rmdir(parts)
+
+
+def _write_table(output, parts, classes, size, first_color):
+    """Writes the solved classes in the work directory into one table file."""
+    offset = _HEADER.size + _CLASS_ENTRY.size * len(classes)
+    directory = []
+    sections = []
+    for counts in classes:
+        name = os.path.join(parts, "%d_%d_%d" % counts)
+        with open(name + ".values", "rb") as values_file:
+            values = values_file.read()
+        with open(name + ".ko", "rb") as ko_file:
+            ko = ko_file.read()
+        offset += -offset % 8
+        values_offset = offset
+        offset += len(values)
+        offset += -offset % 8
+        ko_offset = offset
+        offset += len(ko)
+        directory.append(_CLASS_ENTRY.pack(counts[0], counts[1], counts[2], 0, values_offset, ko_offset,
+                                           len(ko) // 10))
+        sections.append((values_offset, values))
+        sections.append((ko_offset, ko))
+
+    with open(output + ".tmp", "wb") as table_file:
+        table_file.write(_HEADER.pack(MAGIC, size, KubaGame._COLOR_INDEX[first_color], len(classes)))
+        for entry in directory:
+            table_file.write(entry)
+        for section_offset, data in sections:
+            table_file.write(b"\0" * (section_offset - table_file.tell()))
+            table_file.write(data)
+    os.replace(output + ".tmp", output)
+
+
+class KubaTablebase:
+    """Represents an open tablebase file. The file is mapped into memory and every probe reads the values in place.
+    Contains methods as follows: probe, probe_position, best_move, get_size, get_classes, close (also usable with a
+    with statement)."""
+
+    def __init__(self, path):
+        """Opens the tablebase file at path."""
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size, first_index, class_count = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a Kuba tablebase" % path)
+        self._size = size
+        self._cells = size * size
+        self._first_color = "WB"[first_index]
+        self._geometry = KubaGame._get_geometry(size)
+        self._binomials = _binomials(self._cells)
+        view = memoryview(self._map)
+        self._classes = {}
+        for index in range(class_count):
+            white, black, red, _, values_offset, ko_offset, ko_count = _CLASS_ENTRY.unpack_from(
+                self._map, _HEADER.size + index * _CLASS_ENTRY.size)
+            material = _Material((white, black, red), self._cells, self._binomials)
+            values = view[values_offset:values_offset + 2 * material.entries].cast("H")
+            ko_keys = view[ko_offset:ko_offset + 8 * ko_count].cast("Q")
+            ko_values = view[ko_offset + 8 * ko_count:ko_offset + 10 * ko_count].cast("H")
+            self._classes[(white, black, red)] = (material, values, ko_keys, ko_values)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Closes the file. Values read from the table stay valid; further probes are not allowed."""
+        if self._map is not None:
+            self._classes = {}
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+    def get_size(self):
+        """Returns the board size the table was built for."""
+        return self._size
+
+    def get_classes(self):
+        """Returns a dictionary of (white, black, red) counts: (entries, Ko entries) for every class in the table."""
+        return {counts: (material.entries, len(ko_keys))
+                for counts, (material, values, ko_keys, ko_values) in self._classes.items()}
+
+    def probe_position(self, position, color, needs, prev_position=None):
+        """Takes a position tuple of (white, black, red) bitmasks, the color to move (W or B), the neutral marbles
+        (white, black) each still needs to capture and the previous position for the Ko rule (None if there is none).
+        Returns the table value (see decode), or None if the position isn't in the table."""
+        table = self._classes.get((KubaGame._popcount(position[0]), KubaGame._popcount(position[1]),
+                                   KubaGame._popcount(position[2])))
+        if table is None or min(needs) < 1:
+            return None
+        material, values, ko_keys, ko_values = table
+        color_index = KubaGame._COLOR_INDEX[color]
+        index = ((material.board_rank(position, self._binomials) * material.needs + material.need_index(*needs)) * 2
+                 + color_index)
+        if prev_position is not None and len(ko_keys):
+            forbidden = self._forbidden_move(position, prev_position, color_index)
+            if forbidden is not None:
+                key = index * 4 * self._cells + forbidden
+                found = bisect.bisect_left(ko_keys, key)
+                if found < len(ko_keys) and ko_keys[found] == key:
+                    return ko_values[found]
+        return values[index]
+
+    def _forbidden_move(self, position, prev_position, color_index):
+        """Returns the move code of the push that would bring back the previous position for the color to move, or
+        None if there is no such push. Only the player's marbles on spaces that changed can start it."""
+        changed = 0
+        for mask, prev_mask in zip(position, prev_position):
+            if KubaGame._popcount(mask) != KubaGame._popcount(prev_mask):
+                return None
+            changed |= mask ^ prev_mask
+        geometry = self._geometry
+        candidates = position[color_index] & changed
+        while candidates:
+            low_bit = candidates & -candidates
+            candidates ^= low_bit
+            cell = low_bit.bit_length() - 1
+            for direction_index, direction in enumerate(DIRECTIONS):
+                if changed & ~geometry.ray_masks[direction][cell]:
+                    continue
+                if _is_legal(geometry, position, color_index, cell, direction) and \
+                        _push(geometry, position, cell, direction)[1] == tuple(prev_position):
+                    return cell * 4 + direction_index
+        return None
+
+    def probe(self, game, player_name):
+        """Takes a KubaGame and the name of the player to move, and returns the result with best play for that player
+        as a tuple of ("win", "loss" or "draw", plies to the end of the game or None for a draw). Returns None if the
+        position isn't in the table, the game is over, or the game's board size or player order doesn't match the
+        table."""
+        if game.get_winner() is not None or game.get_size() != self._size:
+            return None
+        names = game.get_player_names()
+        if game.get_player_by_name(names[0]).get_marble_color() != self._first_color:
+            return None
+        needs = [0, 0]
+        for name in names:
+            player = game.get_player_by_name(name)
+            needs[KubaGame._COLOR_INDEX[player.get_marble_color()]] = (game.get_captures_to_win() -
+                                                                       player.get_captured_marble_count())
+        board = game._board
+        value = self.probe_position(board.get_position(), game.get_player_by_name(player_name).get_marble_color(),
+                                    needs, board.get_prev_position())
+        return None if value is None else decode(value)
+
+    def best_move(self, game, player_name):
+        """Takes a KubaGame and the name of the player to move, and returns a tuple of (move, result) for the move
+        that keeps the best result in the table: the quickest win, else a draw, else the slowest loss. The move is
+        (coord, direction) and the result is as returned by probe. Returns None if the position isn't in the table or
+        the player has no legal move. The game is left as it was."""
+        result = self.probe(game, player_name)
+        if result is None:
+            return None
+        # moves are made and taken back on a copy, so the game's own move history isn't changed
+        game = game.copy_game()
+        names = game.get_player_names()
+        opponent_name = names[1] if names[0] == player_name else names[0]
+        best = None
+        for move in list(game.legal_moves(player_name)):
+            game.make_move(player_name, move[0], move[1])
+            winner = game.get_winner()
+            if winner is not None:
+                score = (2, 0) if winner == player_name else (0, 0)
+            else:
+                reply = self.probe(game, opponent_name)
+                if reply is None:
+                    score = None
+                elif reply[0] == "loss":
+                    score = (2, -reply[1])
+                elif reply[0] == "draw":
+                    score = (1, 0)
+                else:
+                    score = (0, reply[1])
+            game.undo_move()
+            if score is not None and (best is None or score > best[0]):
+                best = (score, move)
+        if best is None:
+            return None
+        return best[1], result
+
+
+def _game_from_arguments(arguments):
+    """Builds the game to probe from the command line arguments."""
+    player_one_captured, player_two_captured = (int(count) for count in arguments.captured.split(","))
+    board = KubaGame.Board(layout=arguments.board.split("/"))
+    prev_position = None
+    if arguments.prev_board:
+        prev_position = KubaGame.Board(layout=arguments.prev_board.split("/")).get_position()
+    turns = (arguments.player == PLAYERS[0][0], arguments.player == PLAYERS[1][0])
+    return KubaGame.KubaGame.from_state((PLAYERS, board.get_position(), prev_position,
+                                         (player_one_captured, player_two_captured), turns, None, board.get_size(),
+                                         arguments.captures_to_win))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Builds and probes an endgame tablebase for Kuba.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate_parser = commands.add_parser("generate", help="solve every position up to a marble budget")
+    generate_parser.add_argument("--white", type=int, default=2, help="most white marbles")
+    generate_parser.add_argument("--black", type=int, default=2, help="most black marbles")
+    generate_parser.add_argument("--red", type=int, default=0, help="most red marbles")
+    generate_parser.add_argument("--max-marbles", type=int, default=None, help="most marbles in total")
+    generate_parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    generate_parser.add_argument("--first-color", choices="WB", default="W", help="color of the first player")
+    generate_parser.add_argument("--output", default="kuba.tb", help="table file to write")
+    info_parser = commands.add_parser("info", help="list the classes in a table")
+    info_parser.add_argument("--table", default="kuba.tb", help="table file to read")
+    probe_parser = commands.add_parser("probe", help="look up one position")
+    probe_parser.add_argument("--table", default="kuba.tb", help="table file to read")
+    probe_parser.add_argument("--board", required=True, help="board rows separated by / (e.g. -------/-W-B---/...)")
+    probe_parser.add_argument("--prev-board", help="the previous board for the Ko rule, in the same format")
+    probe_parser.add_argument("--captured", default="0,0", help="neutral marbles captured by Player 1 and Player 2")
+    probe_parser.add_argument("--captures-to-win", type=int, default=7, help="neutral marbles needed to win")
+    probe_parser.add_argument("--player", default="Player 1", help="player to move (Player 1 is W, Player 2 is B)")
+    arguments = parser.parse_args()
+
+    if arguments.command == "generate":
+        generate(arguments.output, arguments.white, arguments.black, arguments.red, arguments.max_marbles,
+                 arguments.workers or os.cpu_count() or 1, first_color=arguments.first_color, report=print)
+        print("wrote", arguments.output)
+    elif arguments.command == "info":
+        with KubaTablebase(arguments.table) as tablebase:
+            print("board size %d" % tablebase.get_size())
+            for class_counts, (entries, ko_entries) in sorted(tablebase.get_classes().items()):
+                print("W %d B %d R %d: %12d entries %10d Ko entries" % (class_counts + (entries, ko_entries)))
+    else:
+        probe_game = _game_from_arguments(arguments)
+        with KubaTablebase(arguments.table) as tablebase:
+            probe_start = time.perf_counter()
+            probe_result = tablebase.probe(probe_game, arguments.player)
+            probe_time = time.perf_counter() - probe_start
+            if probe_result is None:
+                print("not in the table")
+                sys.exit(1)
+            best = tablebase.best_move(probe_game, arguments.player)
+        print("%s: %s%s (probe took %.1f us)" % (
+            arguments.player, probe_result[0], "" if probe_result[1] is None else " in %d plies" % probe_result[1],
+            probe_time * 1e6))
+        if best is not None:
+            print("best move: %s %s" % best[0])
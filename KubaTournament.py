@@ -0,0 +1,489 @@
+# Description: This program runs tournaments between computer players (agents). An agent is any function that takes
+# a KubaGame, the name of the player to move and the time limit for the move in milliseconds, and returns a move as
+# (coord, direction). The agents in AGENTS can be given by name and any other agent as "module:function". Agents play
+# each other round robin (every pair plays games_per_pair games) or over a number of Swiss rounds (players with
+# similar scores meet, without repeating a pairing while that can be avoided), swapping colors between the games of
+# a pairing. Games are spread over a pool of worker processes and each result is written to a JSON lines file as soon
+# as the game finishes, so an interrupted tournament carries on from the games already in the file when it is run
+# again with the same settings. Ratings are fitted to all of the results with the Bradley-Terry model on the Elo
+# scale, with 95% confidence intervals from bootstrap resampling of the games.
+#
+# A game is lost by a player whose agent returns no move or an illegal move, raises an exception, or takes longer
+# than the time limit plus grace_ms for a move. Each agent runs in a process of its own that is ended as soon as it
+# runs out of time, so an agent that hangs loses the game without holding up its worker. A game that reaches max_moves
+# moves is a draw.
+#
+# Usage: python KubaTournament.py --agents random greedy search --output results.jsonl [--games-per-pair 4]
+#            [--swiss 5] [--time-ms 100] [--workers 4] [--max-moves 300] [--seed 1]
+
+import concurrent.futures
+import importlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+
+import KubaAI
+import KubaGame
+import KubaMCTS
+
+
+PLAYER_NAMES = ("Player 1", "Player 2")     # Player 1 plays W, Player 2 plays B
+
+# a move may run over the time limit by this much before the game is lost on time
+GRACE_MS = 100
+
+# a game that reaches this many moves is a draw
+MAX_MOVES = 300
+
+# the rating given to the average agent, and the resampled fits used for the confidence intervals
+AVERAGE_ELO = 1500
+BOOTSTRAP_SAMPLES = 200
+
+# games waiting for a worker at any one time, per worker
+GAMES_PER_WORKER = 2
+
+# seconds an agent's process may take to start, and to stop once a game is over, before it is ended
+STARTUP_SECONDS = 30
+CLOSE_SECONDS = 1
+
+
+def random_agent(game, player_name, time_ms):
+    """Plays a random legal move."""
+    moves = list(game.legal_moves(player_name))
+    return random.choice(moves) if moves else None
+
+
+def greedy_agent(game, player_name, time_ms):
+    """Plays a move that pushes a neutral marble off if there is one, then one that pushes an opponent's marble off,
+    and otherwise a random legal move."""
+    player = game.get_player_by_name(player_name)
+    moves = list(game.legal_moves(player_name))
+    knockouts = []
+    for coord, direction in moves:
+        captured = game.check_move(player, coord, direction)[1]
+        if captured == "R":
+            return coord, direction
+        if captured is not None:
+            knockouts.append((coord, direction))
+    if knockouts:
+        return random.choice(knockouts)
+    return random.choice(moves) if moves else None
+
+
+def search_agent(game, player_name, time_ms):
+    """Plays the move found by KubaSearch (alpha-beta search) in the time limit."""
+    return KubaAI.KubaSearch(time_ms).search(game, player_name)
+
+
+def mcts_agent(game, player_name, time_ms):
+    """Plays the move found by KubaMCTS (Monte Carlo Tree Search, in the worker's own process) in the time limit."""
+    return KubaMCTS.KubaMCTS(time_ms=time_ms, workers=1, seed=random.getrandbits(64)).search(game, player_name)
+
+
+# agents that can be given by name
+AGENTS = {"random": random_agent, "greedy": greedy_agent, "search": search_agent, "mcts": mcts_agent}
+
+
+def resolve_agent(spec):
+    """Takes the name of an agent in AGENTS or a "module:function" string and returns the agent function. Raises
+    ValueError if there is no such agent."""
+    if spec in AGENTS:
+        return AGENTS[spec]
+    module_name, _, function_name = spec.partition(":")
+    if not function_name:
+        raise ValueError("unknown agent %r (use one of %s or module:function)" % (spec, ", ".join(sorted(AGENTS))))
+    agent = getattr(importlib.import_module(module_name), function_name, None)
+    if not callable(agent):
+        raise ValueError("%s is not a function" % spec)
+    return agent
+
+
+def _serve_agent(spec, seed, connection):
+    """Runs in an agent's own process. Seeds the random module, resolves the agent and sends ("ready", None), then
+    answers every (state, player_name, time_ms) request with ("move", move) or ("error", message) until it is sent
+    None."""
+    random.seed(seed)
+    try:
+        agent = resolve_agent(spec)
+    except Exception as error:
+        agent = None
+        failure = "%s: %s" % (type(error).__name__, error)
+    connection.send(("ready", None))
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        if agent is None:
+            connection.send(("error", failure))
+            continue
+        state, player_name, time_ms = request
+        try:
+            # the move is pickled before anything is sent, so a move that can't be sent is reported as an error
+            connection.send(("move", agent(KubaGame.KubaGame.from_state(state), player_name, time_ms)))
+        except Exception as error:
+            connection.send(("error", "%s: %s" % (type(error).__name__, error)))
+
+
+class AgentProcess:
+    """Represents an agent running in a process of its own for one game, so that a move that runs past the time limit
+    can be stopped by ending the process rather than waiting for it. The agent is sent the game state for each move
+    and plays on its own copy of the game. Contains methods as follows: request_move and close."""
+
+    def __init__(self, spec, seed):
+        """Starts the process for the agent named spec (see resolve_agent), with the random module seeded with seed."""
+        self._connection, child_connection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve_agent, args=(spec, seed, child_connection), daemon=True)
+        self._process.start()
+        child_connection.close()
+        self._ready = False
+
+    def request_move(self, game, player_name, time_ms, timeout):
+        """Asks the agent for a move for player_name in the game, with a time limit of time_ms milliseconds, and waits
+        at most timeout seconds for the answer (the time the process takes to start isn't counted). Returns a tuple of
+        (kind, value): ("move", the move returned), ("error", a message) if the agent raised an exception or its
+        process ended, or ("time", None) if no answer came in time, in which case the process is ended."""
+        try:
+            if not self._ready:
+                if not self._connection.poll(STARTUP_SECONDS):
+                    self.close()
+                    return "error", "the agent process didn't start"
+                self._connection.recv()
+                self._ready = True
+            self._connection.send((game.get_state(), player_name, time_ms))
+            if not self._connection.poll(timeout):
+                self._process.terminate()
+                return "time", None
+            return self._connection.recv()
+        except (EOFError, OSError):
+            return "error", "the agent process ended"
+
+    def close(self):
+        """Stops the agent's process."""
+        if self._process.is_alive():
+            try:
+                self._connection.send(None)
+            except OSError:
+                pass
+            self._process.join(CLOSE_SECONDS)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
+        self._connection.close()
+
+
+def play_game(game_id, round_number, white, black, time_ms=100, grace_ms=GRACE_MS, max_moves=MAX_MOVES, seed=0):
+    """Plays one game from the opening between the agents named white (Player 1) and black (Player 2) and returns
+    its result as a dictionary: the game number and round, both agents, the score for white (1, 0.5 or 0), the
+    reason the game ended ("win", "time", "illegal", "error" or "max_moves"), the moves played, the seconds taken and
+    the slowest move in milliseconds. Each agent runs in an AgentProcess of its own, with its random module seeded
+    from seed (so agents that use it play the same way every time), and is given a copy of the game, so that it can't
+    change the real one. An agent that hasn't answered time_ms + grace_ms milliseconds after being asked for a move
+    loses on time and its process is ended, so an agent that hangs can't hold up the tournament."""
+    agents = (AgentProcess(white, seed * 2), AgentProcess(black, seed * 2 + 1))
+    game = KubaGame.KubaGame((PLAYER_NAMES[0], "W"), (PLAYER_NAMES[1], "B"))
+    result = {"game": game_id, "round": round_number, "white": white, "black": black, "score": 0.5,
+              "reason": "max_moves", "moves": 0}
+    player_index = 0
+    slowest = 0.0
+    start = time.perf_counter()
+    try:
+        while True:
+            winner = game.get_winner()
+            if winner is not None:
+                result["score"] = 1.0 if winner == PLAYER_NAMES[0] else 0.0
+                result["reason"] = "win"
+                break
+            if result["moves"] >= max_moves:
+                break
+
+            player_name = PLAYER_NAMES[player_index]
+            move_start = time.perf_counter()
+            kind, value = agents[player_index].request_move(game, player_name, time_ms, (time_ms + grace_ms) / 1000)
+            move_ms = (time.perf_counter() - move_start) * 1000
+            slowest = max(slowest, move_ms)
+            if kind == "error":
+                result["error"] = value
+                reason = "error"
+            elif kind == "time" or move_ms > time_ms + grace_ms:
+                reason = "time"
+            else:
+                try:
+                    legal = value is not None and game.make_move(player_name, tuple(value[0]), value[1])
+                except (TypeError, ValueError, IndexError, KeyError):
+                    # a move that isn't a (coord, direction) pair at all
+                    legal = False
+                reason = None if legal else "illegal"
+            if reason is not None:
+                # the player to move loses
+                result["score"] = 0.0 if player_index == 0 else 1.0
+                result["reason"] = reason
+                break
+            result["moves"] += 1
+            player_index = 1 - player_index
+    finally:
+        for agent in agents:
+            agent.close()
+
+    result["seconds"] = time.perf_counter() - start
+    result["slowest_move_ms"] = slowest
+    return result
+
+
+def round_robin_schedule(agents, games_per_pair):
+    """Returns a list of (round, white, black) for every game of a round robin: every pair of agents plays
+    games_per_pair games, one per round, with the colors swapped each round."""
+    schedule = []
+    for round_index in range(games_per_pair):
+        for first_index, first in enumerate(agents):
+            for second in agents[first_index + 1:]:
+                white, black = (first, second) if round_index % 2 == 0 else (second, first)
+                schedule.append((round_index + 1, white, black))
+    return schedule
+
+
+def swiss_pairings(agents, results):
+    """Returns a list of (first, second) agent pairs for the next Swiss round, given the results of the earlier rounds.
+    The agents are ranked by points (ties in the order given) and each one still unpaired is paired with the highest
+    ranked agent below it that it hasn't met yet, or the next one if it has met them all. With an odd number of
+    agents, the lowest ranked agent that hasn't sat a round out yet sits this one out (and is left out of the pairs).
+    The rounds before must be complete."""
+    points = {agent: 0.0 for agent in agents}
+    games = {agent: 0 for agent in agents}
+    met = set()
+    for result in results:
+        points[result["white"]] += result["score"]
+        points[result["black"]] += 1 - result["score"]
+        games[result["white"]] += 1
+        games[result["black"]] += 1
+        met.add((result["white"], result["black"]))
+        met.add((result["black"], result["white"]))
+    ranked = sorted(agents, key=lambda agent: (-points[agent], agents.index(agent)))
+
+    if len(ranked) % 2:
+        # an agent that has sat a round out has played fewer games than the rest
+        most_games = max(games.values())
+        ranked.remove(next(agent for agent in reversed(ranked) if games[agent] == most_games))
+    pairs = []
+    while ranked:
+        first = ranked.pop(0)
+        second = next((agent for agent in ranked if (first, agent) not in met), ranked[0])
+        ranked.remove(second)
+        pairs.append((first, second))
+    return pairs
+
+
+def read_results(path, settings):
+    """Reads the results already in a tournament file and returns them as a list. The first line of the file holds
+    the settings of the tournament; a new file is started with the settings given, and ValueError is raised if an
+    existing file was written with different settings. A last line cut short by an interruption is dropped."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        with open(path, "w") as results_file:
+            results_file.write(json.dumps({"settings": settings}) + "\n")
+        return []
+
+    results = []
+    with open(path) as results_file:
+        lines = results_file.readlines()
+    if json.loads(lines[0]).get("settings") != settings:
+        raise ValueError("%s holds a tournament with different settings" % path)
+    complete_lines = lines[:1]
+    for line in lines[1:]:
+        try:
+            if not line.endswith("\n"):
+                raise ValueError("line cut short")
+            results.append(json.loads(line))
+        except ValueError:
+            break
+        complete_lines.append(line)
+    if len(complete_lines) < len(lines):
+        # rewrite the file without the line that was cut short
+        with open(path, "w") as results_file:
+            results_file.writelines(complete_lines)
+    return results
+
+
+def _play_games(jobs, results_file, pool, workers, report):
+    """Plays a list of games (each the arguments of play_game) and returns their results in the order they finish.
+    Every result is written to the results file (and passed to report, if given) as soon as the game finishes."""
+    finished = []
+
+    def record(result):
+        results_file.write(json.dumps(result, sort_keys=True) + "\n")
+        results_file.flush()
+        finished.append(result)
+        if report is not None:
+            report(result)
+
+    if pool is None:
+        for job in jobs:
+            record(play_game(*job))
+        return finished
+
+    jobs = list(jobs)
+    pending = set()
+    while jobs or pending:
+        while jobs and len(pending) < workers * GAMES_PER_WORKER:
+            pending.add(pool.submit(play_game, *jobs.pop(0)))
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            record(future.result())
+    return finished
+
+
+def run_tournament(agents, output, games_per_pair=2, swiss_rounds=None, time_ms=100, grace_ms=GRACE_MS,
+                   max_moves=MAX_MOVES, workers=1, seed=1, report=None):
+    """Plays a tournament between the agents (names in AGENTS or "module:function" strings) and writes the results to
+    the output file, skipping the games already in it. Plays round robin, or swiss_rounds Swiss rounds if given; either
+    way each pairing plays games_per_pair games with the colors swapped between them. Games are spread over workers
+    processes when workers is more than 1. Returns a tuple of (all results, games played by this run, seconds taken).
+    If report is given it is called with each result as its game finishes."""
+    agents = list(agents)
+    if len(set(agents)) != len(agents) or len(agents) < 2:
+        raise ValueError("a tournament needs at least two different agents")
+    for agent in agents:
+        resolve_agent(agent)
+    settings = {"agents": agents, "games_per_pair": games_per_pair, "swiss_rounds": swiss_rounds,
+                "time_ms": time_ms, "grace_ms": grace_ms, "max_moves": max_moves, "seed": seed}
+    results = read_results(output, settings)
+    done = {result["game"] for result in results}
+
+    def jobs_for(games, first_id):
+        # each game has a number and a seed of its own, so a resumed tournament plays the same games
+        return [(first_id + index, round_number, white, black, time_ms, grace_ms, max_moves, seed * 1000003 + first_id
+                 + index) for index, (round_number, white, black) in enumerate(games) if first_id + index not in done]
+
+    played = 0
+    start = time.perf_counter()
+    pool = concurrent.futures.ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        with open(output, "a") as results_file:
+            if swiss_rounds is None:
+                finished = _play_games(jobs_for(round_robin_schedule(agents, games_per_pair), 0), results_file, pool,
+                                       workers, report)
+                results.extend(finished)
+                played += len(finished)
+            else:
+                first_id = 0
+                for round_number in range(1, swiss_rounds + 1):
+                    # the pairings only depend on the earlier rounds, so they come out the same when resuming
+                    pairs = swiss_pairings(agents, [result for result in results if result["round"] < round_number])
+                    games = [(round_number,) + (pair if index % 2 == 0 else pair[::-1])
+                             for pair in pairs for index in range(games_per_pair)]
+                    finished = _play_games(jobs_for(games, first_id), results_file, pool, workers, report)
+                    results.extend(finished)
+                    played += len(finished)
+                    first_id += len(games)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return results, played, time.perf_counter() - start
+
+
+def _fit_ratings(agents, games):
+    """Fits Bradley-Terry strengths to a list of (white, black, score for white) games and returns the Elo ratings of
+    the agents, with the average at AVERAGE_ELO. Draws count as half a win for each side. Every agent also gets one
+    win and one loss against an imaginary average player, so that an agent that won (or lost) every game still gets a
+    finite rating."""
+    index = {agent: position for position, agent in enumerate(agents)}
+    count = len(agents)
+    points = [1.0] * count
+    pair_games = [[0] * count for _ in range(count)]
+    for white, black, score in games:
+        white_index, black_index = index[white], index[black]
+        points[white_index] += score
+        points[black_index] += 1 - score
+        pair_games[white_index][black_index] += 1
+        pair_games[black_index][white_index] += 1
+
+    # minorization-maximization updates of the strengths (the imaginary player has strength 1)
+    strengths = [1.0] * count
+    for _ in range(1000):
+        new_strengths = []
+        for agent_index in range(count):
+            strength = strengths[agent_index]
+            denominator = 2 / (strength + 1)
+            for other_index, games_played in enumerate(pair_games[agent_index]):
+                if games_played:
+                    denominator += games_played / (strength + strengths[other_index])
+            new_strengths.append(points[agent_index] / denominator)
+        change = max(abs(math.log(new / old)) for new, old in zip(new_strengths, strengths))
+        strengths = new_strengths
+        if change < 1e-9:
+            break
+
+    ratings = [400 * math.log10(strength) for strength in strengths]
+    shift = AVERAGE_ELO - sum(ratings) / count
+    return [rating + shift for rating in ratings]
+
+
+def elo_ratings(agents, results, samples=BOOTSTRAP_SAMPLES, seed=1):
+    """Takes the agents and the game results of a tournament, and returns a dictionary of agent: (Elo rating, low,
+    high), where low to high is the 95% confidence interval found by refitting the ratings to samples random
+    resamplings of the games."""
+    games = [(result["white"], result["black"], result["score"]) for result in results]
+    ratings = _fit_ratings(agents, games)
+    rng = random.Random(seed)
+    resampled = [[] for _ in agents]
+    if games:
+        for _ in range(samples):
+            for agent_index, rating in enumerate(_fit_ratings(agents, rng.choices(games, k=len(games)))):
+                resampled[agent_index].append(rating)
+    intervals = {}
+    for agent_index, agent in enumerate(agents):
+        values = sorted(resampled[agent_index]) or [ratings[agent_index]]
+        intervals[agent] = (ratings[agent_index], values[int(0.025 * (len(values) - 1))],
+                            values[int(math.ceil(0.975 * (len(values) - 1)))])
+    return intervals
+
+
+def standings(agents, results):
+    """Returns a list of (agent, games, points, Elo rating, low, high) sorted by rating, best first."""
+    games = {agent: 0 for agent in agents}
+    points = {agent: 0.0 for agent in agents}
+    for result in results:
+        games[result["white"]] += 1
+        games[result["black"]] += 1
+        points[result["white"]] += result["score"]
+        points[result["black"]] += 1 - result["score"]
+    ratings = elo_ratings(agents, results)
+    return sorted(((agent, games[agent], points[agent]) + ratings[agent] for agent in agents),
+                  key=lambda row: -row[3])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Plays a tournament between Kuba agents and rates them.")
+    parser.add_argument("--agents", nargs="+", required=True,
+                        help="agents to play: %s, or module:function" % ", ".join(sorted(AGENTS)))
+    parser.add_argument("--output", required=True, help="JSON lines file for the results (resumed if it exists)")
+    parser.add_argument("--games-per-pair", type=int, default=2, help="games each pairing plays")
+    parser.add_argument("--swiss", type=int, metavar="ROUNDS", help="play this many Swiss rounds, not round robin")
+    parser.add_argument("--time-ms", type=int, default=100, help="time limit per move in milliseconds")
+    parser.add_argument("--grace-ms", type=int, default=GRACE_MS, help="time a move may run over before it loses")
+    parser.add_argument("--max-moves", type=int, default=MAX_MOVES, help="moves before a game is a draw")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    arguments = parser.parse_args()
+
+    def print_result(game_result):
+        print("game %4d round %2d  %-10s %-10s %3s  %-9s %4d moves %7.2f s" % (
+            game_result["game"], game_result["round"], game_result["white"], game_result["black"],
+            {1.0: "1-0", 0.5: "1/2", 0.0: "0-1"}[game_result["score"]], game_result["reason"],
+            game_result["moves"], game_result["seconds"]))
+
+    all_results, games_played, elapsed = run_tournament(
+        arguments.agents, arguments.output, arguments.games_per_pair, arguments.swiss, arguments.time_ms,
+        arguments.grace_ms, arguments.max_moves, arguments.workers or os.cpu_count() or 1, arguments.seed,
+        print_result)
+
+    print()
+    print("%-24s %6s %7s %7s %16s" % ("agent", "games", "points", "elo", "95% interval"))
+    for name, agent_games, agent_points, elo, low, high in standings(arguments.agents, all_results):
+        print("%-24s %6d %7.1f %7.0f %7.0f to %5.0f" % (name, agent_games, agent_points, elo, low, high))
+    moves_played = sum(result["moves"] for result in all_results[len(all_results) - games_played:])
+    print("%d games played in %.1f s (%.2f games/s, %.0f moves/s)" % (
+        games_played, elapsed, games_played / elapsed if elapsed else 0.0, moves_played / elapsed if elapsed else 0.0))